@@ -0,0 +1,226 @@
+import asyncio
+import inspect
+from uop.connect.uop_connect import ConnectionWrapper
+from uopclient.state import ClientState, AssociatedTags, AssociatedGroups, Relationships
+from uopclient.stats import operation
+from uopclient.utils.lazy import LazyAssocs, is_pending
+
+
+class AsyncAssociated:
+    """
+    Coroutine forms of the ObjectAssociated fetches.  Database calls run in
+    worker threads through the state's concurrency limit while cache
+    updates happen on the event loop under the state's cache lock, so
+    independent fetches can be gathered without racing on the caches or
+    with writes running in worker threads.
+    """
+
+    async def afor_meta(self, meta_name):
+        if (meta_name not in self._by_meta) or is_pending(self._by_meta[meta_name]):
+            data = await self._state.single_flight(
+                ('meta', self._kind, meta_name), self.get_by_meta, meta_name)
+            async with self._state._cache_lock:
+                if (meta_name not in self._by_meta) or is_pending(self._by_meta[meta_name]):
+                    return self._set_meta(meta_name, data)
+        return self._by_meta[meta_name]
+
+    async def afor_object(self, object_id, persisted=None):
+        """
+        :param persisted: whether object_id is in the database, looked up
+        from the state when None
+        """
+        if object_id not in self._by_object:
+            if persisted is None:
+                if object_id in self._state._objects:
+                    persisted = self.object_persisted(object_id)
+                else:  # read off the loop
+                    persisted = (await self._state.aget_object(object_id)) is not None
+            if not persisted:
+                async with self._state._cache_lock:
+                    return self.for_object(object_id)
+            found = await self._state.single_flight(
+                ('object', self._kind, object_id), self.db_object_associated, object_id)
+            async with self._state._cache_lock:
+                if object_id not in self._by_object:
+                    return self._set_object(object_id, self.object_entry(object_id, found))
+        return self._by_object[object_id]
+
+    async def aload_members(self, object_id, names=None, persisted=None):
+        """
+        afor_object with the member sets of names, all its names if None,
+        fetched off the loop, so reading them from the mapping returned
+        does not call the database on the loop.
+        """
+        used = await self.afor_object(object_id, persisted)
+        if isinstance(used, LazyAssocs):
+            names = [n for n in (list(used) if names is None else names)
+                     if (n in used) and (n not in used.loaded())]
+            await asyncio.gather(*(self.afor_meta(n) for n in names))
+            async with self._state._cache_lock:
+                for name in names:
+                    used[name]  # computed from the cached member set
+        return used
+
+    async def amember_value(self, object_id, name):
+        "value of name in the _by_object mapping of object_id, fetched off the loop"
+        used = await self.aload_members(object_id, [name])
+        return used[name]
+
+    async def aload_objects(self, oids):
+        "async load_objects: one batched fetch for all of oids not yet cached"
+        wanted = [oid for oid in oids if oid not in self._by_object]
+        if not wanted:
+            return
+        found = await self._state.run(self.db_objects_associated, wanted)
+        async with self._state._cache_lock:
+            for oid in wanted:
+                if oid not in self._by_object:
+                    self._set_object(oid, self.object_entry(oid, found.get(oid, ())))
+
+
+class AsyncTags(AsyncAssociated, AssociatedTags):
+    pass
+
+
+class AsyncGroups(AsyncAssociated, AssociatedGroups):
+    pass
+
+
+class AsyncRelationships(AsyncAssociated, Relationships):
+    pass
+
+
+class AsyncClientState(ClientState):
+    """
+    ClientState for use from an asyncio event loop.  The a* methods never
+    block the loop on the database: calls run in worker threads, at most
+    concurrency of them at once, and concurrent requests for the same
+    data share one fetch.  Writes are serialized and run in worker threads
+    holding the cache lock, which the a* reads also take to fill the
+    caches, so fills never interleave with a write.
+    Build with `await AsyncClientState.create(connect)` so the initial
+    metadata load does not block the loop either.
+    With threaded=False calls are made on the loop itself, for connections
+    that are coroutine based or cannot be used from other threads.
+    """
+    tags_class = AsyncTags
+    groups_class = AsyncGroups
+    roles_class = AsyncRelationships
+
+    def __init__(self, connect: ConnectionWrapper, concurrency=8, threaded=True, **kwargs):
+        self._limit = asyncio.Semaphore(concurrency)
+        self._threaded = threaded
+        self._in_flight = {}
+        self._cache_lock = asyncio.Lock()
+        super().__init__(connect, **kwargs)
+
+    @classmethod
+    async def create(cls, connect: ConnectionWrapper, concurrency=8, threaded=True, **kwargs):
+        if not threaded:
+            return cls(connect, concurrency, threaded, **kwargs)
+        return await asyncio.to_thread(cls, connect, concurrency, threaded, **kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        "run blocking fn in a worker thread within the concurrency limit"
+        async with self._limit:
+            if self._threaded:
+                res = await asyncio.to_thread(fn, *args, **kwargs)
+            else:
+                res = fn(*args, **kwargs)
+            if inspect.isawaitable(res):
+                res = await res
+        return res
+
+    async def single_flight(self, key, fn, *args):
+        "run fn once for all concurrent callers asking for the same key"
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.run(fn, *args))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+    @operation()
+    async def aget_object(self, oid):
+        known = self._objects.get(oid)
+        if not known:
+            known = await self.single_flight(('objects', oid), self._connect.get_object, oid)
+            async with self._cache_lock:
+                if known and (oid not in self._objects):
+                    self._cache_object(oid, known)
+                known = self._objects.get(oid) or known
+        return known
+
+    @operation()
+    async def aget_object_and_associations(self, oid):
+        """
+        Object and its tags, groups and roles fetched concurrently, with the
+        member sets of its tags and groups so reading them does not block.
+        """
+        persisted = self.is_persisted('objects', oid) if oid in self._objects else True
+        object, tags, groups, roles = await asyncio.gather(
+            self.aget_object(oid),
+            self.tags.aload_members(oid, persisted=persisted),
+            self.groups.aload_members(oid, persisted=persisted),
+            self.roles.aload_members(oid, persisted=persisted))
+        return object, dict(tags=tags, groups=groups, roles=roles)
+
+    @operation()
+    async def aload_objects(self, oids):
+        """
+        Async prefetch_objects: the objects and each kind of association for
+        all missing oids are fetched concurrently as batches.
+        """
+        missing = [oid for oid in dict.fromkeys(oids) if oid not in self._objects]
+        if not missing:
+            return
+        objects, *_ = await asyncio.gather(
+            self.run(self.db_get_objects, missing),
+            self.tags.aload_objects(missing),
+            self.groups.aload_objects(missing),
+            self.roles.aload_objects(missing))
+        async with self._cache_lock:
+            for obj in objects:
+                if obj and (obj['id'] not in self._objects):
+                    self._cache_object(obj['id'], obj)
+
+    async def atagged_objects(self, name):
+        return await self.tags.afor_meta(name)
+
+    async def agrouped_objects(self, name):
+        return await self.groups.afor_meta(name)
+
+    async def arelated_objects(self, name):
+        return await self.roles.afor_meta(name)
+
+    async def write(self, fn, *args):
+        "run a state changing call in a worker thread, one at a time and never during a cache fill"
+        async with self._cache_lock:
+            return await self.run(fn, *args)
+
+    async def abegin_transaction(self):
+        await self.write(self.begin_transaction)
+
+    async def acommit(self):
+        await self.write(self.commit)
+
+    async def aabort(self):
+        await self.write(self.abort)
+
+    async def atag(self, oid, name):
+        await self.write(self.tag, oid, name)
+
+    async def auntag(self, oid, name):
+        await self.write(self.untag, oid, name)
+
+    async def agroup(self, oid, name):
+        await self.write(self.group, oid, name)
+
+    async def aungroup(self, oid, name):
+        await self.write(self.ungroup, oid, name)
+
+    async def arelate(self, oid, name, other_id):
+        await self.write(self.relate, oid, name, other_id)
+
+    async def aunrelate(self, oid, name, other_id):
+        await self.write(self.unrelate, oid, name, other_id)
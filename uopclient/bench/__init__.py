@@ -0,0 +1,7 @@
+"""
+Benchmarks of ClientState operations on generated datasets.
+
+Run with `python -m uopclient.bench --scales 1000,10000` for JSON results
+per scale: seconds, peak traced memory and database calls of each
+timed operation.
+"""
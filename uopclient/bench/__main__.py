@@ -0,0 +1,57 @@
+from uop.connect.uop_connect import register_adaptor, ConnectionWrapper
+from uop.connect import direct
+from uopclient.bench.dataset import DatasetSpec
+from uopclient.bench.runner import run_scale, environment
+import argparse
+import asyncio
+import json
+import sys
+import uuid
+
+
+async def connect_sqlite(db_name):
+    from sqluop import adaptor
+    register_adaptor(adaptor.AlchemyDatabase, 'sqlite')
+    wrapper = ConnectionWrapper()
+    wrapper.set_connection(await direct.DirectConnection.get_connection('sqlite', db_name))
+    return wrapper
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m uopclient.bench',
+                                     description='benchmark ClientState on generated datasets')
+    parser.add_argument('--scales', default='1000,10000,100000',
+                        help='comma separated numbers of objects')
+    parser.add_argument('--sample', type=int, default=100,
+                        help='objects used for single object operations')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db-prefix', default='uopbench',
+                        help='each scale is built in a new database named '
+                             '<prefix>_<scale>_<seed>_<run id>')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip tracemalloc, which slows the timed operations')
+    parser.add_argument('--output', help='file for the JSON results, stdout if not given')
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    results = dict(environment=environment(), scales=[])
+    run_id = uuid.uuid4().hex[:8]  # never reuse, and so measure, a database of an earlier run
+    for scale in (int(s) for s in args.scales.split(',')):
+        db_name = f'{args.db_prefix}_{scale}_{args.seed}_{run_id}'
+        connect = await connect_sqlite(db_name)
+        spec = DatasetSpec(scale, seed=args.seed)
+        result = run_scale(connect, spec, args.sample, not args.no_memory)
+        result['database'] = db_name
+        results['scales'].append(result)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
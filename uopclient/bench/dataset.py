@@ -0,0 +1,61 @@
+import random
+
+
+class DatasetSpec:
+    """
+    Size of a generated dataset.  Metas scale with the number of objects
+    unless given.
+    """
+
+    def __init__(self, objects, tags=None, groups=None, roles=None,
+                 assocs_per_object=3, seed=1, cls_name='DescribedComponent'):
+        self.objects = objects
+        self.tags = tags or max(objects // 50, 4)
+        self.groups = groups or max(objects // 100, 4)
+        self.roles = roles or max(objects // 1000, 2)
+        self.assocs_per_object = assocs_per_object
+        self.seed = seed
+        self.cls_name = cls_name
+
+    def tag_names(self):
+        return [f'bench_tag_{i}' for i in range(self.tags)]
+
+    def group_names(self):
+        return [f'bench_group_{i}' for i in range(self.groups)]
+
+    def role_names(self):
+        return [f'bench_role_{i}' for i in range(self.roles)]
+
+    def as_dict(self):
+        return dict(objects=self.objects, tags=self.tags, groups=self.groups,
+                    roles=self.roles, assocs_per_object=self.assocs_per_object,
+                    seed=self.seed, cls_name=self.cls_name)
+
+
+def build_dataset(state, spec: DatasetSpec, batch=1000):
+    """
+    Persist spec.objects new objects, each with about assocs_per_object
+    tags, groups and relationships, through state.  Each batch of objects
+    is its own transaction.
+    :return: ids of the objects created
+    """
+    rnd = random.Random(spec.seed)
+    tags, groups, roles = spec.tag_names(), spec.group_names(), spec.role_names()
+    state.begin_transaction()
+    for names, assoc in ((tags, state.tags), (groups, state.groups), (roles, state.roles)):
+        for name in names:
+            assoc.ensure_meta(name)
+    state.commit()
+    oids = []
+    for start in range(0, spec.objects, batch):
+        state.begin_transaction()
+        created = [state.create_class_instance(spec.cls_name)['id']
+                   for _ in range(min(batch, spec.objects - start))]
+        oids.extend(created)
+        for oid in created:
+            for _ in range(spec.assocs_per_object):
+                state.tag(oid, rnd.choice(tags))
+                state.group(oid, rnd.choice(groups))
+                state.relate(oid, rnd.choice(roles), rnd.choice(oids))
+        state.commit()
+    return oids
@@ -0,0 +1,107 @@
+from uopclient.bench.dataset import DatasetSpec, build_dataset
+from uopclient.state import ClientState
+from uopclient.stats import Stats
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+
+class Measure:
+    """
+    Times the block and, when memory is traced, its peak allocation.
+    Database calls recorded by stats during the block are counted.
+    """
+
+    def __init__(self, results, name, stats=None, ops=1, memory=True):
+        self._results = results
+        self._name = name
+        self._stats = stats
+        self._ops = ops
+        self._memory = memory
+
+    def _calls(self):
+        return sum(self._stats.call_counts().values()) if self._stats else 0
+
+    def __enter__(self):
+        if self._memory:
+            tracemalloc.start()
+        self._calls_before = self._calls()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._start
+        res = dict(seconds=elapsed, ops=self._ops,
+                   ops_per_second=self._ops / elapsed if elapsed else None,
+                   db_calls=self._calls() - self._calls_before)
+        if self._memory:
+            res['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self._results[self._name] = res
+        return False
+
+
+def bench_state(connect, oids, spec, sample=100, memory=True, state_class=ClientState):
+    """
+    Time the main ClientState operations against a dataset.
+    :param oids: ids of the dataset's objects
+    :param sample: number of objects single object operations are run on
+    :return: operation name -> measurement
+    """
+    rnd = random.Random(spec.seed)
+    picked = rnd.sample(oids, min(sample, len(oids)))
+    results = {}
+    measure = lambda name, ops=1: Measure(results, name, stats, ops, memory)
+
+    stats = Stats()
+    state = state_class(connect, stats=stats)
+    with measure('load_objects', len(oids)):
+        state.load_objects(oids)
+
+    stats = Stats()
+    state = state_class(connect, stats=stats)
+    with measure('get_object_and_associations.cold', len(picked)):
+        for oid in picked:
+            state.get_object_and_associations(oid)
+    with measure('get_object_and_associations.warm', len(picked)):
+        for oid in picked:
+            state.get_object_and_associations(oid)
+
+    state.begin_transaction()
+    tags, groups, roles = spec.tag_names(), spec.group_names(), spec.role_names()
+    with measure('tag', len(picked)):
+        for oid in picked:
+            state.tag(oid, rnd.choice(tags))
+    with measure('group', len(picked)):
+        for oid in picked:
+            state.group(oid, rnd.choice(groups))
+    with measure('relate', len(picked)):
+        for oid in picked:
+            state.relate(oid, rnd.choice(roles), rnd.choice(oids))
+    for oid in picked:
+        state.get_object(oid)['description'] = 'benchmarked'
+    with measure('has_changes', 1):
+        state.has_changes
+    doomed = picked[:max(len(picked) // 10, 1)]
+    with measure('delete_object', len(doomed)):
+        for oid in doomed:
+            state.delete_object(oid)
+    with measure('commit', len(picked)):
+        state.commit()
+    return results
+
+
+def environment():
+    return dict(python=sys.version.split()[0], implementation=platform.python_implementation(),
+                platform=platform.platform())
+
+
+def run_scale(connect, spec: DatasetSpec, sample=100, memory=True):
+    "build the dataset for spec on connect and benchmark it"
+    started = time.perf_counter()
+    oids = build_dataset(ClientState(connect), spec)
+    build_seconds = time.perf_counter() - started
+    return dict(dataset=spec.as_dict(), build_seconds=build_seconds,
+                operations=bench_state(connect, oids, spec, sample, memory))
@@ -0,0 +1,112 @@
+"""
+Traversals of the relationship graph held by a ClientState's roles cache:
+k-hop neighborhoods, shortest paths and walks along given role names.
+
+Each level of a traversal is fetched with one batched load_objects call
+for the frontier oids not yet cached, so exploring costs a round trip per
+level rather than per node.  Role names may be forward or reverse names;
+without names every relationship is followed in both directions.
+"""
+
+
+def inverse_names(roles, names):
+    "names to follow from the other end of relationships of names"
+    res = set()
+    for name in names:
+        forward, reverse = roles.meta_names(name)
+        res.add(reverse if name == forward else forward)
+    return res
+
+
+def expand(roles, frontier, names=None):
+    "oid -> oids related to it by any of names, for each oid of frontier"
+    roles.load_objects(frontier)
+    res = {}
+    for oid in frontier:
+        related = set()
+        for name, oids in roles.for_object(oid).items():
+            if (names is None) or (name in names):
+                related.update(oids)
+        res[oid] = related
+    return res
+
+
+def neighborhood(roles, start, k=1, names=None):
+    "oid -> hops from start for all oids within k hops of start"
+    names = set(names) if names else None
+    seen = {start: 0}
+    frontier = [start]
+    for depth in range(1, k + 1):
+        if not frontier:
+            break
+        found = expand(roles, frontier, names)
+        frontier = []
+        for related in found.values():
+            for oid in related:
+                if oid not in seen:
+                    seen[oid] = depth
+                    frontier.append(oid)
+    return seen
+
+
+def walk(roles, start, path):
+    "oids reached from start, an oid or oids, following one role name per step"
+    current = set(start) if isinstance(start, (set, frozenset, list, tuple)) else {start}
+    for name in path:
+        if not current:
+            break
+        current = set().union(*expand(roles, current, {name}).values())
+    return current
+
+
+def _advance(roles, frontier, names, seen, other_seen):
+    """
+    Expand frontier a level, recording (parent, depth) of new oids in seen.
+    Returns the next frontier and the new oid closest to the other side's
+    start among those the other side has seen, if any.
+    """
+    nxt = []
+    meet = None
+    for oid, related in expand(roles, frontier, names).items():
+        depth = seen[oid][1] + 1
+        for other in related:
+            if other in seen:
+                continue
+            seen[other] = (oid, depth)
+            nxt.append(other)
+            if (other in other_seen) and \
+                    ((meet is None) or (other_seen[other][1] < other_seen[meet][1])):
+                meet = other
+    return nxt, meet
+
+
+def _path_to(oid, seen):
+    res = []
+    while oid is not None:
+        res.append(oid)
+        oid = seen[oid][0]
+    return res
+
+
+def shortest_path(roles, source, target, names=None, max_hops=None):
+    """
+    Oids along a shortest chain of relationships from source to target,
+    both included, or None if there is none within max_hops.  Bidirectional
+    BFS growing the smaller frontier one level at a time.
+    """
+    if source == target:
+        return [source]
+    names = set(names) if names else None
+    back_names = inverse_names(roles, names) if names else None
+    forward, backward = {source: (None, 0)}, {target: (None, 0)}
+    front, back = [source], [target]
+    hops = 0
+    while front and back and ((max_hops is None) or (hops < max_hops)):
+        hops += 1
+        if len(front) <= len(back):
+            front, meet = _advance(roles, front, names, forward, backward)
+        else:
+            back, meet = _advance(roles, back, back_names, backward, forward)
+        if meet is not None:
+            return list(reversed(_path_to(meet, forward))) + _path_to(meet, backward)[1:]
+    return None
@@ -1,107 +1,322 @@
-from collections import defaultdict, deque
-import json
+from collections import defaultdict
+from html.parser import HTMLParser
+from sjautils import decorations
+from uopclient.state import ClientState
+from uopclient.utils.jsonstream import iter_events, START_MAP, END_MAP, START_ARRAY, \
+    END_ARRAY, KEY, VALUE
+from uopclient.utils.lru import CacheLimits
+from uopclient.loaders.urls import UrlIndex
 
+SKIPPED_SCHEMES = ('place:', 'javascript:', 'data:')
 
-class JSONLoader:
-    def __init__(self, path, *filters):
+
+class BookmarkRecord:
+    """
+    One bookmark: folder titles from the top down, url, title, add date
+    in epoch seconds and the bookmark's own tags.
+    """
+    __slots__ = ('path', 'url', 'title', 'add_date', 'tags')
+
+    def __init__(self, path, url, title=None, add_date=None, tags=()):
+        self.path = tuple(path)
+        self.url = url
+        self.title = title
+        self.add_date = add_date
+        self.tags = list(tags)
+
+    def __repr__(self):
+        return f'BookmarkRecord({"/".join(self.path)!r}, {self.url!r}, {self.title!r})'
+
+
+def merge_prefixes(path, prefixes):
+    """
+    path without the longest of prefixes it starts with, so the folders
+    under a prefix are merged into the top level.
+    """
+    for prefix in sorted(prefixes, key=len, reverse=True):
+        if tuple(path[:len(prefix)]) == tuple(prefix):
+            return tuple(path[len(prefix):])
+    return tuple(path)
+
+
+def skipped_title(title):
+    "folders and bookmarks left out of imports: earlier imports' folders"
+    return bool(title) and title.startswith('Imported ')
+
+
+def iter_json_bookmarks(f, chunk_size=1 << 16):
+    """
+    BookmarkRecord for each bookmark of a Firefox JSON bookmark backup read
+    incrementally from text file f.  Only the open folders are held.
+    """
+    path = []
+    frames = []  # per open container, see below
+    for event, value in iter_events(f, chunk_size):
+        top = frames[-1] if frames else None
+        if event == START_MAP:
+            # maps that are the root or in a children array are bookmark nodes
+            is_node = (top is None) or top.get('children', False)
+            skip = bool(top) and top.get('skip', False)
+            frames.append(dict(node=is_node, fields={}, key=None, skip=skip))
+        elif event == KEY:
+            top['key'] = value
+        elif event == VALUE:
+            if top.get('node') and (top['key'] is not None):
+                top['fields'][top['key']] = value
+        elif event == START_ARRAY:
+            is_children = bool(top) and top.get('node', False) and (top['key'] == 'children')
+            frame = dict(children=is_children, pushed=False)
+            if is_children:
+                title = top['fields'].get('title')
+                frame['skip'] = top['skip'] or skipped_title(title)
+                if title and not frame['skip']:
+                    path.append(title)
+                    frame['pushed'] = True
+            frames.append(frame)
+        elif event == END_ARRAY:
+            if frames.pop()['pushed']:
+                path.pop()
+        elif event == END_MAP:
+            frame = frames.pop()
+            fields = frame['fields']
+            url = fields.get('uri')
+            if frame['node'] and url and not (frame['skip'] or skipped_title(fields.get('title'))):
+                if not url.startswith(SKIPPED_SCHEMES):
+                    added = fields.get('dateAdded')
+                    tags = [t for t in (fields.get('tags') or '').split(',') if t]
+                    yield BookmarkRecord(path, url, fields.get('title'),
+                                         added // 1000000 if added else None, tags)
+
+
+class NetscapeBookmarkParser(HTMLParser):
+    """
+    Incremental parser of Netscape bookmark files: <DT><H3> folder titles
+    each followed by a <DL> of their contents and <DT><A> bookmarks.
+    Records found so far are taken with take().
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._folders = []  # per open <DL>: its folder title or None
+        self._next_folder = None
+        self._text = None  # text of the open <A> or <H3>
+        self._link = None
+        self._found = []
+
+    def _path(self):
+        return [t for t in self._folders if t]
+
+    def _skipping(self):
+        return any(skipped_title(t) for t in self._folders)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'dl':
+            self._folders.append(self._next_folder)
+            self._next_folder = None
+        elif tag == 'h3':
+            self._text = []
+        elif tag == 'a':
+            self._text = []
+            self._link = dict(attrs)
+
+    def handle_endtag(self, tag):
+        if tag == 'dl':
+            if self._folders:
+                self._folders.pop()
+        elif (tag == 'h3') and (self._text is not None):
+            self._next_folder = ''.join(self._text).strip()
+            self._text = None
+        elif (tag == 'a') and (self._link is not None):
+            self._add_link(''.join(self._text or ()).strip())
+            self._text = self._link = None
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def _add_link(self, title):
+        link = self._link
+        url = link.get('href')
+        if (not url) or url.startswith(SKIPPED_SCHEMES) or self._skipping() or \
+                skipped_title(title):
+            return
+        added = link.get('add_date')
+        tags = [t for t in (link.get('tags') or '').split(',') if t]
+        self._found.append(BookmarkRecord(self._path(), url, title or None,
+                                          int(added) if added and added.isdigit() else None,
+                                          tags))
+
+    def take(self):
+        found, self._found = self._found, []
+        return found
+
+
+def iter_html_bookmarks(f, chunk_size=1 << 16):
+    """
+    BookmarkRecord for each bookmark of a Netscape bookmark file read
+    incrementally from text file f.
+    """
+    parser = NetscapeBookmarkParser()
+    for chunk in iter(lambda: f.read(chunk_size), ''):
+        parser.feed(chunk)
+        yield from parser.take()
+    parser.close()
+    yield from parser.take()
+
+
+class BookmarkImporter:
+    """
+    Creates an object for each bookmark record and groups, or tags, it by
+    its folder path.  Records are written a batch per transaction with
+    one group_many and tag_many each; given a connection rather than a ClientState
+    the importer uses a state whose caches are bounded by the batch size.
+    Committing releases the unfetched member sets the batch added to, so
+    memory grows with the number of folders and tags, not of bookmarks.
+    With a url_index records whose normalized url is already in it, or
+    earlier in the import, are skipped.
+    """
+
+    def __init__(self, target, cls_name='DescribedComponent', folders_as='groups',
+                 batch_size=500, object_fields=None, folder_name=None,
+                 url_field='description', url_index: UrlIndex = None):
+        """
+        :param target: ClientState or ConnectionWrapper to import into
+        :param folders_as: 'groups' or 'tags', how folder paths are recorded
+        :param object_fields: record -> data of its new object
+        :param folder_name: folder path -> group or tag name
+        :param url_field: object field holding the url
+        :param url_index: UrlIndex of urls already present, see prime_urls
+        """
+        if not isinstance(target, ClientState):
+            limits = CacheLimits(max_entries=batch_size)
+            target = ClientState(target, object_limits=limits, assoc_limits=limits)
+        self._state = target
+        self._cls_name = cls_name
+        self._folders_as = folders_as
+        self._batch_size = batch_size
+        self._url_field = url_field
+        self._object_fields = object_fields or self.default_fields
+        self._folder_name = folder_name or '/'.join
+        self._url_index = url_index
+        self._pending = []
+        self.created = 0
+        self.duplicates = 0
+        self.batches = 0
+
+    def default_fields(self, record):
+        return {'name': record.title or record.url, self._url_field: record.url}
+
+    def prime_urls(self, objects, capacity=1000000):
+        """
+        Use a UrlIndex of the urls of objects, the existing instances of the
+        importer's class as read by the caller, to skip bookmarks already
+        present.
+        :param objects: iterable of object records, read in one pass
+        """
+        self._url_index = UrlIndex(capacity)
+        self._url_index.prime(objects, lambda obj: obj.get(self._url_field))
+        return self._url_index
+
+    @property
+    def state(self):
+        return self._state
+
+    def add(self, record):
+        if (self._url_index is not None) and not self._url_index.add(record.url):
+            self.duplicates += 1
+            return
+        self._pending.append(record)
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        "write the pending records as one transaction"
+        records, self._pending = self._pending, []
+        if not records:
+            return
+        state = self._state
+        state.begin_transaction()
+        folders, tags = [], []
+        for record in records:
+            obj = state.create_class_instance(self._cls_name, **self._object_fields(record))
+            if record.path:
+                folders.append((obj['id'], self._folder_name(record.path)))
+            tags.extend((obj['id'], tag) for tag in record.tags)
+        if self._folders_as == 'tags':
+            tags.extend(folders)
+        else:
+            state.group_many(folders)
+        state.tag_many(tags)
+        state.commit()
+        self.created += len(records)
+        self.batches += 1
+
+    def run(self, records):
+        "import all of records, returns the number of objects created"
+        for record in records:
+            self.add(record)
+        self.flush()
+        return self.created
+
+
+class BookmarkLoader:
+    """
+    Bookmark export at path, read as a stream of BookmarkRecords.
+    :param filters: folder title paths whose contents are merged into the
+    top level, e.g. ('Bookmarks Menu',)
+    """
+
+    def __init__(self, path, *filters, chunk_size=1 << 16):
         self._path = path
-        with open(path) as f:
-            self._data = json.load(f)
-        self._by_title = self.by_title()
-        self.prefix_merge_titles(self._by_title, filters)
-        self._by_url = self.by_url()
-
-    def prefix_merge_titles(self, filters):
-        grouping = defaultdict(list)
-        ordered = []
-        for f in filters:
-            grouping[filter[0]].append(filter)
-        for group, g_filters in grouping.items():
-            if len(g_filters) > 1:
-                s_order = sorted(g_filters, key=lambda g: len(g))[::-1]
-                for f in s_order:
-                    ordered.append(f)
-            else:
-                ordered.append(g_filters)
-        def heal_dict(the_keys, rest):
-            the_dict = rest
-            for key in the_keys[::-1]:
-                rest = {key: rest}
-            self._by_title.update(rest)
-
-
-        to_merge = []
-        for f in ordered:
-            working = self._by_title
-            keys = []
-            for k in f[:-1]:
-                working = working.get(k, None)
-                if not next:
-                    break
-            if working:
-                working = working.pop(f[-1], None)
-                if working:
-                    self._by_title.update(working)
-
-
-    def load(self, dbi):
+        self._filters = [tuple(f) for f in filters]
+        self._chunk_size = chunk_size
+
+    @decorations.abstract
+    def iter_records(self, f):
+        "records of the export in open file f"
         pass
 
+    def records(self):
+        with open(self._path, encoding='utf-8') as f:
+            for record in self.iter_records(f):
+                record.path = merge_prefixes(record.path, self._filters)
+                yield record
+
+    def load(self, target, **kwargs):
+        """
+        Import into target, a ClientState or ConnectionWrapper.
+        :param kwargs: BookmarkImporter options
+        :return: number of objects created
+        """
+        return BookmarkImporter(target, **kwargs).run(self.records())
+
     def by_title(self):
-        "index by title for items that have children"
+        "nested dict of folder titles down to bookmark title -> record"
         res = {}
-
-        def handle_one(item, in_dict):
-            title = item.get('title')
-            children = item.get('children')
-            if title.startswith('Imported '):
-                return
-            if children:
-                contents = {}
-                for child in children:
-                    handle_one(child, contents)
-                in_dict[title] = contents
-            elif 'uri' in item:
-                in_dict[title] = item
-
-        handle_one(self._data, res)
+        for record in self.records():
+            contents = res
+            for title in record.path:
+                contents = contents.setdefault(title, {})
+            contents[record.title] = record
         return res
 
     def by_url(self):
         "url based dict of title paths"
         res = defaultdict(list)
-        path = deque()
-
-        def walk_path(data):
-            def wrapped_walk(last):
-                path.append(k)
-                walk_path(v)
-                path.pop(k)
-
-            uri = data.get('uri')
-            if uri:
-                res[uri].append('/'.join(path))
-            else:
-                for k, v in data.items():
-
-                    tc = v.get('typeCode')
-                    if tc and tc > 1:
-                        continue  # empty container
-                    if (v.get('uri')):
-                        walk_path(v)
-                    else:
-                        path.append(k)
-                        walk_path(v)
-                        path.pop()
-
-        walk_path(self._by_title)
+        for record in self.records():
+            res[record.url].append('/'.join(record.path))
         return res
 
 
-class HTMLLoader:
-    def __init__(self, path):
-        self._path = path
-        with open(path) as f:
-            self._data = f.read()\
+class JSONLoader(BookmarkLoader):
+    "Firefox JSON bookmark backup"
+
+    def iter_records(self, f):
+        return iter_json_bookmarks(f, self._chunk_size)
+
 
+class HTMLLoader(BookmarkLoader):
+    "Netscape bookmark file as exported by Chrome, Safari, Edge and Firefox"
 
+    def iter_records(self, f):
+        return iter_html_bookmarks(f, self._chunk_size)
@@ -0,0 +1,346 @@
+"""
+Boolean expressions over tag, group and role membership evaluated
+against a ClientState's association caches.
+
+    (tag('a') & tag('b')) - group('c') | role('author_of')
+
+Terms not yet cached are fetched together before evaluation: one query
+for the groups and one for the roles, and one for the tags where the
+connection has get_tagsets, else one get_tagset per tag.  Intersections run smallest set first and results are
+evaluated lazily and paged.
+
+as_data and from_data convert expressions to and from the plain data
+saved queries store.  ResultCache keeps saved query results until an
+association they read changes.
+"""
+from collections import defaultdict
+from collections.abc import Mapping
+from sjautils import decorations
+from uopclient.stats import operation
+from uopclient.utils.oidset import OidSet
+from uopclient.utils.lazy import materialized
+
+
+class Expr:
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def __sub__(self, other):
+        return And(self, Not(other))
+
+    @decorations.abstract
+    def terms(self):
+        "all Terms in the expression"
+        pass
+
+
+class Term(Expr):
+    """
+    Objects with an association.  kind is tags, groups or roles.  For roles
+    subject gives the objects related to subject by the role; without it
+    the objects having the role at all.
+    """
+
+    def __init__(self, kind, name, subject=None):
+        self.kind = kind
+        self.name = name
+        self.subject = subject
+
+    def _key(self):
+        return self.kind, self.name, self.subject
+
+    def __eq__(self, other):
+        return isinstance(other, Term) and (self._key() == other._key())
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def terms(self):
+        yield self
+
+    def __repr__(self):
+        subject = f', {self.subject!r}' if self.subject else ''
+        return f'{self.kind}({self.name!r}{subject})'
+
+
+def tag(name):
+    return Term('tags', name)
+
+
+def group(name):
+    return Term('groups', name)
+
+
+def role(name, subject=None):
+    return Term('roles', name, subject)
+
+
+class _Combined(Expr):
+    op = ''
+
+    def __init__(self, *parts):
+        self.parts = []
+        for part in parts:
+            if type(part) is type(self):
+                self.parts.extend(part.parts)
+            else:
+                self.parts.append(part)
+
+    def terms(self):
+        for part in self.parts:
+            yield from part.terms()
+
+    def __repr__(self):
+        return '(' + f' {self.op} '.join(repr(p) for p in self.parts) + ')'
+
+
+class And(_Combined):
+    op = '&'
+
+
+class Or(_Combined):
+    op = '|'
+
+
+class Not(Expr):
+    def __init__(self, part):
+        self.part = part
+
+    def terms(self):
+        return self.part.terms()
+
+    def __repr__(self):
+        return f'~{self.part!r}'
+
+
+_COMBINERS = {'and': And, 'or': Or}
+
+
+def as_data(expr):
+    "expr as plain lists and dicts for storing in a saved query"
+    if isinstance(expr, Term):
+        res = {expr.kind: expr.name}
+        if expr.subject:
+            res['subject'] = expr.subject
+        return res
+    if isinstance(expr, Not):
+        return {'not': as_data(expr.part)}
+    op = 'and' if isinstance(expr, And) else 'or'
+    return {op: [as_data(p) for p in expr.parts]}
+
+
+def from_data(data):
+    "expression stored by as_data"
+    if not isinstance(data, Mapping):
+        raise ValueError(f'not a stored query expression: {data!r}')
+    for kind in ('tags', 'groups', 'roles'):
+        if kind in data:
+            return Term(kind, data[kind], data.get('subject'))
+    if 'not' in data:
+        return Not(from_data(data['not']))
+    for op, combined in _COMBINERS.items():
+        if op in data:
+            return combined(*(from_data(p) for p in data[op]))
+    raise ValueError(f'not a stored query expression: {data!r}')
+
+
+def dependencies(expr):
+    "(kind, name) of every association expr reads"
+    return {(t.kind, t.name) for t in expr.terms()}
+
+
+def fetch_terms(state, terms):
+    "Term -> member oids, loading uncached terms with one load_metas per kind"
+    by_kind = defaultdict(list)
+    for term in terms:
+        by_kind[term.kind].append(term)
+    res = {}
+    for kind in ('tags', 'groups'):
+        assoc = getattr(state, kind)
+        assoc.load_metas(t.name for t in by_kind[kind])
+        for term in by_kind[kind]:
+            known = assoc.get_meta(term.name)
+            res[term] = materialized(assoc.for_meta(term.name)) if known else set()
+    whole = [t.name for t in by_kind['roles'] if not t.subject]
+    members = state.roles.db_role_members(whole) if whole else {}
+    for term in by_kind['roles']:
+        if term.subject:
+            known = state.roles.get_meta(term.name)
+            res[term] = state.roles.related_to(term.name, term.subject) if known else set()
+        else:
+            res[term] = members[term.name]
+    return res
+
+
+def intersect(sets):
+    "intersection of sets, smallest first"
+    sets = sorted(sets, key=len)
+    if not sets or not sets[0]:
+        return set()
+    first, rest = sets[0], sets[1:]
+    if isinstance(first, OidSet) and all(first._same(s) for s in rest):
+        res = first
+        for other in rest:
+            res = res & other
+        return res
+    return {oid for oid in first if all(oid in s for s in rest)}
+
+
+def evaluate(expr, members, universe=None):
+    """
+    Oids matching expr.
+    :param members: Term -> member oids for every term in expr
+    :param universe: oids negations are taken against when nothing positive
+    limits them
+    """
+    if isinstance(expr, Term):
+        return members[expr]
+    if isinstance(expr, Or):
+        return set().union(*(evaluate(p, members, universe) for p in expr.parts))
+    parts = expr.parts if isinstance(expr, And) else [expr]
+    positive = [p for p in parts if not isinstance(p, Not)]
+    negative = [p.part for p in parts if isinstance(p, Not)]
+    if positive:
+        res = intersect([evaluate(p, members, universe) for p in positive])
+    elif universe is not None:
+        res = universe
+    else:
+        raise ValueError(f'{expr!r} has only negations; give within to negate against')
+    for part in negative:
+        if not res:
+            break
+        excluded = evaluate(part, members, universe)
+        res = {oid for oid in res if oid not in excluded}
+    return res
+
+
+class QueryResult:
+    """
+    Oids matching an expression, evaluated on first use and iterated in
+    sorted order so pages are stable.
+    """
+
+    def __init__(self, state, expr, within=None, key=None):
+        self._state = state
+        self._expr = expr
+        self._within = within
+        self._key = key
+        self._members = None
+        self._ordered = None
+
+    @property
+    def _stats(self):
+        return self._state._stats
+
+    @operation('query')
+    def _evaluate(self):
+        within = None if self._within is None else set(self._within)
+        members = fetch_terms(self._state, set(self._expr.terms()))
+        res = evaluate(self._expr, members, within)
+        if within is not None:
+            res = {oid for oid in res if oid in within}
+        elif any(res is cached for cached in members.values()):
+            res = res.copy()
+        return res
+
+    def members(self):
+        if self._members is None:
+            self._members = self._evaluate()
+        return self._members
+
+    def ids(self):
+        if self._ordered is None:
+            self._ordered = sorted(self.members(), key=self._key)
+        return self._ordered
+
+    def __iter__(self):
+        return iter(self.ids())
+
+    def __len__(self):
+        return len(self.members())
+
+    def __bool__(self):
+        return bool(self.members())
+
+    def __contains__(self, oid):
+        return oid in self.members()
+
+    def page(self, number, size=50):
+        "oids of page number, counting from 0"
+        start = number * size
+        return self.ids()[start:start + size]
+
+    def pages(self, size=50):
+        ids = self.ids()
+        for start in range(0, len(ids), size):
+            yield ids[start:start + size]
+
+    def page_objects(self, number, size=50):
+        "objects of page number, loaded together"
+        oids = self.page(number, size)
+        self._state.load_objects(oids)
+        return [self._state.get_object(oid) for oid in oids]
+
+
+class ResultCache:
+    """
+    QueryResults by key, each dropped as soon as an association it reads
+    changes, so unchanged results are reused with their evaluated members
+    and ordering.
+    """
+
+    def __init__(self):
+        self._results = {}  # key -> QueryResult
+        self._deps = {}  # key -> (kind, name) read
+        self._readers = defaultdict(set)  # (kind, name) -> keys reading it
+
+    def get(self, key):
+        return self._results.get(key)
+
+    def put(self, key, result, deps):
+        self.discard(key)
+        self._results[key] = result
+        self._deps[key] = deps
+        for dep in deps:
+            self._readers[dep].add(key)
+
+    def discard(self, key):
+        self._results.pop(key, None)
+        for dep in self._deps.pop(key, ()):
+            readers = self._readers.get(dep)
+            if readers:
+                readers.discard(key)
+                if not readers:
+                    del self._readers[dep]
+
+    def changed(self, kind, names=None):
+        "associations of names of kind changed, all of the kind if names is None"
+        if names is None:
+            keys = [k for k, deps in self._deps.items() if any(d[0] == kind for d in deps)]
+        else:
+            keys = set().union(*(self._readers.get((kind, n), ()) for n in names))
+        for key in keys:
+            self.discard(key)
+
+    def forget_object(self, oid):
+        "drop the evaluated results holding oid"
+        for key, result in list(self._results.items()):
+            if (result._members is not None) and (oid in result._members):
+                self.discard(key)
+
+    def clear(self):
+        self._results.clear()
+        self._deps.clear()
+        self._readers.clear()
+
+    def __contains__(self, key):
+        return key in self._results
+
+    def __len__(self):
+        return len(self._results)
@@ -0,0 +1,67 @@
+"""
+Read only metadata shared by the ClientStates of many worker processes.
+
+SharedMetadata is built once, before forking workers or from a snapshot
+file, and holds every meta item as an immutable FrozenItem.  Worker
+states started from it fetch no metadata and index the shared items
+rather than copying them; an item is only copied into a worker, as an
+ordinary tracked item, when that worker gets it with
+CachedByNameId.modifiable to change it.  Calling freeze() after building
+moves the items out of the garbage collector's reach so collections in
+the workers do not write to, and so copy, the pages holding them.
+"""
+from types import MappingProxyType
+from uopclient.state import ClientState
+from uopclient.snapshot import META_KINDS, read_snapshot, _require_token
+from uopclient.utils.frozen import freeze
+import gc
+
+
+class SharedMetadata:
+    """
+    Frozen result of connect.meta_map() for starting ClientStates
+    without fetching metadata.
+    """
+
+    def __init__(self, meta_map, token=None):
+        """
+        :param meta_map: kind -> id -> meta item, e.g. connect.meta_map()
+        :param token: validity token, supplied by the caller, of the
+        database state the metadata was read at
+        """
+        self.token = token
+        self.meta_map = MappingProxyType({
+            kind: MappingProxyType({k: freeze(v) for k, v in items.items()})
+            for kind, items in meta_map.items()})
+
+    @classmethod
+    def from_connection(cls, connect, token=None):
+        return cls(connect.meta_map(), token)
+
+    @classmethod
+    def from_snapshot(cls, path, token):
+        "metadata of the snapshot at path if it was saved at token, else None"
+        key = _require_token(token)
+        payload = read_snapshot(path, lambda found: found == key)
+        if not payload:
+            return None
+        return cls({k: payload['metas'].get(k, {}) for k in META_KINDS}, token)
+
+    def is_current(self, token):
+        "whether the metadata was read at the caller's current token, unknown counting as changed"
+        return (token is not None) and (self.token is not None) and (str(token) == str(self.token))
+
+    def freeze(self):
+        """
+        Exempt everything allocated so far, the shared items included, from
+        garbage collection.  Call in the parent just before forking.
+        """
+        gc.collect()
+        gc.freeze()
+
+    def state(self, connect, state_class=ClientState, **kwargs):
+        "state_class for connect using the shared metadata"
+        return state_class(connect, meta_map=self.meta_map, **kwargs)
+
+    def __len__(self):
+        return sum(len(items) for items in self.meta_map.values())
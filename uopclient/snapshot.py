@@ -0,0 +1,151 @@
+"""
+Local snapshot files of a ClientState's persisted metadata and warm
+object and association caches so a new process can start without
+refetching them.
+
+File layout: a fixed header (magic, version, token and payload sizes),
+the validity token, then the payload as JSON.  Only the header and token
+are read before the token is checked, and the payload is only ever
+decoded as data, so a foreign or tampered file cannot run code.
+
+The database offers no token that changes with its contents, so callers
+must supply one, e.g. a revision counter kept by the application.
+Saving or loading without a token is an error rather than a guess.
+"""
+from uopmeta.schemas.meta import as_dict
+from uopclient.state import ClientState
+from uopclient.utils.lazy import LazyAssocs, is_pending
+from collections import defaultdict
+from collections.abc import Mapping
+import json
+import os
+import struct
+
+MAGIC = b'UOPSNAP\0'
+VERSION = 2
+HEADER = struct.Struct('<8sHHQ')  # magic, version, token length, payload length
+META_KINDS = ('classes', 'attributes', 'roles', 'tags', 'groups', 'queries')
+
+
+def _require_token(token):
+    if not token:
+        raise ValueError('snapshots need a validity token from the caller')
+    return str(token)
+
+
+def _members(value):
+    "oid set, or subject -> oid set mapping, as json data"
+    if isinstance(value, Mapping):
+        return {k: list(v) for k, v in value.items()}
+    return list(value)
+
+
+def _from_members(data):
+    if isinstance(data, dict):
+        return defaultdict(set, {k: set(v) for k, v in data.items()})
+    return set(data)
+
+
+def _entry(mapping):
+    "by_object entry as json data, only the names of a LazyAssocs so nothing is fetched"
+    if isinstance(mapping, LazyAssocs):
+        return list(mapping)
+    return _members(mapping)
+
+
+def _from_entry(assoc, oid, data):
+    if isinstance(data, list):
+        return assoc.object_entry(oid, data)
+    return assoc.object_entry(oid, _from_members(data))
+
+
+def _clean_assocs(assoc):
+    "association cache entries holding only committed data"
+    dirty = assoc._dirty_metas
+    by_meta = {k: _members(v) for k, v in assoc.by_meta.items()
+               if (k not in dirty) and not is_pending(v)}
+    by_object = {k: _entry(v) for k, v in assoc.by_object.items()
+                 if (k not in assoc._dirty_objects) and not (v.keys() & dirty)}
+    return dict(by_meta=by_meta, by_object=by_object)
+
+
+def _persisted(cached):
+    return {k: as_dict(v) for k, v in cached.original.items()}
+
+
+def save_snapshot(state: ClientState, path, token):
+    """
+    Write the persisted part of state to path.
+    :param token: validity token, something that changes with any database
+    change, e.g. a revision counter kept by the application
+    """
+    key = _require_token(token).encode()
+    payload = dict(
+        metas={kind: _persisted(getattr(state, f'_{kind}')) for kind in META_KINDS},
+        objects=_persisted(state._objects),
+        assocs={a._kind: _clean_assocs(a) for a in (state.tags, state.groups, state.roles)})
+    data = json.dumps(payload).encode()
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(key), len(data)))
+        f.write(key)
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def read_snapshot(path, accept):
+    """
+    Payload of the snapshot at path if its token satisfies accept(token),
+    else None.  Missing, foreign, truncated or malformed files give None.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        magic, version, key_len, data_len = HEADER.unpack(header)
+        if (magic != MAGIC) or (version != VERSION):
+            return None
+        key = f.read(key_len)
+        if (len(key) < key_len) or not accept(key.decode(errors='replace')):
+            return None
+        data = f.read(data_len)
+    if len(data) < data_len:
+        return None
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def _restore(state, payload):
+    for oid, obj in payload['objects'].items():
+        state._cache_object(oid, obj)
+    for assoc in (state.tags, state.groups, state.roles):
+        cached = payload['assocs'].get(assoc._kind, {})
+        for name, data in cached.get('by_meta', {}).items():
+            if assoc.get_meta(name):
+                assoc._set_meta(name, _from_members(data))
+        for oid, data in cached.get('by_object', {}).items():
+            assoc._set_object(oid, _from_entry(assoc, oid, data))
+
+
+def load_snapshot(connect, path, token, state_class=ClientState, **kwargs):
+    """
+    ClientState for connect started from the snapshot at path if it was
+    saved at token: metadata, objects and associations are then restored
+    without fetching.  Otherwise the state is built cold as usual.
+    :param token: current validity token, as given to save_snapshot
+    :param kwargs: passed to state_class
+    """
+    token = _require_token(token)
+    payload = read_snapshot(path, lambda key: key == token)
+    if not payload:
+        return state_class(connect, **kwargs)
+    state = state_class(connect, meta_map=payload['metas'], **kwargs)
+    _restore(state, payload)
+    return state
@@ -1,5 +1,6 @@
 from collections import defaultdict
-from functools import partial
+from collections.abc import Mapping, MutableSet
+from functools import partial, wraps
 from sjautils import dicts, decorations
 from uop.connect.uop_connect import ConnectionWrapper
 from uop.connect import direct
@@ -7,6 +8,13 @@ from uopmeta.schemas.predefined import pkm_schema
 from uopmeta.schemas import meta
 from uopmeta import attr_info
 from uopmeta.schemas.meta import as_dict, as_object
+from uopclient.utils.lru import LRUIndex
+from uopclient.utils.oidset import OidInterner, OidSet
+from uopclient.utils.lazy import LazyAssocs, DeltaSet, peek, is_pending
+from uopclient.utils.frozen import FrozenItem
+from uopclient.stats import operation
+from uopclient.query import QueryResult, ResultCache, as_data, from_data, dependencies
+from uopclient import graph
 import copy
 import asyncio
 
@@ -14,7 +22,23 @@ def type_default(a_type):
     info = attr_info.attribute_types[a_type]
     return info.default()
 
-set_dict = lambda: defaultdict(set)
+def set_dict():
+    return defaultdict(set)
+
+def bulk_method(connect, name):
+    "optional bulk operation of the connection or None if it has none"
+    return getattr(connect, name, None)
+
+
+def meta_attr(meta, name, default=None):
+    "attribute of a meta item whether it is a dict or an object"
+    if isinstance(meta, dict):
+        return meta.get(name, default)
+    return getattr(meta, name, default)
+
+def reverse_name_of(meta):
+    "reverse_name of a role meta, None for other kinds"
+    return meta_attr(meta, 'reverse_name')
 
 
 class MetaMappings:
@@ -23,13 +47,35 @@ class MetaMappings:
         self.name_map = {i['name']: i for i in meta_items}
         self.id_to_name = {i['id']: i['name'] for i in meta_items}
         self.name_to_id = {i['name']: i['id'] for i in meta_items}
+        self.reverse_map = {}  # reverse_name -> meta
+        self.is_reverse = {}  # name or reverse_name -> whether it is a reverse_name
+        for i in meta_items:
+            self._add_names(i)
+
+    def _add_names(self, meta):
+        self.is_reverse[meta['name']] = False
+        reverse_name = reverse_name_of(meta)
+        if reverse_name:
+            self.reverse_map[reverse_name] = meta
+            self.is_reverse[reverse_name] = True
+
+    def _remove_names(self, meta):
+        self.is_reverse.pop(meta['name'], None)
+        reverse_name = reverse_name_of(meta)
+        if reverse_name:
+            self.reverse_map.pop(reverse_name, None)
+            self.is_reverse.pop(reverse_name, None)
 
     def add_meta(self, meta):
         mid, name = meta.id, meta.name
+        known = self.id_map.get(mid)
+        if known:
+            self._remove_names(known)
         self.id_map[mid] = meta
         self.name_map[name] = meta
         self.id_to_name[mid] = name
         self.name_to_id[name] = mid
+        self._add_names(meta)
 
     def remove_meta(self, meta):
         mid, name = meta['id'], meta['name']
@@ -37,6 +83,11 @@ class MetaMappings:
         self.name_map.pop(name, None)
         self.id_to_name.pop(mid, None)
         self.name_to_id.pop(name, None)
+        self._remove_names(meta)
+
+    def forward_meta(self, name):
+        "meta having name as its name or reverse_name"
+        return self.name_map.get(name) or self.reverse_map.get(name)
 
 def as_object(item):
     if type(item) == dict:
@@ -50,6 +101,7 @@ class ObjectAssociated:
     Relationship is special case in that accon mapping is 
     assoc_name -> object_id -> other_ids where other_ids is a set
     """
+    _related_sets = False # _by_object sets are per owner relations
 
     def __init__(self, state, kind, meta_target=set):
         """
@@ -70,6 +122,21 @@ class ObjectAssociated:
         may be present.
         The value in _by_meta will be a dict of obj -> set(objects) on other side of
         relationship.
+
+        Back references are kept so deletes and presence checks only touch
+        the entries an oid actually appears in:
+        _refs: oid -> {(assoc_name, owner_oid)} where owner_oid is None for
+            membership in the _by_meta[assoc_name] set and otherwise the oid
+            whose related set under assoc_name holds it.
+        _holders: assoc_name -> oids whose _by_object mapping has assoc_name
+
+        When the state has assoc_limits the least recently used entries of
+        _by_object and _by_meta are evicted, never ones changed by this
+        transaction (_dirty_objects, _dirty_metas) nor member sets object
+        entries have read.
+
+        watchers: fn(names) told of names whose associations changed or
+        whose cached data was dropped, names None when everything was.
         """
         self._state = state
         self._connect:ConnectionWrapper = state.connect
@@ -77,6 +144,15 @@ class ObjectAssociated:
         self._items = [as_object(i) for i in state.cached_items(kind)]
         self._by_object = defaultdict(set_dict)
         self._by_meta = defaultdict(meta_target)
+        self._refs = defaultdict(set)
+        self._holders = defaultdict(set)
+        self._dirty_objects = set()
+        self._dirty_metas = set()
+        self.watchers = []
+        limits = state.assoc_limits
+        self._object_lru = LRUIndex(limits, self._evict_object,
+                                    lambda oid: oid not in self._dirty_objects)
+        self._meta_lru = LRUIndex(limits, self._evict_meta, self._meta_evictable)
         self._map = MetaMappings(self._items)
 
     def remove_meta(self, meta):
@@ -85,12 +161,223 @@ class ObjectAssociated:
             name = meta['name']
             self._map.remove_meta(meta)
             self._by_meta.pop(name, None)
-            for used in self._by_object.values():
-                if isinstance(used, set):
-                    used.discard(name)
-                elif isinstance(used, dict):
+            self._meta_lru.discard(name)
+            for oid in self._holders.pop(name, ()):
+                used = self._by_object.get(oid)
+                if used:
                     used.pop(name, None)
 
+    def _ref(self, oid, name, owner=None):
+        self._refs[oid].add((name, owner))
+
+    def _unref(self, oid, name, owner=None):
+        refs = self._refs.get(oid)
+        if refs:
+            refs.discard((name, owner))
+            if not refs:
+                del self._refs[oid]
+
+    def _index_meta(self, name):
+        "record back references for freshly cached _by_meta[name]"
+        subs = self._by_meta[name]
+        if isinstance(subs, Mapping):
+            for owner, oids in subs.items():
+                self._ref(owner, name, owner)
+                key = (name, owner)
+                for oid in oids:
+                    self._refs[oid].add(key)
+        else:
+            key = (name, None)
+            for oid in subs:
+                self._refs[oid].add(key)
+
+    def _index_object(self, owner):
+        "record back references for freshly cached _by_object[owner]"
+        used = self._by_object[owner]
+        for name in used:
+            self._holders[name].add(owner)
+            if self._related_sets:
+                key = (name, owner)
+                for oid in used[name]:
+                    self._refs[oid].add(key)
+
+    def _set_object(self, oid, mapping):
+        if isinstance(mapping, LazyAssocs):
+            mapping.bind(self)
+        self._by_object[oid] = mapping
+        self._index_object(oid)
+        self._object_lru.touch(oid, mapping)
+        return mapping
+
+    def _compact(self, members):
+        "members as an OidSet when the state uses compact sets"
+        interner = self._state.interner
+        if (interner is None) or not isinstance(members, MutableSet) or \
+                isinstance(members, OidSet):
+            return members
+        return OidSet(interner, members)
+
+    def _set_meta(self, name, data):
+        data = self._compact(data)
+        pending = self._by_meta.get(name)
+        if is_pending(pending):
+            pending.fill(data)  # keep the set object entries may share
+            data = pending
+        self._by_meta[name] = data
+        self._index_meta(name)
+        self._meta_lru.touch(name, data)
+        return data
+
+    def _meta_evictable(self, name):
+        """
+        Whether the cached members of name can be evicted: not changed in
+        this transaction and not read into an object entry, which would keep
+        the old set and miss the changes made to a refetched one.
+        """
+        if name in self._dirty_metas:
+            return False
+        subs = self._by_meta.get(name)
+        return not any(peek(self._by_object.get(oid, {}), name) is subs
+                       for oid in self._holders.get(name, ()))
+
+    def _evict_object(self, oid):
+        self.objects_delete_obj(oid)
+
+    def _evict_meta(self, name):
+        subs = self._by_meta.pop(name, None)
+        if (subs is None) or self._holders.get(name):
+            return  # refs still describe the _by_object sets holding name
+        if isinstance(subs, Mapping):
+            for owner, oids in subs.items():
+                self._unref(owner, name, owner)
+                for oid in oids:
+                    self._unref(oid, name, owner)
+        else:
+            for oid in (subs.known() if isinstance(subs, DeltaSet) else subs):
+                self._unref(oid, name)
+
+    def _delta_meta(self, name):
+        """
+        Cached members of name to add to or discard from, a DeltaSet that
+        fetches its base only if enumerated when name is not cached yet.
+        """
+        if name not in self._by_meta:
+            self._by_meta[name] = DeltaSet(partial(self._fetch_base, name))
+            self._meta_lru.touch(name, self._by_meta[name])
+        return self._by_meta[name]
+
+    def _fetch_base(self, name, fetched=None):
+        "base members of the DeltaSet of name, fetched unless given"
+        members = self._compact(self.get_by_meta(name) if fetched is None else fetched)
+        key = (name, None)
+        for oid in members:
+            self._refs[oid].add(key)
+        return members
+
+    def _notify(self, names):
+        for watcher in self.watchers:
+            watcher(names)
+
+    def _touched(self, oids, names):
+        "oids and names were changed in this transaction"
+        for oid in oids:
+            self._dirty_objects.add(oid)
+            self._object_lru.touch(oid)
+        for name in names:
+            self._dirty_metas.add(name)
+            self._meta_lru.touch(name)
+        self._notify(names)
+
+    def cache_stats(self):
+        return dict(by_object=self._object_lru.stats(), by_meta=self._meta_lru.stats())
+
+    def invalidate(self, names):
+        "drop cached data of the named metas and the object entries using them"
+        for name in names:
+            for oid in list(self._holders.get(name, ())):
+                self.objects_delete_obj(oid)
+            self._meta_lru.discard(name)
+            self._evict_meta(name)
+        self._notify(names)
+
+    def _release_pending(self, names):
+        """
+        Drop the never fetched member sets of names once their changes are
+        committed, along with the back references to their overlays and the
+        object entries sharing them, so the overlays of repeated commits do
+        not accumulate.  The members are fetched again if read.
+        """
+        for name in names:
+            for oid in list(self._holders.get(name, ())):
+                used = self._by_object.get(oid)
+                if isinstance(used, LazyAssocs):
+                    used.unload(name)
+                elif used is not None:
+                    self.objects_delete_obj(oid)
+            subs = self._by_meta.pop(name)
+            self._meta_lru.discard(name)
+            for oid in subs.known():
+                self._unref(oid, name)
+
+    def _meta_names(self, meta):
+        return [n for n in (meta_attr(meta, 'name'), reverse_name_of(meta)) if n]
+
+    def settle(self, changes, items):
+        """
+        After a commit: associations were written through to the changed
+        metas so stay as they are; the committed changeset of this kind's
+        metas is folded into the mappings.
+        :param changes: changeset of the metas as pushed
+        :param items: the state's CachedByNameId of this kind
+        """
+        self._release_pending([n for n in self._dirty_metas if is_pending(self._by_meta.get(n))])
+        self._dirty_objects.clear()
+        self._dirty_metas.clear()
+        for meta in changes['deleted'].values():
+            self.invalidate(self._meta_names(meta))
+            self.remove_meta(meta)
+        for mid, mods in changes['modified'].items():
+            known = self._map.id_map.get(mid)
+            if known and (mods.keys() & {'name', 'reverse_name'}):
+                self.invalidate(self._meta_names(known))
+        for mid in list(changes['modified']) + list(changes['inserted']):
+            item = items.get(mid)
+            if item:
+                self._map.add_meta(as_object(dict(item)))
+        self._object_lru.enforce()
+        self._meta_lru.enforce()
+
+    def _ref_present(self, oid, name, owner):
+        subs = self._by_meta.get(name)
+        if owner is None:
+            return (subs is not None) and (oid in subs)
+        if isinstance(subs, Mapping):
+            if (owner == oid) and (oid in subs):
+                return True
+            if oid in subs.get(owner, ()):
+                return True
+        used = self._by_object.get(owner)
+        return bool(used) and (oid in used.get(name, ()))
+
+    def _drop_ref(self, oid, name, owner):
+        subs = self._by_meta.get(name)
+        if owner is None:
+            if subs is not None:
+                subs.discard(oid)
+            for holder in self._holders.get(name, ()):
+                oids = peek(self._by_object.get(holder, {}), name)
+                if oids is not None:
+                    oids.discard(oid)
+            return
+        if isinstance(subs, Mapping):
+            if owner == oid:
+                subs.pop(oid, None)
+            elif owner in subs:
+                subs[owner].discard(oid)
+        used = self._by_object.get(owner)
+        if used and (name in used):
+            used[name].discard(oid)
+
     def all_assocs(self):
         return set(self._map.name_to_id.keys())
 
@@ -105,37 +392,27 @@ class ObjectAssociated:
         return self.assoc_present(assoc)
 
     def meta_delete_obj(self, oid):
-        for name, subs in self.by_meta.items():
-            if isinstance(subs, set):
-                subs.discard(oid)
-            elif isinstance(subs, dict):
-                subs.pop(oid, None)
-                for k_oid, oids in subs.items():
-                    oids.discard(oid)
+        for name, owner in self._refs.pop(oid, ()):
+            self._drop_ref(oid, name, owner)
 
     def objects_delete_obj(self, oid):
-        self.by_object.pop(oid, None)
-        for k_oid, meta_objs in self.by_object.items():
-            for name, oids in meta_objs.items():
-                oids.discard(oid)
+        self._object_lru.discard(oid)
+        used = self._by_object.pop(oid, None)
+        if used:
+            for name in used:
+                holders = self._holders.get(name)
+                if holders:
+                    holders.discard(oid)
+                if self._related_sets:
+                    for other in used[name]:
+                        self._unref(other, name, oid)
 
     def object_present(self, oid):
-        if oid in self.by_object:
+        if oid in self._by_object:
             return True
-        for k_oid, meta_objs in self._by_object.items():
-            for name, oids in meta_objs.items():
-                if oid in oids:
-                    return True
-        for name, subs in self.by_meta.items():
-            if isinstance(subs, set):
-                if oid in subs:
-                    return True
-            elif isinstance(subs, dict):
-                if oid in subs:
-                    return True
-                for k_oid, oids in subs.items():
-                    if oid in oids:
-                        return True
+        for name, owner in self._refs.get(oid, ()):
+            if self._ref_present(oid, name, owner):
+                return True
         return False
 
     def delete_object(self, oid):
@@ -165,27 +442,81 @@ class ObjectAssociated:
     def clear(self):
         self._by_object.clear()
         self._by_meta.clear()
+        self._refs.clear()
+        self._holders.clear()
+        self._dirty_objects.clear()
+        self._dirty_metas.clear()
+        self._object_lru.clear()
+        self._meta_lru.clear()
+        self._notify(None)
 
     def _meta_neighbors(self, meta_collection, object_id):
-        copy = None
-        if isinstance(meta_collection, set):
-            copy = set(meta_collection)
+        if isinstance(meta_collection, MutableSet):
+            copy = meta_collection.copy()
             copy.discard(object_id)
             return copy
-        if isinstance(meta_collection, dict):
+        if isinstance(meta_collection, Mapping):
             return meta_collection.get(object_id, set())
 
     def for_object(self, object_id):
-        return dicts.get(self._by_object, object_id, self.get_by_object)
+        known = self._by_object.get(object_id)
+        if known is None:
+            self._state.count_cache(f'{self._kind}.by_object', misses=1)
+            return self._set_object(object_id, self.get_by_object(object_id))
+        self._state.count_cache(f'{self._kind}.by_object', hits=1)
+        self._object_lru.touch(object_id)
+        return known
 
     def add_object(self, oid):
         self.for_object(oid) # side affect does the work
 
+    def load_objects(self, oids, persisted=False):
+        """
+        Fills _by_object for all of oids not yet cached from one batched
+        association fetch instead of one get_by_object per oid.
+        :param persisted: whether oids are known to be in the database,
+        else those not cached are read together to find out
+        """
+        wanted = [oid for oid in oids if oid not in self._by_object]
+        if wanted and not persisted:
+            wanted = self._state.persisted_objects(wanted)
+        self._state.count_cache(f'{self._kind}.by_object', len(oids) - len(wanted), len(wanted))
+        if not wanted:
+            return
+        found = self.db_objects_associated(wanted)
+        for oid in wanted:
+            self._set_object(oid, self.object_entry(oid, found.get(oid, ())))
+
+    @decorations.abstract
+    def db_collection(self):
+        "database collection holding the raw association records"
+        pass
+
+    def db_objects_associated(self, oids):
+        "oid -> names of its associations for all of oids in one call"
+        res = defaultdict(list)
+        id_names = self._map.id_to_name
+        criteria = {'object_id': {'$in': list(oids)}}
+        for rec in self.db_collection().find(criteria):
+            res[rec['object_id']].append(id_names[rec['assoc_id']])
+        return res
+
+    def object_entry(self, oid, names):
+        """
+        _by_object mapping for oid given the names of its associations.
+        Member sets are only fetched for the names that are read.
+        """
+        return LazyAssocs(self, oid, names)
+
+    def member_value(self, oid, name):
+        "value of name in the _by_object mapping of oid"
+        return self.for_meta(name)
+
     def _meta_without_oid(self, meta, oid):
-        if isinstance(meta, set):
+        if isinstance(meta, MutableSet):
             meta.discard(oid)
             return meta
-        elif isinstance(meta, dict):
+        elif isinstance(meta, Mapping):
             meta.pop(oid, None)
             for name, oids in meta.items():
                 oids.discard(oid)
@@ -194,8 +525,15 @@ class ObjectAssociated:
     def object_persisted(self, oid):
         return self._state.is_persisted('objects', oid)
 
-    @decorations.abstract
     def get_by_object(self, object_id):
+        names = ()
+        if self.object_persisted(object_id):  # is in database
+            names = self.db_object_associated(object_id)
+        return self.object_entry(object_id, names)
+
+    @decorations.abstract
+    def db_object_associated(self, object_id):
+        "association data of one object as consumed by object_entry"
         pass
 
     def _mapping(self, obj_id):
@@ -211,8 +549,7 @@ class ObjectAssociated:
 
     def ensure_association(self, oid, meta_name):
         self.ensure_meta(meta_name)
-        if oid not in self._by_object:
-            self._by_object[oid] = self.get_by_object(oid)
+        self.for_object(oid)
 
 
 
@@ -256,11 +593,15 @@ class ObjectAssociated:
                 named = self.by_meta[name]
                 if oid not in named:
                     named[oid] = fn(name)
+                    self._ref(oid, name, oid)
+                    for related in named[oid]:
+                        self._ref(related, name, oid)
 
                 named[oid].add(other_oid)
+                self._ref(other_oid, name, oid)
             else:
-                named = self.for_meta(name)
-                named.add(oid)
+                self._delta_meta(name).add(oid)
+                self._ref(oid, name)
 
 
 
@@ -275,17 +616,23 @@ class ObjectAssociated:
         return self._map.name_map.get(assoc_name)
 
     def mod_metas_on_disassociate(self, obj_id, assoc_name, other_id):
-        def drop_assoc(meta_data, dropped_id, other_id):
-            if meta_data:
-                if other_id:
-                    meta_data[other_id].discard(dropped_id)
-                else:
+        def drop_assoc(name, owner_id, dropped_id):
+            meta_data = self._by_meta.get(name)
+            if other_id:
+                if meta_data and (owner_id in meta_data):
+                    meta_data[owner_id].discard(dropped_id)
+                self._unref(dropped_id, name, owner_id)
+            else:
+                if meta_data is not None:
                     meta_data.discard(dropped_id)
+                self._unref(dropped_id, name)
 
         meta = self.get_meta(assoc_name)
-        drop_assoc(self._by_meta.get(meta.name), obj_id, other_id)
         if other_id:
-            drop_assoc(self._by_meta.get(meta.reverse_name), other_id, obj_id)
+            drop_assoc(meta.name, obj_id, other_id)
+            drop_assoc(meta.reverse_name, other_id, obj_id)
+        else:
+            drop_assoc(meta.name, None, obj_id)
 
 
     def associate(self, obj_id, assoc_name, other_obj_id=None):
@@ -311,31 +658,67 @@ class ObjectAssociated:
         self.add_assoc(obj_id, assoc_name, other_obj_id)
 
     def remove_assoc(self, obj_id, assoc_name, other_obj_id=None):
-        obj_data = self._by_object.get(obj_id)
-        if obj_data:
+        obj_data = self._by_object.get(obj_id)  # None if not loaded, nothing to update
+        if obj_data is not None:
+            if other_obj_id:
+                related = obj_data.get(assoc_name)
+                if related is not None:
+                    related.discard(other_obj_id)
+                    self._unref(other_obj_id, assoc_name, obj_id)
+                    if related:
+                        return
             obj_data.pop(assoc_name, None)
-        self._by_object[obj_id].pop(assoc_name, None)
+        holders = self._holders.get(assoc_name)
+        if holders:
+            holders.discard(obj_id)
+        if not other_obj_id:
+            for holder in self._holders.get(assoc_name, ()):
+                oids = peek(self._by_object.get(holder, {}), assoc_name)
+                if oids is not None:
+                    oids.discard(obj_id)
 
     def mod_objects_on_associate(self, oid, name, other):
         meta = self.get_meta(name)
         def from_meta(for_obj, name):
             meta_data = self.by_meta[name]
-            if isinstance(meta_data, dict):
+            if isinstance(meta_data, Mapping):
                 meta_data = meta_data[for_obj]
             return meta_data - {for_obj}
 
         def fix_object(obj, name, other):
-            if not name in self.by_object[obj]:
-                self.by_object[obj][name] = from_meta(obj, name)
+            used = self.by_object[obj]
+            if isinstance(used, LazyAssocs) and not other:
+                used.add_name(name)
+                self._holders[name].add(obj)
+            elif not name in used:
+                oids = from_meta(obj, name)
+                if other:
+                    oids.add(other)  # from_meta leaves out obj itself
+                self.by_object[obj][name] = oids
+                self._holders[name].add(obj)
+                if other:
+                    for related in oids:
+                        self._ref(related, name, obj)
             elif other:
                 self.by_object[obj][name].add(other)
+                self._ref(other, name, obj)
         fix_object(oid, meta.name, other)
         if other:
             fix_object(other, meta.reverse_name, oid)
 
 
+    def _touch_assoc(self, obj_id, meta, other_obj_id):
+        if other_obj_id:
+            self._touched((obj_id, other_obj_id), (meta.name, meta.reverse_name))
+        else:
+            self._touched((obj_id,), (meta.name,))
+
     def add_assoc(self, obj_id, assoc_name, other_obj_id):
         meta = self.get_meta(assoc_name)
+        self._touch_assoc(obj_id, meta, other_obj_id)  # pinned, so loading one cannot evict the other
+        self.for_object(obj_id)  # complete entries before adding to them
+        if other_obj_id:
+            self.for_object(other_obj_id)
         self.mod_metas_on_associate(obj_id, assoc_name, other_obj_id)
         self.mod_objects_on_associate(obj_id, assoc_name, other_obj_id)
 
@@ -345,21 +728,110 @@ class ObjectAssociated:
         if meta:
             mid = meta.id
             self.db_disassociate(obj_id, mid, other_obj_id)
-            self.remove_assoc(obj_id, meta.name, other_obj_id)
-            if other_obj_id:
-                self.remove_assoc(other_obj_id, meta.reverse_name, obj_id)
-            self.mod_metas_on_disassociate(obj_id, meta.name, other_obj_id)
+            self._remove_cached(obj_id, meta, other_obj_id)
+
+    def _remove_cached(self, obj_id, meta, other_obj_id):
+        self._touch_assoc(obj_id, meta, other_obj_id)
+        self.remove_assoc(obj_id, meta.name, other_obj_id)
+        if other_obj_id:
+            self.remove_assoc(other_obj_id, meta.reverse_name, obj_id)
+        self.mod_metas_on_disassociate(obj_id, meta.name, other_obj_id)
+
+    def _assoc_key(self, assoc):
+        "(obj_id, name, other_obj_id) in forward order with the forward name"
+        obj_id, assoc_name, other_obj_id = (tuple(assoc) + (None,))[:3]
+        obj_id, other_obj_id = self.maybe_reorder(obj_id, assoc_name, other_obj_id)
+        meta = self.get_meta(assoc_name)
+        return obj_id, (meta.name if meta else assoc_name), other_obj_id
+
+    def _db_many(self, op_name, each, changes):
+        """
+        Write changes, (obj_id, meta, other_obj_id) items, with one
+        <op_name>_many(assoc_id, members) call per meta where the connection
+        has it, members being the oids or, for roles, (obj_id, other_obj_id)
+        pairs; else with each(obj_id, assoc_id, other_obj_id) per change.
+        """
+        if not changes:
+            return
+        bulk = bulk_method(self._connect, f'{op_name}_many')
+        if not bulk:
+            for obj_id, meta, other_obj_id in changes:
+                each(obj_id, meta.id, other_obj_id)
+            return
+        members = defaultdict(list)
+        for obj_id, meta, other_obj_id in changes:
+            members[meta.id].append((obj_id, other_obj_id) if other_obj_id else obj_id)
+        for assoc_id, items in members.items():
+            bulk(assoc_id, items)
+
+    def change_many(self, added=(), removed=()):
+        """
+        Bulk associate and disassociate.  Each of added and removed holds
+        (obj_id, name) or, for roles, (obj_id, name, other_obj_id) items.
+        Duplicates are dropped and an association both added and removed
+        cancels out, so neither is written.  Metas are ensured once per name
+        and the objects involved are loaded with one load_objects.  The
+        remaining changes are written with one call per name where the
+        connection has the bulk operation, see _db_many.
+        """
+        adds = dict.fromkeys(self._assoc_key(a) for a in added)
+        removes = dict.fromkeys(self._assoc_key(a) for a in removed)
+        for key in adds.keys() & removes.keys():
+            del adds[key]
+            del removes[key]
+        dropped = [(o, self.get_meta(n), x) for o, n, x in removes if self.get_meta(n)]
+        self._db_many(self.disassociate_name, self.db_disassociate, dropped)
+        for obj_id, meta, other_obj_id in dropped:
+            self._remove_cached(obj_id, meta, other_obj_id)
+        self.load_objects([o for o, _, _ in adds] + [x for _, _, x in adds if x])
+        metas = {n: self.ensure_meta(n) for n in dict.fromkeys(n for _, n, _ in adds)}
+        made = [(o, metas[n], x) for o, n, x in adds]
+        self._db_many(self.associate_name, self.db_associate, made)
+        for obj_id, meta, other_obj_id in made:
+            self.add_assoc(obj_id, meta.name, other_obj_id)
+
+    def associate_many(self, assocs):
+        self.change_many(added=assocs)
+
+    def disassociate_many(self, assocs):
+        self.change_many(removed=assocs)
 
     @decorations.abstract
     def get_by_meta(self, meta_name, related_to=None):
         pass
 
+    def load_metas(self, names):
+        """
+        Ensures _by_meta holds each of names that is a known meta, fetching
+        all the missing ones with one db_metas_associated call, a single
+        query for groups and roles and for tags where the connection has
+        get_tagsets.
+        """
+        wanted = [n for n in dict.fromkeys(names) if self.get_meta(n)]
+        missing = [n for n in wanted
+                   if (n not in self._by_meta) or is_pending(self._by_meta[n])]
+        self._state.count_cache(f'{self._kind}.by_meta', len(wanted) - len(missing), len(missing))
+        if missing:
+            for name, members in self.db_metas_associated(missing).items():
+                self._set_meta(name, members)
+
+    def db_metas_associated(self, names):
+        "name -> associated oids for each of names"
+        return {name: self.get_by_meta(name) for name in names}
+
     def for_meta (self, meta_name, fn=None):
-        fn = fn or self.get_by_meta
-        return dicts.get(self._by_meta, meta_name, fn)
+        known = self._by_meta.get(meta_name)
+        if known is None:
+            self._state.count_cache(f'{self._kind}.by_meta', misses=1)
+            fn = fn or self.get_by_meta
+            return self._set_meta(meta_name, fn(meta_name))
+        self._state.count_cache(f'{self._kind}.by_meta', hits=1)
+        self._meta_lru.touch(meta_name)
+        return known
 
 class AssociatedTags(ObjectAssociated):
 
+    associate_name = 'tag'
     disassociate_name = 'untag'
 
     def __init__(self, state):
@@ -368,6 +840,9 @@ class AssociatedTags(ObjectAssociated):
     def db_all_associated(self):
         return self._connect.tagged.find()
 
+    def db_collection(self):
+        return self._connect.tagged
+
 
     def db_associated_objects(self, an_id, related_to=None, reverse=False):
         name = self._map.id_to_name[an_id]
@@ -378,14 +853,9 @@ class AssociatedTags(ObjectAssociated):
         return self.for_meta(name, fn)
 
 
-    def get_by_object(self, object_id):
-        res = defaultdict(set)
-        if self.object_persisted(object_id):  # is in database
-            tags = self._connect.get_object_tags(object_id)
-            for tid in tags:
-                name = self._map.id_to_name[tid]
-                res[name] = self.db_associated_objects(tid)
-        return res
+    def db_object_associated(self, object_id):
+        id_names = self._map.id_to_name
+        return [id_names[tid] for tid in self._connect.get_object_tags(object_id)]
 
     def db_associate(self, obj_id, assoc_id, other_obj_id=None):
         return self._connect.tag(obj_id, assoc_id)
@@ -397,8 +867,21 @@ class AssociatedTags(ObjectAssociated):
         tid = self._map.name_to_id[meta_name]
         return self._connect.get_tagset(tid, recursive=True, **kwargs)
 
+    def db_metas_associated(self, names):
+        """
+        Recursive member sets of names with one get_tagsets call if the
+        connection supports it, else one get_tagset per name.
+        """
+        bulk = bulk_method(self._connect, 'get_tagsets')
+        if not bulk:
+            return super().db_metas_associated(names)
+        ids = self._map.name_to_id
+        found = bulk([ids[n] for n in names], recursive=True)
+        return {n: found.get(ids[n], set()) for n in names}
+
 
 class AssociatedGroups(ObjectAssociated):
+    associate_name = 'group'
     disassociate_name = 'ungroup'
 
     def __init__(self, context):
@@ -407,6 +890,28 @@ class AssociatedGroups(ObjectAssociated):
     def db_all_associated(self):
         return self._connect.grouped.find()
 
+    def settle(self, changes, items):
+        """
+        Member sets are recursive, so writing membership through to the
+        changed groups leaves the groups above them and the neighbour copies
+        objects hold (see member_value) behind: drop those.
+        """
+        changed = set(self._dirty_metas)
+        super().settle(changes, items)
+        hierarchy = self._state.group_hierarchy
+        above = set().union(*(hierarchy.ancestor_names(n) for n in changed))
+        self.invalidate(above - changed)
+        for name in changed:
+            for oid in list(self._holders.get(name, ())):
+                used = self._by_object.get(oid)
+                if isinstance(used, LazyAssocs):
+                    used.unload(name)
+                elif used is not None:
+                    self.objects_delete_obj(oid)
+
+    def db_collection(self):
+        return self._connect.grouped
+
     def db_associate(self, obj_id, assoc_id, other_obj_id=None):
         return self._connect.group(obj_id, assoc_id)
 
@@ -414,36 +919,42 @@ class AssociatedGroups(ObjectAssociated):
         return self._connect.ungroup(obj_id, assoc_id)
 
 
-    def get_by_object(self, object_id):
-        res = defaultdict(set)
-        if self.object_persisted(object_id):
-            group_ids = self._connect.get_object_groups(object_id)
-            id_names = self._map.id_to_name
-            res = dict()
-            for gid in group_ids:
-                name = id_names[gid]
-                associated = self.db_associated_objects(gid)
-                res[name] = self._meta_neighbors(associated, object_id)
-        return res
+    def db_object_associated(self, object_id):
+        id_names = self._map.id_to_name
+        return [id_names[gid] for gid in self._connect.get_object_groups(object_id)]
+
+    def member_value(self, oid, name):
+        return self._meta_neighbors(self.for_meta(name), oid)
 
     def get_by_meta(self, meta_name, **kwargs):
         meta = self.get_meta(meta_name)
         gid = meta.id
         return self._state.get_groupset(gid, recursive=True)
 
+    def db_metas_associated(self, names):
+        """
+        Recursive member sets of names from one query for the direct members
+        of the named groups and all groups below them.
+        """
+        hierarchy = self._state.group_hierarchy
+        ids = self._map.name_to_id
+        below = {n: [g for g in {n} | hierarchy.descendant_names(n) if g in ids] for n in names}
+        gids = list({ids[g] for groups in below.values() for g in groups})
+        direct = defaultdict(set)
+        for rec in self.db_collection().find({'assoc_id': {'$in': gids}}):
+            direct[rec['assoc_id']].add(rec['object_id'])
+        return {n: set().union(*(direct[ids[g]] for g in groups)) for n, groups in below.items()}
+
 class Relationships(ObjectAssociated):
+    associate_name = 'relate'
     disassociate_name = 'unrelate'
+    _related_sets = True
 
     def __init__(self, context):
         super().__init__(context, 'roles')
 
     def all_assocs(self):
-        assocs = self._map.name_map.values()
-        res = set()
-        for assoc in assocs:
-            res.add(assoc.name)
-            res.add(assoc.reverse_name)
-        return res
+        return set(self._map.is_reverse)
 
     def assoc_present(self, assoc):
         def reverse_assoc(assoc):
@@ -470,14 +981,12 @@ class Relationships(ObjectAssociated):
 
     def contains(self, assoc):
         return self.assoc_present(assoc)
+
     def get_meta(self, name):
-        meta = self._map.name_map.get(name)
-        if not meta:
-            for k,v in self._map.name_map.items():
-                if v.reverse_name == name:
-                    meta = v
-                    break
-        return meta
+        return self._map.forward_meta(name)
+
+    def ensure_meta(self, meta_name):
+        return self.get_meta(meta_name) or super().ensure_meta(meta_name)
 
     def meta_names(self, assoc_name):
         meta = self.get_meta(assoc_name)
@@ -485,18 +994,18 @@ class Relationships(ObjectAssociated):
 
     def __init__(self, state):
         super().__init__(state, 'roles')
-        set_dict = lambda: defaultdict(set)
         self._by_meta = defaultdict(set_dict)
 
     def db_all_associated(self):
         return self._connect.related.find()
 
     def _meta_reversed(self, meta_name):
-        if not self._map.name_map.get(meta_name):
+        reverse = self._map.is_reverse.get(meta_name)
+        if reverse is None:
             if meta_name in self._connect.reverse_role_names():
                 return True
             raise Exception(f'{meta_name} in not role name or reverse role name')
-        return False
+        return reverse
 
 
     def _remove_by_object(self, obj_id, assoc_name, other_obj_id=None):
@@ -513,10 +1022,54 @@ class Relationships(ObjectAssociated):
     def db_associated(self):
         return self._connect.related.find()
 
-    def get_by_object(self, object_id):
-        res = defaultdict(set)
-        if self.object_persisted(object_id):
-            res = self._connect.get_related_by_name(object_id)
+    def db_object_associated(self, object_id):
+        return self._connect.get_related_by_name(object_id)
+
+    def db_collection(self):
+        return self._connect.related
+
+    def db_objects_associated(self, oids):
+        """
+        oid -> role name -> related oids for all of oids.  Forward and
+        reverse sides are each a single query.
+        """
+        res = defaultdict(set_dict)
+        id_map = self._map.id_map
+        oids = list(oids)
+        for rec in self.db_collection().find({'subject_id': {'$in': oids}}):
+            role = id_map[rec['assoc_id']]
+            res[rec['subject_id']][role.name].add(rec['object_id'])
+        for rec in self.db_collection().find({'object_id': {'$in': oids}}):
+            role = id_map[rec['assoc_id']]
+            res[rec['object_id']][role.reverse_name].add(rec['subject_id'])
+        return res
+
+    def object_entry(self, oid, names):
+        return names or defaultdict(set)
+
+    def related_to(self, name, subject):
+        "oids related to subject by role name, cached in _by_meta"
+        named = self._by_meta[name]
+        if subject not in named:
+            named[subject] = self.get_by_meta(name, related_to=subject)
+            self._ref(subject, name, subject)
+            for related in named[subject]:
+                self._ref(related, name, subject)
+        return named[subject]
+
+    def db_role_members(self, names):
+        """
+        name -> oids on the name side of some relationship of that role, so
+        subjects for role names and objects for reverse names.  One query.
+        """
+        metas = {n: self.get_meta(n) for n in names}
+        res = {n: set() for n in names}
+        ids = list({m.id for m in metas.values() if m})
+        for rec in self.db_collection().find({'assoc_id': {'$in': ids}}):
+            for name, meta in metas.items():
+                if meta and (meta.id == rec['assoc_id']):
+                    side = 'object_id' if self._map.is_reverse.get(name) else 'subject_id'
+                    res[name].add(rec[side])
         return res
 
     def get_by_meta(self, meta_name, related_to=None):
@@ -524,53 +1077,406 @@ class Relationships(ObjectAssociated):
         reversed = meta_name == role.reverse_name
         return self._connect.get_roleset(related_to, role.id, reverse=reversed)
 
+class GroupHierarchy:
+    """
+    Group containment DAG derived from the contained_in names of the groups
+    in a CachedByNameId, with memoized descendant and ancestor closures.
+    Groups whose name or contained_in change are relinked individually and
+    only the closures passing through them are dropped.
+    """
+
+    def __init__(self, groups):
+        self._groups = groups
+        self._children = None  # name -> child names
+        self._parents = defaultdict(set)  # name -> parent names
+        self._links = {}  # gid -> (name, parent names) as last linked
+        self._gids = {}  # name -> gid as last linked
+        self._stale = set()
+        self._descendants = {}  # name -> frozenset of descendant names
+        self._ancestors = {}  # name -> frozenset of ancestor names
+        groups.watchers.append(self.group_changed)
+
+    def group_changed(self, gid, key=None):
+        if gid is None:
+            self._children = None
+        elif key in (None, 'name', 'contained_in'):
+            self._stale.add(gid)
+
+    def _build(self):
+        self._children = defaultdict(set)
+        self._parents.clear()
+        self._links.clear()
+        self._gids.clear()
+        self._stale.clear()
+        self._descendants.clear()
+        self._ancestors.clear()
+        for group in self._groups.get_all():
+            self._link(group['id'], group)
+
+    def _link(self, gid, group):
+        name, parents = group['name'], frozenset(meta_attr(group, 'contained_in') or ())
+        self._links[gid] = (name, parents)
+        self._gids[name] = gid
+        for parent in parents:
+            self._children[parent].add(name)
+            self._parents[name].add(parent)
+
+    def _unlink(self, gid):
+        name, parents = self._links.pop(gid)
+        self._gids.pop(name, None)
+        for parent in parents:
+            self._children[parent].discard(name)
+            self._parents[name].discard(parent)
+
+    def _walk(self, name, adjacent):
+        seen, todo = set(), [name]
+        while todo:
+            for other in adjacent.get(todo.pop(), ()):
+                if other not in seen:
+                    seen.add(other)
+                    todo.append(other)
+        return seen
+
+    def _invalidate(self, name):
+        for above in self._walk(name, self._parents) | {name}:
+            self._descendants.pop(above, None)
+        for below in self._walk(name, self._children) | {name}:
+            self._ancestors.pop(below, None)
+
+    def _refresh(self):
+        if self._children is None:
+            self._build()
+        while self._stale:
+            gid = self._stale.pop()
+            group = self._groups.get(gid)
+            old = self._links.get(gid)
+            new = group and (group['name'], frozenset(meta_attr(group, 'contained_in') or ()))
+            if old == new:
+                continue
+            if old:
+                self._invalidate(old[0])
+                self._unlink(gid)
+            if new:
+                self._link(gid, group)
+                self._invalidate(new[0])
+
+    def _closure(self, name, adjacent, memo):
+        known = memo.get(name)
+        if known is None:
+            res = set()
+            for other in adjacent.get(name, ()):
+                if other in res:
+                    continue
+                res.add(other)
+                done = memo.get(other)
+                res |= done if done is not None else self._walk(other, adjacent)
+            known = memo[name] = frozenset(res)
+        return known
+
+    def _ids(self, names):
+        gids = self._gids
+        return {gids[n] for n in names if n in gids}
+
+    def descendant_names(self, name):
+        self._refresh()
+        return self._closure(name, self._children, self._descendants)
+
+    def ancestor_names(self, name):
+        self._refresh()
+        return self._closure(name, self._parents, self._ancestors)
+
+    def _name(self, gid):
+        self._refresh()
+        return self._links[gid][0]
+
+    def children(self, gid):
+        "ids of groups directly contained in group gid"
+        return self._ids(self._children.get(self._name(gid), ()))
+
+    def descendants(self, gid):
+        return self._ids(self.descendant_names(self._name(gid)))
+
+    def ancestors(self, gid):
+        return self._ids(self.ancestor_names(self._name(gid)))
+
+
+def plain_object(data):
+    return dicts.DictObject(**data)
+
+
+class _TrackedValue:
+    """
+    Mixin for the list, dict and set values of a TrackedObject: in place
+    changes are reported to the owner as changes of the top level key the
+    value is under.  Copies are plain containers.
+    """
+    __slots__ = ()
+    _plain = None  # the plain container type
+
+    def _bind(self, owner, key):
+        object.__setattr__(self, '_owner', owner)
+        object.__setattr__(self, '_key', key)
+        return self
+
+    def __reduce__(self):
+        return self._plain, (self._plain(self),)
+
+    def __copy__(self):
+        return self._plain(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._plain(self), memo)
+
+
+def _changing_method(base, name):
+    method = getattr(base, name)
+
+    @wraps(method)
+    def changing(self, *args, **kwargs):
+        self._owner._changing(self._key)
+        res = method(self, *args, **kwargs)
+        if name in ('append', 'insert', 'extend', '__setitem__', '__iadd__',
+                    'update', 'setdefault', '__ior__'):
+            self._track_members()
+        return res
+    return changing
+
+
+class TrackedList(_TrackedValue, list):
+    __slots__ = ('_owner', '_key')
+    _plain = list
+
+    def _track_members(self):
+        for i, v in enumerate(self):
+            list.__setitem__(self, i, tracked_value(self._owner, self._key, v))
+
+
+class TrackedDict(_TrackedValue, dict):
+    __slots__ = ('_owner', '_key')
+    _plain = dict
+
+    def _track_members(self):
+        for k, v in dict.items(self):
+            dict.__setitem__(self, k, tracked_value(self._owner, self._key, v))
+
+
+class TrackedSet(_TrackedValue, set):
+    __slots__ = ('_owner', '_key')
+    _plain = set
+
+    def _track_members(self):
+        pass
+
+
+for _name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse',
+              '__setitem__', '__delitem__', '__iadd__', '__imul__'):
+    setattr(TrackedList, _name, _changing_method(list, _name))
+for _name in ('__setitem__', '__delitem__', 'pop', 'popitem', 'clear', 'update',
+              'setdefault', '__ior__'):
+    setattr(TrackedDict, _name, _changing_method(dict, _name))
+for _name in ('add', 'discard', 'remove', 'pop', 'clear', 'update', 'difference_update',
+              'intersection_update', 'symmetric_difference_update',
+              '__ior__', '__iand__', '__isub__', '__ixor__'):
+    setattr(TrackedSet, _name, _changing_method(set, _name))
+
+
+def tracked_value(owner, key, value):
+    "value, to be held under key of owner, with its containers reporting changes"
+    if isinstance(value, _TrackedValue):
+        if (value._owner is owner) and (value._key == key):
+            return value
+        value = value._plain(value)
+    kind = type(value)
+    if kind is list:
+        res = TrackedList(value)
+    elif kind is dict:
+        res = TrackedDict(value)
+    elif kind is set:
+        res = TrackedSet(value)
+    else:
+        return value
+    res._bind(owner, key)
+    res._track_members()
+    return res
+
+
+def plain_value(value):
+    "value with tracked containers replaced by plain ones"
+    if isinstance(value, _TrackedValue):
+        return copy.deepcopy(value)
+    return value
+
+
+class TrackedObject(dicts.DictObject):
+    """
+    DictObject that tells its owning CachedByNameId before any write so
+    the cache can copy the original on write and record the item as
+    touched.  Its list, dict and set values, at any depth, are tracked
+    containers, so changing them in place counts as a write of the top
+    level key they are under.
+    """
+    __slots__ = ('_cache', '_evicted')
+
+    def __init__(self, cache, data):
+        object.__setattr__(self, '_cache', None)
+        object.__setattr__(self, '_evicted', False)
+        super().__init__(**data)
+        self._track_values()
+        object.__setattr__(self, '_cache', cache)
+
+    def _track_values(self):
+        for k, v in dict.items(self):
+            dict.__setitem__(self, k, tracked_value(self, k, v))
+
+    def _changing(self, key=None):
+        cache = self._cache
+        if cache is not None:
+            cache.item_changing(self, key)
+
+    def __reduce__(self):
+        return plain_object, (dict(self),)
+
+    def __setitem__(self, key, value):
+        self._changing(key)
+        super().__setitem__(key, tracked_value(self, key, value))
+
+    def __delitem__(self, key):
+        self._changing(key)
+        super().__delitem__(key)
+
+    def __setattr__(self, name, value):
+        if name in self.__slots__:
+            return object.__setattr__(self, name, value)
+        self._changing(name)
+        super().__setattr__(name, tracked_value(self, name, value))
+
+    def __delattr__(self, name):
+        self._changing(name)
+        super().__delattr__(name)
+
+    def __ior__(self, other):
+        self._changing()
+        res = super().__ior__(other)
+        self._track_values()
+        return res
+
+    def update(self, *args, **kwargs):
+        self._changing()
+        super().update(*args, **kwargs)
+        self._track_values()
+
+    def pop(self, key, *default):
+        if key in self:
+            self._changing(key)
+        return super().pop(key, *default)
+
+    def popitem(self):
+        self._changing()
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def clear(self):
+        self._changing()
+        super().clear()
+
+
 class CachedByNameId(meta.ByNameId):
+    """
+    ByNameId that knows which of its items are persisted (original) and
+    tracks writes so changes cost O(changed items) to find.
+    original holds the persisted item itself until it is first written, at
+    which point a snapshot of its prior state replaces it (copy on write).
+    FrozenItems, e.g. shared between processes, are held as they are and
+    replaced by a tracked copy when modifiable.
+    """
     original: dict = {}
-
+    touched: set = set()  # original ids written since loaded
+    added: set = set()  # ids added that are not original
+    removed: set = set()  # original ids removed
+    untracked: set = set()  # original ids whose items cannot report writes
+    watchers: list = []  # fn(an_id, key) told of changes, an_id None on clear
+
+    def _notify(self, an_id, key=None):
+        for watcher in self.watchers:
+            watcher(an_id, key)
+
+    def tracked(self, item):
+        if isinstance(item, FrozenItem):
+            return item
+        if isinstance(item, TrackedObject):
+            object.__setattr__(item, '_cache', self)
+            return item
+        if isinstance(item, dict):
+            return TrackedObject(self, item)
+        return item
+
+    def item_changing(self, item, key=None):
+        an_id = item.get('id')
+        if getattr(item, '_evicted', False):
+            object.__setattr__(item, '_evicted', False)
+            if an_id not in self.by_id:
+                self.original[an_id] = item
+                super().add_item(item)
+        if self.original.get(an_id) is item:
+            self.original[an_id] = copy.deepcopy(dict(item))
+        if self.by_id.get(an_id) is item:
+            if an_id in self.original:
+                self.touched.add(an_id)
+            self._notify(an_id, key)
+
+    def item_mods(self, an_id):
+        orig = self.original[an_id]
+        orig = orig.thaw() if isinstance(orig, FrozenItem) else as_dict(orig)
+        active = self.by_id.get(an_id)
+        if active is None:
+            return {}
+        return {k: plain_value(v) for k, v in as_dict(active).items() if orig.get(k) != v}
+
+    def _modified_ids(self):
+        return (self.touched | self.untracked) - self.removed
 
     def get_changes(self):
         active = self.by_id
-        inserted = {k:v for k,v in active.items() if k not in self.original}
-        deleted = {k:v for k,v in self.original.items() if k not in active}
+        inserted = {k: active[k] for k in self.added if k in active}
+        deleted = {k: self.original[k] for k in self.removed}
         modified = {}
-        for k,v in self.original.items():
-            v = as_dict(v)
-            active_item = active.get(k)
-            if not active_item:
-                continue
-            mod = {}
-            for vk, val in as_dict(active_item).items():
-                if val != v[vk]:
-                    mod[vk] = val
+        for k in self._modified_ids():
+            mod = self.item_mods(k)
             if mod:
                 modified[k] = mod
         return dict(inserted=inserted, deleted=deleted, modified=modified)
 
     def has_changes(self):
-        for k in self.by_id:
-            if k not in self.original:
-                return True
-        for k in self.original:
-            if k not in self.by_id:
-                return True
-        for k,v in self.original.items():
-            active = self.by_id.get(k)
-            if not active:
-                continue
-            for vk, val in active.items():
-                if val != v.get(vk):
-                    return True
+        if self.added or self.removed:
+            return True
+        return any(self.item_mods(k) for k in self._modified_ids())
 
     def __setitem__(self, key, value):
-        self.add_item(as_object(value))
-        self.original[key] = copy.deepcopy(value)
+        item = value if isinstance(value, FrozenItem) else self.tracked(as_object(value))
+        super().add_item(item)
+        if isinstance(item, (TrackedObject, FrozenItem)):
+            self.original[key] = item
+            self.untracked.discard(key)
+        else:
+            self.original[key] = copy.deepcopy(value)
+            self.untracked.add(key)
+        for ids in (self.touched, self.added, self.removed):
+            ids.discard(key)
+        self._notify(key)
 
     def __contains__(self, an_id):
         return  an_id in self.by_id
 
     def clear(self):
         self.original.clear()
+        for ids in (self.touched, self.added, self.removed, self.untracked):
+            ids.clear()
         super().clear()
+        self._notify(None)
 
     def __getitem__(self, an_id):
         return self.by_id.get(an_id)
@@ -581,8 +1487,71 @@ class CachedByNameId(meta.ByNameId):
     def is_original(self, an_id):
         return an_id in self.original
 
+    def add_item(self, item):
+        item = self.tracked(item)
+        super().add_item(item)
+        an_id = item['id']
+        if an_id in self.original:
+            self.removed.discard(an_id)
+            self.touched.add(an_id)
+        else:
+            self.added.add(an_id)
+        self._notify(an_id)
+
     def remove_item(self, item):
         super().remove_item(item)
+        an_id = item['id']
+        if an_id in self.original:
+            self.removed.add(an_id)
+        else:
+            self.added.discard(an_id)
+        self._notify(an_id)
+
+    def is_dirty(self, an_id):
+        "whether an_id has changes not yet committed"
+        if (an_id in self.added) or (an_id in self.touched) or (an_id in self.removed):
+            return True
+        return (an_id in self.untracked) and bool(self.item_mods(an_id))
+
+    def evict(self, an_id):
+        """
+        Forget a clean item without recording a removal.  It can be loaded
+        again; a later write to the evicted item readmits it as touched.
+        """
+        item = self.by_id.get(an_id)
+        if (item is None) or self.is_dirty(an_id):
+            return False
+        super().remove_item(item)
+        self.original.pop(an_id, None)
+        self.untracked.discard(an_id)
+        if isinstance(item, TrackedObject):
+            object.__setattr__(item, '_evicted', True)
+        return True
+
+    def settle(self):
+        "the current items were persisted: make them the originals"
+        for an_id in self.removed:
+            self.original.pop(an_id, None)
+        changed = self.added | self.touched
+        changed.update(k for k in self.untracked if self.item_mods(k))
+        for an_id in changed:
+            item = self.by_id.get(an_id)
+            if isinstance(item, TrackedObject):
+                self.original[an_id] = item
+                self.untracked.discard(an_id)
+            elif item is not None:
+                self.original[an_id] = copy.deepcopy(item)
+                self.untracked.add(an_id)
+        for ids in (self.touched, self.added, self.removed):
+            ids.clear()
+
+    def mark_new(self, an_id):
+        "treat an item loaded as original as not yet persisted"
+        self.original.pop(an_id, None)
+        for ids in (self.touched, self.removed, self.untracked):
+            ids.discard(an_id)
+        if an_id in self.by_id:
+            self.added.add(an_id)
 
     def delete(self, an_id):
         item = self.get(an_id)
@@ -599,8 +1568,16 @@ class CachedByNameId(meta.ByNameId):
             self[an_id] = data
 
     def modifiable(self, an_id):
-        if an_id in self.original:
-            return self.by_id[an_id]
+        "original item about to be changed in place, including nested values"
+        item = self.by_id.get(an_id) if an_id in self.original else None
+        if isinstance(item, FrozenItem):
+            item = TrackedObject(self, item.thaw())
+            super().add_item(item)
+            self.touched.add(an_id)
+            self._notify(an_id)
+        elif isinstance(item, TrackedObject):
+            self.item_changing(item)
+        return item
 
     def all(self):
         return self.by_id
@@ -612,40 +1589,75 @@ class CachedByNameId(meta.ByNameId):
     
     def mods(self):
         res = {}
-        for obj in self.get_all():
-            oid = obj['id']
-            orig = self.original.get(oid)
-            diffs = {k:v for k,v in obj.items() if orig.get(k) != v}
+        for oid in self._modified_ids():
+            diffs = self.item_mods(oid)
             if diffs:
                 res[oid] = diffs
         return res
 
     def inserts(self):
-        return {k:v for k,v in self._active.items() if k not in self.original}
+        return {k: self.by_id[k] for k in self.added if k in self.by_id}
 
 
 class ClientState:
     # TODO need means to track changes to object assocs or derive it from changeset. Or do we??
+    pushed_kinds = ('roles', 'groups', 'tags', 'queries', 'objects')
+    _stats = None
+    tags_class = AssociatedTags
+    groups_class = AssociatedGroups
+    roles_class = Relationships
+
     @classmethod
     def get_local_pkm_state(cls, dbtype='mongo'):
         loop = asyncio.get_event_loop()
         connect = direct.DirectConnection.connect(dbtype, db_name='pkm_app', schemas=[pkm_schema])
         return cls(ConnectionWrapper(connect))
 
-    def __init__(self, connect:ConnectionWrapper):
+    def __init__(self, connect:ConnectionWrapper, object_limits=None, assoc_limits=None,
+                 meta_map=None, stats=None, compact_sets=False):
+        """
+        :param connect: ConnectionWrapper
+        :param object_limits: CacheLimits for loaded objects, unbounded if None
+        :param assoc_limits: CacheLimits for each association cache map
+        :param meta_map: known current result of connect.meta_map(), e.g. from
+        a snapshot or SharedMetadata, used instead of fetching metadata, also
+        when the caches are cleared
+        :param stats: uopclient.stats.Stats to record database calls and
+        cache use in, not recorded if None
+        :param compact_sets: keep tag and group member sets as OidSets
+        """
+        self._stats = stats
+        if stats is not None:
+            connect = stats.wrap(connect)
         self._connect = connect
         self._context = self._connect.metacontext()
+        self._meta_map = meta_map
+        self.assoc_limits = assoc_limits
+        self.interner = OidInterner() if compact_sets else None
         self._objects = CachedByNameId()
+        self._object_lru = LRUIndex(object_limits, self._objects.evict,
+                                    lambda oid: not self._objects.is_dirty(oid))
+        self._objects.watchers.append(self._object_written)
         self._classes = CachedByNameId()
         self._attributes = CachedByNameId()
         self._tags = CachedByNameId()
         self._groups = CachedByNameId()
         self._roles = CachedByNameId()
         self._queries = CachedByNameId()
-        self.tags = AssociatedTags(self)
-        self.groups = AssociatedGroups(self)
-        self.roles = Relationships(self)
-        self._meta_context = self.refresh_metacontext()
+        self.group_hierarchy = GroupHierarchy(self._groups)
+        self.tags = self.tags_class(self)
+        self.groups = self.groups_class(self)
+        self.roles = self.roles_class(self)
+        self._query_results = ResultCache()
+        self._created_queries = set()  # ids of queries new_query persisted since the last commit
+        for assoc in (self.tags, self.groups, self.roles):
+            assoc.watchers.append(partial(self._assocs_changed, assoc._kind))
+        self._groups.watchers.append(self._group_changed)
+        self._queries.watchers.append(self._saved_query_changed)
+        self._meta_context = self.refresh_metacontext(meta_map)
+        self._meta_map = None
+        self._shared_metas = meta_map
+        self._committed_metas = defaultdict(dict)  # kind -> id -> meta committed over meta_map, None if deleted
         self.tagged_objects = partial(self._associated_objects, self.tags)
         self.grouped_objects = partial(self._associated_objects, self.groups)
         self.related_objects = partial(self._associated_objects, self.roles)
@@ -653,9 +1665,47 @@ class ClientState:
         self.object_group_neighbors = partial(self._object_assocs, self.groups)
         self.object_role_neighbors = partial(self._object_assocs, self.roles)
 
-    def refresh_metacontext(self):
+    def known_metas(self):
+        """
+        The meta_map the state was started with, with the metas it committed
+        since in place, so clearing the caches keeps using, and sharing, its
+        items.  None if started without one.
+        """
+        if self._shared_metas is None:
+            return None
+        res = {}
+        for kind, items in self._shared_metas.items():
+            committed = self._committed_metas.get(kind)
+            if committed:
+                items = dict(items)
+                items.update(committed)
+                items = {k: v for k, v in items.items() if v is not None}
+            res[kind] = items
+        return res
+
+    def _note_committed(self, changes):
+        "record the committed meta changes and metas ensured by name over the starting meta_map"
+        if self._shared_metas is None:
+            return
+        for kind, changeset in changes.items():
+            if kind == 'objects':
+                continue
+            noted, cached = self._committed_metas[kind], getattr(self, f'_{kind}')
+            for an_id in list(changeset['inserted']) + list(changeset['modified']):
+                noted[an_id] = copy.deepcopy(as_dict(cached.get(an_id)))
+            for an_id in changeset['deleted']:
+                noted[an_id] = None
+        for assoc in (self.tags, self.groups, self.roles):
+            shared = self._shared_metas.get(assoc._kind, {})
+            noted = self._committed_metas[assoc._kind]
+            for mid, item in assoc._map.id_map.items():
+                if (mid not in shared) and (mid not in noted):
+                    noted[mid] = copy.deepcopy(as_dict(item))
+
+    def refresh_metacontext(self, meta_map=None):
         kwargs = {}
-        for kind, values in self._connect.meta_map().items():
+        meta_map = meta_map or self._connect.meta_map()
+        for kind, values in meta_map.items():
             cached = getattr(self, f'_{kind}')
             cached.clear()
             cached.add_originals(values)
@@ -674,14 +1724,12 @@ class ClientState:
         cache.add_item(meta)
 
     def group_children(self, gid):
-        res = set()
-        group = self._groups.get(gid)
-        name = group.name
-        direct_children = {g.id for g in self._groups.get_all() if name in g.contained_in}
-        for g_id in direct_children:
-            res.add(g_id)
-            res |= self.group_children(g_id)
-        return res
+        "ids of all groups contained directly or indirectly in group gid"
+        return self.group_hierarchy.descendants(gid)
+
+    def group_ancestors(self, gid):
+        "ids of all groups containing group gid directly or indirectly"
+        return self.group_hierarchy.ancestors(gid)
 
     def possible_group_parents(self, gid):
         all_gids = set(self._groups.all().keys())
@@ -705,11 +1753,21 @@ class ClientState:
 
     def is_persisted(self, kind, an_id):
         cached = getattr(self, f'_{kind}')
+        if (kind == 'objects') and (an_id not in cached):
+            return self.get_object(an_id) is not None  # not created here: persisted if it reads
         return cached.is_original(an_id)
 
+    def persisted_objects(self, oids):
+        "those of oids in the database, the uncached ones read, and cached, together"
+        uncached = [oid for oid in dict.fromkeys(oids) if oid not in self._objects]
+        found = set(self.read_objects(uncached)) if uncached else set()
+        return [oid for oid in oids if (oid in found) or self._objects.is_original(oid)]
+
     def cached_items(self, kind):
         cached = getattr(self, f'_{kind}')
-        persisted = {k: as_dict(v) for k,v in self._connect.id_map(kind).items()}
+        known = self._meta_map and self._meta_map.get(kind)
+        id_map = known if known is not None else self._connect.id_map(kind)
+        persisted = {k: as_dict(v) for k,v in id_map.items()}
         cached.add_originals(persisted)
         return list(cached.all().values())
 
@@ -741,116 +1799,376 @@ class ClientState:
     def context(self):
         return self._connect
 
+    @operation()
     def delete_object(self, oid):
         self.connect.delete_object(oid)
         if oid in self._objects:
             self._objects.delete(oid)
-            self.tags.delete_object(oid)
-            self.groups.delete_object(oid)
-            self.roles.delete_object(oid)
+        self._query_results.forget_object(oid)
+        self.tags.delete_object(oid)
+        self.groups.delete_object(oid)
+        self.roles.delete_object(oid)
 
     def queries(self):
-        res = dict(self._original_queries)
-        res.update(self._live_queries)
-        return res
+        "name -> saved query"
+        return {meta_attr(q, 'name'): q for q in self._queries.get_all()}
 
-    def new_query(self, name):
-        pass
+    def new_query(self, name, expr=None):
+        """
+        saved query named name, storing expr if given.  The query row is
+        persisted at once by ensure_meta_named, so abort deletes it again.
+        """
+        known = name in self._queries.by_name
+        query = self._connect.ensure_meta_named('queries', name)
+        if not known:
+            self._created_queries.add(query.id)
+        self._queries.add_original(query.id, as_dict(query))
+        if expr is not None:
+            self.save_query(name, expr)
+        return self._queries.get(query.id)
 
     def get_query(self, name, create_if_missing=True):
         """
-        fetch query and ensure it is in live queries for tracking changes
+        Saved query named name; changes to it are tracked and pushed on
+        commit like other metas.
         """
-        query = self._live_queries.get(name)
-        if not query:
-            query = self._original_queries.get(name)
-            if query:
-                self._live_queries[name] = query
-
+        query = self._queries.by_name.get(name)
+        if (query is None) and create_if_missing:
+            query = self.new_query(name)
         return query
 
+    def save_query(self, name, expr):
+        "store expr, a uopclient.query expression, as the saved query name"
+        qid = self.get_query(name)['id']
+        query = self._queries.modifiable(qid) or self._queries.get(qid)
+        query['query'] = as_data(expr)
+
+    def delete_query(self, name):
+        query = self.get_query(name, create_if_missing=False)
+        if query is not None:
+            self._queries.delete(query['id'])
+
+    @operation()
+    def run_query(self, name, within=None):
+        """
+        QueryResult of the saved query name.  Results are kept, already
+        evaluated ones with their members and order, until an association
+        the query reads changes; results restricted by within are not kept.
+        Raises KeyError if there is no such query and ValueError if it has
+        no expression saved yet.
+        """
+        query = self.get_query(name, create_if_missing=False)
+        if query is None:
+            raise KeyError(name)
+        if meta_attr(query, 'query') is None:
+            raise ValueError(f'saved query {name} has no expression')
+        qid = query['id']
+        if within is None:
+            known = self._query_results.get(qid)
+            self.count_cache('saved_queries', hits=int(known is not None),
+                             misses=int(known is None))
+            if known is not None:
+                return known
+        expr = from_data(meta_attr(query, 'query'))
+        res = QueryResult(self, expr, within)
+        if within is None:
+            self._query_results.put(qid, res, dependencies(expr))
+        return res
+
+    def _assocs_changed(self, kind, names):
+        if (names is not None) and (kind == 'groups'):
+            hierarchy = self.group_hierarchy
+            names = set(names).union(*(hierarchy.ancestor_names(n) for n in names))
+        self._query_results.changed(kind, names)
+
+    def _group_changed(self, gid, key=None):
+        if key in (None, 'name', 'contained_in'):
+            self._query_results.changed('groups')  # containment may have changed
+
+    def _saved_query_changed(self, qid, key=None):
+        if qid is None:
+            self._query_results.clear()
+        else:
+            self._query_results.discard(qid)
+
+
+    def query(self, expr, within=None):
+        """
+        Lazy result of a boolean expression over tag, group and role
+        membership, see uopclient.query.
+        :param within: oids to restrict the result to, needed for negation
+        with nothing positive to subtract from
+        """
+        return QueryResult(self, expr, within)
+
+    @operation()
+    def neighborhood(self, oid, k=1, names=None):
+        """
+        oid -> hops from oid of everything within k relationships of oid.
+        :param names: role names to follow, all in both directions if None
+        """
+        return graph.neighborhood(self.roles, oid, k, names)
+
+    @operation()
+    def shortest_path(self, source, target, names=None, max_hops=None):
+        "oids along a shortest relationship chain from source to target or None"
+        return graph.shortest_path(self.roles, source, target, names, max_hops)
+
+    @operation()
+    def walk(self, start, path):
+        "oids reached from start following the role names of path in turn"
+        return graph.walk(self.roles, start, path)
 
+    @operation('associated_objects')
     def _associated_objects(self, assoc, name):
         return assoc.for_meta(name)
 
+    @operation('object_assocs')
     def _object_assocs(self, assoc_type, oid, names_only=False):
         raw = assoc_type.for_object(oid)
         if names_only:
             return list(raw.keys())
         return raw
 
+    @operation()
     def begin_transaction(self):
         self._connect.begin_transaction()
 
+    @operation()
     def abort(self):
         self._connect.abort()
+        for qid in self._created_queries:
+            self._connect.meta_delete('queries', qid)
+        self._created_queries.clear()
         self._objects.clear()
         self.txn_clear()
 
-    def push_object_changes(self):
+    def _bulk_or_each(self, bulk_name, each, items, *args):
+        """
+        Sends items with a single call to the named bulk operation of the
+        connection when it has one, else calls each per item.  Dict items
+        are sent whole in bulk and as each(key, value) otherwise.
+        """
+        if not items:
+            return
+        bulk = bulk_method(self._connect, bulk_name)
+        if bulk:
+            bulk(*args, items)
+        elif isinstance(items, dict):
+            for k, v in items.items():
+                each(k, v)
+        else:
+            for item in items:
+                each(item)
+
+    def push_object_changes(self, changes=None):
         """
         This type of local state gathers objects modified in transaction at end
         and pushes thes modifications to the db_context.
+        Each kind of change goes out as one bulk call where the connection
+        supports it, modify_objects, delete_objects and add_objects, and as
+        one call per object otherwise.
         :return: None
         """
-        changes = self._objects.get_changes()
-        for obj in changes['inserted']:
-            self.connect.add_object(obj)
-        for k,mods in changes['modified'].items():
-            self.connect.modify_object(k, mods)
-        for k in changes['deleted']:
-            self.connect.delete_object(k)
+        changes = changes or self._objects.get_changes()
+        connect = self.connect
+        self._bulk_or_each('modify_objects', connect.modify_object, changes['modified'])
+        self._bulk_or_each('delete_objects', connect.delete_object, list(changes['deleted']))
+        self._bulk_or_each('add_objects', connect.add_object, list(changes['inserted'].values()))
 
-
-    def push_mods(self):
+    def push_meta_changes(self, kind, changes):
+        """
+        Push one kind's changeset grouped per operation: one
+        meta_modify_many, meta_delete_many or meta_insert_many call where
+        the connection has it, one call per changed item otherwise.
+        Unchanged items cost nothing since the changeset only holds written
+        ones.
         """
-        Push any modifications not yet pushed to database.
+        connect = self.connect
+        modify = lambda k, mods: connect.meta_modify(kind, k, **mods)
+        delete = partial(connect.meta_delete, kind)
+        self._bulk_or_each('meta_modify_many', modify, changes['modified'], kind)
+        self._bulk_or_each('meta_delete_many', delete, list(changes['deleted']), kind)
+        self._bulk_or_each('meta_insert_many', connect.meta_insert,
+                           list(changes['inserted'].values()))
+
+    def pending_changes(self):
+        "kind -> changeset for each kind that push_mods sends"
+        return {kind: getattr(self, f'_{kind}').get_changes() for kind in self.pushed_kinds}
+
+    def push_mods(self, changes=None):
+        """
+        Push any modifications not yet pushed to database, kind by kind.
+        Changes are grouped per kind and operation so each group is a
+        single bulk call when the connection offers one.
+        :param changes: result of pending_changes, gathered if not given
         :return:
         """
-        for kind in ['roles', 'groups', 'tags', 'objects']:
-            meta = getattr(self, f'_{kind}')
-            changes = meta.get_changes()
-            for k,mods in changes['modified'].items():
-                self.connect.meta_modify(kind, k, **mods)
-            for k in changes['deleted']:
-                self.connect.meta_delete(kind, k)
-            for new_meta in changes['inserted'].values():
-                self.connect.meta_insert(new_meta)
+        changes = changes or self.pending_changes()
+        for kind in self.pushed_kinds:
+            self.push_meta_changes(kind, changes[kind])
 
 
-    def commit(self):
-        self.push_mods()
+    @operation()
+    def commit(self, full_refresh=False):
+        """
+        Push changes and commit.  The caches are then brought up to date
+        from what was pushed rather than reloaded, unless full_refresh or
+        there are changes of kinds that are not pushed.
+        """
+        changes = self.pending_changes()
+        self.push_mods(changes)
         self._connect.commit()
-        self.txn_clear()
+        self._created_queries.clear()
+        self._note_committed(changes)
+        unpushed = (getattr(self, f'_{kind}') for kind in ('classes', 'attributes'))
+        if full_refresh or any(c.has_changes() for c in unpushed):
+            self.txn_clear()
+        else:
+            self.settle(changes)
+
+    def _stale_groups(self, changes):
+        """
+        Names of groups whose recursive member sets are out of date after
+        the group changes: contained or renamed changed groups, under their
+        old and new names, and all groups above them before and after the
+        change.
+        """
+        hierarchy = self.group_hierarchy
+        renamed = {gid for gid, mods in changes['modified'].items() if 'name' in mods}
+        olds = list(changes['deleted'].values())
+        olds.extend(self._groups.original[gid] for gid, mods in changes['modified'].items()
+                    if mods.keys() & {'name', 'contained_in'})
+        news = [self._groups.get(gid) for gid in changes['modified']]
+        news.extend(changes['inserted'].values())
+        res = set()
+        for group in olds + news:
+            if group and (meta_attr(group, 'contained_in') or (meta_attr(group, 'id') in renamed)):
+                res.add(meta_attr(group, 'name'))
+                for parent in meta_attr(group, 'contained_in'):
+                    res.add(parent)
+                    res.update(hierarchy.ancestor_names(parent))
+        return res
+
+    def settle(self, changes):
+        """
+        Fold a committed changeset into the caches: the persisted items
+        become originals, deleted objects leave the association caches and
+        only group member sets the changes made stale are dropped.
+        """
+        stale_groups = self._stale_groups(changes['groups'])
+        for kind in self.pushed_kinds:
+            getattr(self, f'_{kind}').settle()
+        for assoc in (self.tags, self.groups, self.roles):
+            assoc.settle(changes[assoc._kind], getattr(self, f'_{assoc._kind}'))
+            for oid in changes['objects']['deleted']:
+                assoc.delete_object(oid)
+            cached = getattr(self, f'_{assoc._kind}')
+            for mid, meta in assoc._map.id_map.items():
+                cached.add_original(mid, as_dict(meta))  # metas ensured by name
+        self.groups.invalidate(stale_groups)
+        for oid in changes['objects']['deleted']:
+            self._query_results.forget_object(oid)
+        self._object_lru.enforce()
+
+    def count_cache(self, name, hits=0, misses=0):
+        if self._stats is not None:
+            self._stats.cache_access(name, hits, misses)
+
+    def stats_report(self):
+        "recorded stats with cache sizes and evictions, None if not recording"
+        if self._stats is None:
+            return None
+        return dict(self._stats.as_dict(), evictions=self.cache_stats())
+
+    def cache_stats(self):
+        "sizes and eviction counts of the object and association caches"
+        return dict(objects=self._object_lru.stats(),
+                    tags=self.tags.cache_stats(),
+                    groups=self.groups.cache_stats(),
+                    roles=self.roles.cache_stats())
 
     def txn_clear(self):
         self._objects.clear()
-        self.refresh_metacontext()
+        self._object_lru.clear()
+        self.refresh_metacontext(self.known_metas())
         self.tags.clear()
         self.groups.clear()
         self.roles.clear()
 
+    def _object_written(self, oid, key=None):
+        "count written objects, evicted ones readmitted by the write included, against the limits"
+        if (oid is not None) and (oid in self._objects):
+            self._object_lru.touch(oid, self._objects.get(oid))
+
+    def _cache_object(self, oid, obj):
+        self._objects[oid] = obj
+        known = self._objects.get(oid)
+        self._object_lru.touch(oid, known)
+        return known
+
+    @operation()
     def get_object(self, oid):
         known = self._objects.get(oid)
+        self.count_cache('objects', *((1, 0) if known else (0, 1)))
         if not known:
             known = self._connect.get_object(oid)
             if known:
-                self._objects[oid] = known
+                known = self._cache_object(oid, known)
+        else:
+            self._object_lru.touch(oid)
         return known
 
+    @operation()
     def ensure_object(self, oid):
         if oid not in self._objects:
             self.get_object_and_associations(oid)
 
+    @operation()
     def load_objects(self, oids):
-        for oid in oids:
-            self.ensure_object(oid)
+        self.prefetch_objects(oids)
+
+    def db_get_objects(self, oids):
+        "objects of oids in one get_objects call if the connection supports it, else one get_object each"
+        bulk = bulk_method(self._connect, 'get_objects')
+        if bulk:
+            return bulk(oids)
+        return [self._connect.get_object(oid) for oid in oids]
+
+    @operation()
+    def prefetch_objects(self, oids):
+        """
+        Bulk form of ensure_object. Fetches all oids not already loaded along
+        with their tag, group and role associations.  The associations of
+        all of them take one query per association kind and the objects one
+        call, or one per object where the connection has no get_objects.
+        :param oids: iterable of object ids
+        :return: None
+        """
+        wanted = dict.fromkeys(oids)
+        missing = [oid for oid in wanted if oid not in self._objects]
+        self.count_cache('objects', len(wanted) - len(missing), len(missing))
+        if not missing:
+            return
+        loaded = self.read_objects(missing)
+        for assoc in (self.tags, self.groups, self.roles):
+            assoc.load_objects(loaded, persisted=True)
+
+    def read_objects(self, oids):
+        "read and cache the objects of oids, not cached yet, returning the ids found"
+        loaded = []
+        for obj in self.db_get_objects(oids):
+            if obj:
+                self._cache_object(obj['id'], obj)
+                loaded.append(obj['id'])
+        return loaded
 
     def load_instances(self, objects):
         for obj in objects:
             if obj['id'] not in self._objects:
                 self.add_object(obj)
 
+    @operation()
     def get_object_and_associations(self, oid):
         object = self.get_object(oid)
         self.add_object(object)
@@ -861,38 +2179,54 @@ class ClientState:
         )
         return object, assoc_data
 
+    @operation()
+    def get_objects_and_associations(self, oids):
+        "oid -> (object, assoc_data) for oids, prefetching all missing in bulk"
+        self.prefetch_objects(oids)
+        return {oid: self.get_object_and_associations(oid) for oid in oids
+                if oid in self._objects}
+
+    @operation()
     def create_class_instance(self, cls_name, **data) -> dict:
         obj = self._connect.create_instance_of(cls_name, use_defaults=True)
+        obj.update(data)
         return self.add_object(obj, is_new=True)
 
+    @operation()
     def add_object(self, object_data, is_new=False):
         # TODO maybe ensure in database here
         oid = object_data['id']
         if oid in self._objects:
             return object_data
-        self._objects[oid] = object_data
+        self._cache_object(oid, object_data)
         if is_new:
-            self._objects.original.pop(oid)
+            self._objects.mark_new(oid)
         self.tags.add_object(oid)
         self.groups.add_object(oid)
         self.roles.add_object(oid)
         return object_data
 
+    @operation()
     def untag(self, oid, name):
         self.tags.disassociate(oid, name)
 
+    @operation()
     def tag(self, oid, name):
         self.tags.associate(oid, name)
 
+    @operation()
     def group(self, oid, name):
         self.groups.associate(oid, name)
 
+    @operation()
     def ungroup(self, oid, name):
         self.groups.disassociate(oid, name)
 
+    @operation()
     def relate(self, oid, name, other_id):
         self.roles.associate(oid, name, other_id)
 
+    @operation()
     def unrelate(self, oid, name, other_id):
         self.roles.disassociate(oid, name, other_id)
 
@@ -924,13 +2258,54 @@ class ClientState:
 
         )
 
+    @operation()
+    def change_assocs(self, added=(), removed=()):
+        """
+        Bulk add and remove of labeled associations, (kind, assoc) pairs as
+        taken by add_assocs, with one change_many per kind.
+        """
+        by_kind = defaultdict(lambda: ([], []))
+        for kind, assoc in added:
+            by_kind[kind][0].append(assoc)
+        for kind, assoc in removed:
+            by_kind[kind][1].append(assoc)
+        for kind, (adds, removes) in by_kind.items():
+            getattr(self, kind).change_many(adds, removes)
+
+    @operation()
     def add_assocs(self, labeled_assocs):
-        for kind, assoc in labeled_assocs:
-            self.kind_map[kind]['add'](*assoc)
+        self.change_assocs(added=labeled_assocs)
 
+    @operation()
     def remove_assocs(self, labeled_assocs):
-        for kind, assoc in labeled_assocs:
-            self.kind_map[kind]['remove'](*assoc)
+        self.change_assocs(removed=labeled_assocs)
+
+    @operation()
+    def tag_many(self, pairs):
+        "tag each (oid, name) of pairs"
+        self.tags.associate_many(pairs)
+
+    @operation()
+    def untag_many(self, pairs):
+        self.tags.disassociate_many(pairs)
+
+    @operation()
+    def group_many(self, pairs):
+        "group each (oid, name) of pairs"
+        self.groups.associate_many(pairs)
+
+    @operation()
+    def ungroup_many(self, pairs):
+        self.groups.disassociate_many(pairs)
+
+    @operation()
+    def relate_many(self, triples):
+        "relate each (oid, role name, other oid) of triples"
+        self.roles.associate_many(triples)
+
+    @operation()
+    def unrelate_many(self, triples):
+        self.roles.disassociate_many(triples)
 
     def assocs_present(self, labeled_assocs):
         present = True
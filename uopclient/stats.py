@@ -0,0 +1,202 @@
+"""
+Opt-in instrumentation of the database calls a ClientState makes.
+
+Pass a Stats to ClientState(stats=...) to have the connection wrapped so
+every call, including ones on collections such as connect.tagged, is
+counted and timed.  Calls are attributed to the outermost ClientState
+operation in progress (see operation), or to a name given with
+Stats.attribute, so N+1 patterns show up as call counts per operation.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from uopclient.utils.lru import estimate_size
+import bisect
+import functools
+import inspect
+import threading
+import time
+
+current_operation = ContextVar('current_operation', default=None)
+UNATTRIBUTED = 'other'
+BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+PLAIN_TYPES = (str, bytes, int, float, bool, type(None), dict, list, tuple, set, frozenset)
+
+
+class Timing:
+    "count, total and histogram of durations; sizes of results if given"
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.payload_bytes = 0
+        self.max_payload = 0
+
+    def add(self, ms, payload=None):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        if payload is not None:
+            self.payload_bytes += payload
+            self.max_payload = max(self.max_payload, payload)
+
+    def histogram(self):
+        labels = [f'<={b}ms' for b in BUCKETS_MS] + [f'>{BUCKETS_MS[-1]}ms']
+        return {l: n for l, n in zip(labels, self.buckets) if n}
+
+    def as_dict(self):
+        return dict(count=self.count, total_ms=self.total_ms,
+                    mean_ms=self.total_ms / self.count if self.count else 0.0,
+                    max_ms=self.max_ms, histogram=self.histogram(),
+                    payload_bytes=self.payload_bytes, max_payload=self.max_payload)
+
+
+class Stats:
+    """
+    Collected timings of operations and of the connection calls made
+    within them plus hit and miss counts of the state's caches.
+    """
+
+    def __init__(self, sizer=estimate_size):
+        self._sizer = sizer
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.operations = defaultdict(Timing)  # op -> Timing
+        self.calls = defaultdict(lambda: defaultdict(Timing))  # op -> method -> Timing
+        self.caches = defaultdict(lambda: [0, 0])  # cache name -> [hits, misses]
+
+    def wrap(self, connect):
+        return InstrumentedConnection(connect, self)
+
+    @contextmanager
+    def attribute(self, name):
+        "attribute calls made in the block to operation name"
+        token = current_operation.set(name)
+        try:
+            yield
+        finally:
+            current_operation.reset(token)
+
+    def record_call(self, method, ms, result):
+        op = current_operation.get() or UNATTRIBUTED
+        size = self._sizer(result)
+        with self._lock:
+            self.calls[op][method].add(ms, size)
+
+    def record_operation(self, name, ms):
+        with self._lock:
+            self.operations[name].add(ms)
+
+    def cache_access(self, name, hits=0, misses=0):
+        with self._lock:
+            counts = self.caches[name]
+            counts[0] += hits
+            counts[1] += misses
+
+    def call_counts(self):
+        "op -> total number of connection calls made"
+        return {op: sum(t.count for t in methods.values()) for op, methods in self.calls.items()}
+
+    def as_dict(self):
+        ops = {}
+        for op in set(self.operations) | set(self.calls):
+            timing = self.operations.get(op)
+            data = timing.as_dict() if timing else {}
+            data['calls'] = {m: t.as_dict() for m, t in self.calls.get(op, {}).items()}
+            ops[op] = data
+        caches = {}
+        for name, (hits, misses) in self.caches.items():
+            total = hits + misses
+            caches[name] = dict(hits=hits, misses=misses,
+                                hit_ratio=hits / total if total else None)
+        return dict(operations=ops, caches=caches)
+
+
+class InstrumentedConnection:
+    """
+    Proxy of a connection recording each call made through it in stats.
+    Attributes that are objects, e.g. collections, are proxied in turn with
+    dotted method names.
+    """
+
+    def __init__(self, target, stats, prefix=''):
+        self._target = target
+        self._stats = stats
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        full_name = f'{self._prefix}{name}'
+        if callable(value):
+            return self._timed(full_name, value)
+        if isinstance(value, PLAIN_TYPES):
+            return value
+        return InstrumentedConnection(value, self._stats, f'{full_name}.')
+
+    def _timed(self, name, fn):
+        stats = self._stats
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            res = fn(*args, **kwargs)
+            if inspect.isawaitable(res):
+                return awaited(res, start)
+            stats.record_call(name, (time.perf_counter() - start) * 1000, res)
+            return res
+
+        async def awaited(pending, start):
+            res = await pending
+            stats.record_call(name, (time.perf_counter() - start) * 1000, res)
+            return res
+        return call
+
+    def __repr__(self):
+        return f'InstrumentedConnection({self._target!r})'
+
+
+def operation(name=None):
+    """
+    Decorator for ClientState methods that are operations calls are
+    attributed to.  Does nothing unless the state has stats or when an
+    enclosing operation is already in progress.
+    """
+    def wrap(fn):
+        op_name = name or fn.__name__
+
+        def begin(self):
+            if (self._stats is None) or (current_operation.get() is not None):
+                return None
+            return current_operation.set(op_name), time.perf_counter()
+
+        def end(self, started):
+            token, start = started
+            current_operation.reset(token)
+            self._stats.record_operation(op_name, (time.perf_counter() - start) * 1000)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(self, *args, **kwargs):
+                started = begin(self)
+                try:
+                    return await fn(self, *args, **kwargs)
+                finally:
+                    if started:
+                        end(self, started)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            started = begin(self)
+            try:
+                return fn(self, *args, **kwargs)
+            finally:
+                if started:
+                    end(self, started)
+        return wrapper
+    return wrap
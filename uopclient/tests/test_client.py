@@ -1,12 +1,34 @@
 from uop.connect.uop_connect import register_adaptor, ConnectionWrapper
 from uopclient import state
+from uopclient.async_state import AsyncClientState
+from uopclient.threaded import ThreadSafeClientState
+from uopclient.utils.lru import CacheLimits
+from uopclient import snapshot
+from uopclient.shared import SharedMetadata
+from uopclient.stats import Stats
+from uopclient.utils.oidset import OidSet
+from uopclient.utils.lazy import LazyAssocs, DeltaSet, is_pending
+from uopclient.query import tag, group, as_data, from_data
+from uopclient.loaders.bookmarks import iter_json_bookmarks, iter_html_bookmarks, \
+    BookmarkImporter, BookmarkRecord
+from uopclient.loaders.urls import UrlIndex, normalize_url
+from uopclient.utils.misc import ReadThroughCache
+from uopclient.bench.__main__ import main as bench_main
 from uop.connect import direct
 from uopmeta.schemas.meta import ByNameId, WorkingContext
 from sjautils import dicts
 from sqluop import adaptor
 from uopmeta.oid import oid_class
+import asyncio
 import random
+import tempfile
+import threading
+import time
+import os
+import io
+import json
 from collections import defaultdict
+from collections.abc import Set
 
 set_dict = lambda: defaultdict(set)
 dict_dict = lambda: defaultdict(set_dict)
@@ -291,7 +313,7 @@ class FromState(DataSource):
     def load_associated(self):
         def load_assocs(assoc_objects, object_assocs, source):
             for name, data in source.by_meta.items():
-                if isinstance(data, set):
+                if isinstance(data, Set):
                     assoc_objects[name] = set(data)
                 else:
                     assoc_objects[name] = dict(data)
@@ -319,6 +341,18 @@ def check_persisted():
 
     EquivalenceCheck(FromDB(), FromWorkingContext(base_data))
 
+def check_is_persisted():
+    checking = state.ClientState(wrapper)
+    oid = random_member([o['id'] for o in base_data.instances])
+    assert checking.is_persisted('objects', oid)  # read to find out
+    assert oid in checking._objects
+    unsaved = wrapper.create_instance_of('DescribedComponent', use_defaults=True)['id']
+    assert not checking.is_persisted('objects', unsaved)
+    checking.begin_transaction()
+    created = checking.create_class_instance('DescribedComponent')
+    assert not checking.is_persisted('objects', created['id'])
+    checking.abort()
+
 def check_associate():
     local_state.abort() # clear previous test data
     local_state.begin_transaction()
@@ -406,6 +440,34 @@ def check_disassociate():
     local_state.commit()
     assert FromDB().assocs_not_present(params)
 
+def check_back_refs():
+    refs = state.ClientState(wrapper)
+    oids = [o['id'] for o in base_data.instances]
+    refs.load_objects(oids)
+    name = random_member([n for n in base_data.tags.by_name if refs.tagged_objects(n)])
+    members = set(refs.tagged_objects(name))
+    assert all((name, None) in refs.tags._refs[oid] for oid in members)
+    for oid in oids:
+        for role, related in refs.roles.for_object(oid).items():
+            assert all((role, oid) in refs.roles._refs[other] for other in related)
+    victim = random_member(members)
+    refs.tags.delete_object(victim)  # cache only, found through its refs
+    assert victim not in refs.tagged_objects(name)
+    assert not refs.tags.object_present(victim)
+
+    roles = wrapper.name_map('roles')
+    pairs = [(n, a, b) for n, subs in FromDB().related.items() if n in roles
+             for a, others in subs.items() for b in others if a != b]
+    role, subject, other = random_member(pairs)
+    fresh = state.ClientState(wrapper)
+    fresh.begin_transaction()
+    fresh.roles.for_object(subject)
+    fresh.unrelate(subject, role, other)
+    assert other not in fresh.roles.by_object  # not cached as having no relations
+    assert subject not in fresh.roles.for_object(other).get(roles[role].reverse_name, ())
+    fresh.relate(subject, role, other)
+    fresh.commit()
+
 def check_deletes():
     local_state.abort()
     oids = [o['id'] for o in base_data.instances]
@@ -437,28 +499,731 @@ def check_mods():
         obj['description'] = 'modded object'
         assert(mod['description'] != obj['description'])
     local_state.commit()
+    assert not local_state.has_changes
+    assert all(mod_id in local_state._objects for mod_id in to_mod)  # kept after commit
     local_state.load_objects(oids)
     for mod_id in to_mod:
         obj = local_state.get_object(mod_id)
         assert obj['description'] == 'modded object'
 
+def check_pushes():
+    stats = Stats()
+    pushing = state.ClientState(wrapper, stats=stats)
+    pushing.begin_transaction()
+    to_mod = random.sample([o['id'] for o in base_data.instances], 3)
+    before = {oid: pushing.get_object(oid)['description'] for oid in to_mod}
+    for oid in to_mod:
+        pushing.get_object(oid)['description'] = 'pushed object'
+    pushing.commit()
+    calls = stats.calls['commit']
+    assert calls['meta_modify'].count == len(to_mod)  # one per written object only
+    assert not calls.keys() & {'meta_insert', 'meta_delete'}
+    fresh = state.ClientState(wrapper)
+    assert all(fresh.get_object(oid)['description'] == 'pushed object' for oid in to_mod)
+
+    # connections with bulk writes get one call per kind of change
+    stats = Stats()
+    bulk = state.ClientState(BulkConnection(wrapper), stats=stats)
+    bulk.begin_transaction()
+    for oid, desc in before.items():
+        bulk.get_object(oid)['description'] = desc
+    bulk.commit()
+    calls = stats.calls['commit']
+    assert calls['meta_modify_many'].count == 1 and 'meta_modify' not in calls
+    fresh = state.ClientState(wrapper)
+    assert all(fresh.get_object(oid)['description'] == desc for oid, desc in before.items())
+
+def check_change_tracking():
+    local_state.abort()
+    local_state.begin_transaction()
+    oids = [o['id'] for o in base_data.instances]
+    local_state.load_objects(oids)
+    assert not local_state.has_changes
+    obj = local_state.get_object(random_member(oids))
+    obj['description'] = obj.get('description')
+    assert not local_state.has_changes
+    obj['description'] = 'tracked change'
+    changes = local_state._objects.get_changes()
+    assert changes['modified'] == {obj['id']: {'description': 'tracked change'}}
+    assert not (changes['inserted'] or changes['deleted'])
+    local_state.abort()
+
+def check_cache_limits():
+    limits = CacheLimits(max_entries=3)
+    bounded = state.ClientState(wrapper, object_limits=limits, assoc_limits=limits)
+    bounded.begin_transaction()
+    oids = [o['id'] for o in base_data.instances]
+    changed = bounded.get_object(oids[0])
+    changed['description'] = 'kept while dirty'
+    for oid in oids[1:]:
+        bounded.get_object_and_associations(oid)
+    stats = bounded.cache_stats()
+    assert stats['objects']['entries'] <= 3 and stats['objects']['evictions']
+    assert stats['tags']['by_object']['entries'] <= 3
+    assert bounded.get_object(oids[0]) is changed
+    bounded.abort()
+
+    # entries pinned by changes fill the limits: new entries are still served
+    reference = state.ClientState(wrapper)
+    tight = CacheLimits(max_entries=2)
+    pinned = state.ClientState(wrapper, object_limits=tight, assoc_limits=tight)
+    pinned.begin_transaction()
+    t1, t2 = random.sample(list(base_data.tags.by_name), 2)
+    pinned.tag(oids[0], t1)
+    pinned.tag(oids[1], t2)
+    for oid in oids[2:8]:
+        assert set(pinned.tags.for_object(oid)) == set(reference.tags.for_object(oid))
+    for name in base_data.tags.by_name:
+        assert set(pinned.tagged_objects(name)) == set(reference.tagged_objects(name))
+    pinned.abort()
+
+    # an evicted object written to is counted against the limits again
+    evicted = bounded.get_object(oids[0])
+    for oid in oids[1:5]:
+        bounded.get_object(oid)
+    evicted['description'] = 'readmitted'
+    entries = bounded.cache_stats()['objects']['entries']
+    assert entries <= 3 and entries == len(bounded._objects.all())
+    assert bounded.get_object(oids[0]) is evicted
+    bounded.abort()
+
+    # member sets object entries have read are not evicted, so they cannot split
+    limited = state.ClientState(wrapper, assoc_limits=CacheLimits(max_entries=2))
+    name, *others = random.sample([n for n in base_data.tags.by_name
+                                   if local_state.tagged_objects(n)], 3)
+    holder = random_member(list(local_state.tagged_objects(name)))
+    read = limited.tags.for_object(holder)[name]
+    for other in others:
+        limited.tagged_objects(other)
+    assert limited.tags.by_meta.get(name) is read
+    added = random_member([oid for oid in oids if oid not in read])
+    limited.begin_transaction()
+    limited.tag(added, name)
+    assert added in limited.tags.for_object(holder)[name]
+    limited.untag(added, name)
+    limited.commit()
+
+def check_snapshot():
+    oids = [o['id'] for o in base_data.instances]
+    local_state.load_objects(oids)
+    path = os.path.join(tempfile.mkdtemp(), 'state.snap')
+    snapshot.save_snapshot(local_state, path, token='rev-1')
+    warm = snapshot.load_snapshot(wrapper, path, token='rev-1')
+    assert set(oids) <= set(warm._objects.all())
+    EquivalenceCheck(FromDB(), FromState(warm))()
+    cold = snapshot.load_snapshot(wrapper, path, token='rev-2')
+    assert not cold._objects.all()
+    shared = SharedMetadata.from_snapshot(path, 'rev-1')
+    assert len(shared) == sum(len(v) for v in wrapper.meta_map().values())
+    assert SharedMetadata.from_snapshot(path, 'rev-2') is None
+    for token in (None, ''):  # no token, no snapshot
+        for call in (lambda: snapshot.save_snapshot(local_state, path, token),
+                     lambda: snapshot.load_snapshot(wrapper, path, token)):
+            try:
+                call()
+            except ValueError:
+                continue
+            assert False, 'snapshot used without a token'
+    with open(path, 'r+b') as f:  # payload that is not data
+        f.seek(snapshot.HEADER.size + len('rev-1'))
+        f.write(b'\x80\x04cos\nsystem\n')
+    assert not snapshot.load_snapshot(wrapper, path, token='rev-1')._objects.all()
+
+def check_instrumentation():
+    stats = Stats()
+    measured = state.ClientState(wrapper, stats=stats)
+    oids = [o['id'] for o in base_data.instances]
+    measured.load_objects(oids)
+    loaded = stats.call_counts()['load_objects']
+    measured.load_objects(oids)
+    assert stats.call_counts()['load_objects'] == loaded  # all cached now
+    report = measured.stats_report()
+    assert report['caches']['objects']['hits'] == len(oids)
+    assert 'evictions' in report
+
+class BulkConnection:
+    "connection with the optional bulk operations, made of the per-item calls"
+
+    def __init__(self, connect):
+        self._connect = connect
+
+    def __getattr__(self, name):
+        return getattr(self._connect, name)
+
+    def get_objects(self, oids):
+        return [self._connect.get_object(oid) for oid in oids]
+
+    def get_tagsets(self, tids, recursive=False):
+        return {tid: self._connect.get_tagset(tid, recursive=recursive) for tid in tids}
+
+    def meta_modify_many(self, kind, mods):
+        for an_id, changed in mods.items():
+            self._connect.meta_modify(kind, an_id, **changed)
+
+    def meta_delete_many(self, kind, ids):
+        for an_id in ids:
+            self._connect.meta_delete(kind, an_id)
+
+    def meta_insert_many(self, items):
+        for item in items:
+            self._connect.meta_insert(item)
+
+    def tag_many(self, tid, oids):
+        for oid in oids:
+            self._connect.tag(oid, tid)
+
+    def untag_many(self, tid, oids):
+        for oid in oids:
+            self._connect.untag(oid, tid)
+
+    def group_many(self, gid, oids):
+        for oid in oids:
+            self._connect.group(oid, gid)
+
+    def ungroup_many(self, gid, oids):
+        for oid in oids:
+            self._connect.ungroup(oid, gid)
+
+    def relate_many(self, rid, pairs):
+        for oid, other in pairs:
+            self._connect.relate(oid, rid, other)
+
+    def unrelate_many(self, rid, pairs):
+        for oid, other in pairs:
+            self._connect.unrelate(oid, rid, other)
+
+def check_change_many():
+    stats = Stats()
+    batched = state.ClientState(wrapper, stats=stats)
+    oids = [o['id'] for o in base_data.instances]
+    names = list(base_data.tags.by_name)
+    new = [(oid, name) for oid in oids for name in names
+           if name not in local_state.tags.for_object(oid)][:4]
+    batched.begin_transaction()
+    batched.change_assocs(added=[('tags', p) for p in new + new[:2]],
+                          removed=[('tags', new[-1])])  # added and removed cancels out
+    calls = stats.calls['change_assocs']
+    assert calls['tag'].count == len(new) - 1 and 'untag' not in calls
+    for oid, name in new[:-1]:
+        assert oid in batched.tagged_objects(name)
+    assert new[-1][0] not in batched.tagged_objects(new[-1][1])
+    batched.change_assocs(removed=[('tags', p) for p in new[:-1]])
+    assert calls['untag'].count == len(new) - 1
+    batched.commit()
+
+    # connections with bulk writes get one call per name
+    stats = Stats()
+    bulk = state.ClientState(BulkConnection(wrapper), stats=stats)
+    bulk.begin_transaction()
+    bulk.change_assocs(added=[('tags', p) for p in new])
+    calls = stats.calls['change_assocs']
+    written = len({name for _, name in new})
+    assert calls['tag_many'].count == written and 'tag' not in calls
+    fresh = state.ClientState(wrapper)
+    for oid, name in new:
+        assert oid in fresh.tagged_objects(name) and oid in bulk.tagged_objects(name)
+    bulk.change_assocs(removed=[('tags', p) for p in new])
+    assert calls['untag_many'].count == written and 'untag' not in calls
+    bulk.commit()
+    fresh = state.ClientState(wrapper)
+    assert not any(oid in fresh.tagged_objects(name) for oid, name in new)
+
+def check_batched_loads():
+    stats = Stats()
+    batched = state.ClientState(wrapper, stats=stats)
+    oids = [o['id'] for o in base_data.instances]
+    batched.load_objects(oids + oids[:3])
+    calls = {m: t.count for m, t in stats.calls['load_objects'].items()}
+    assert calls.pop('get_object') == len(oids)  # no get_objects on this connection
+    assert calls == {'tagged.find': 1, 'grouped.find': 1, 'related.find': 2}  # per kind, not per oid
+    batched.load_objects(oids)
+    assert sum(t.count for t in stats.calls['load_objects'].values()) == len(oids) + 4
+    EquivalenceCheck(FromDB(), FromState(batched))()
+    stats = Stats()
+    bulk = state.ClientState(BulkConnection(wrapper), stats=stats)
+    bulk.load_objects(oids)
+    calls = {m: t.count for m, t in stats.calls['load_objects'].items()}
+    assert calls == {'get_objects': 1, 'tagged.find': 1, 'grouped.find': 1, 'related.find': 2}  # objects batched too
+    EquivalenceCheck(FromDB(), FromState(bulk))()
+
+def check_compact_sets():
+    compact = state.ClientState(wrapper, compact_sets=True)
+    oids = [o['id'] for o in base_data.instances]
+    compact.load_objects(oids)
+    EquivalenceCheck(FromDB(), FromState(compact))()
+    assert all(isinstance(v, OidSet) for v in compact.tags.by_meta.values())
+
+def check_lazy_assocs():
+    lazy = state.ClientState(wrapper)
+    oid = next(o['id'] for o in base_data.instances if local_state.tags.for_object(o['id']))
+    tags = lazy.tags.for_object(oid)
+    assert tags and not lazy.tags.by_meta  # names known, no member sets fetched
+    name = next(iter(tags))
+    assert set(tags[name]) == set(local_state.tagged_objects(name))
+    assert name in lazy.tags.by_meta
+    unread = LazyAssocs(lazy.tags, oid, list(base_data.tags.by_name))
+    fetched = set(lazy.tags.by_meta)
+    for name in list(unread):
+        unread.pop(name)  # dropped without computing members
+    assert not unread and set(lazy.tags.by_meta) == fetched
+
+def check_delta_sets():
+    delta = state.ClientState(wrapper)
+    oid = random_member({o['id'] for o in base_data.instances})
+    name = random_member(set(base_data.tags.by_name))
+    before = set(local_state.tagged_objects(name))
+    delta.tag(oid, name)
+    assert not delta.tags.by_meta[name].loaded  # tagged without fetching the tag
+    assert set(delta.tagged_objects(name)) == before | {oid}
+    if oid not in before:
+        delta.untag(oid, name)
+
+    removal = state.ClientState(wrapper)
+    name = random_member([n for n in base_data.tags.by_name if local_state.tagged_objects(n)])
+    members = set(local_state.tagged_objects(name))
+    oid = random_member(members)
+    assert name in removal.tags.for_object(oid)
+    removal.untag(oid, name)
+    cached = removal.tags.by_meta
+    assert (name not in cached) or is_pending(cached[name])  # untagged without fetching
+    assert name not in removal.tags.for_object(oid)
+    assert set(removal.tagged_objects(name)) == members - {oid}
+    removal.tag(oid, name)
+
+def check_graph():
+    oid = random_member({o['id'] for o in base_data.instances})
+    direct = {o for oids in local_state.roles.for_object(oid).values() for o in oids}
+    hops = local_state.neighborhood(oid, 2)
+    assert {o for o, n in hops.items() if n == 1} == direct - {oid}
+    for other in direct - {oid}:
+        assert local_state.shortest_path(oid, other) == [oid, other]
+    for name, oids in local_state.roles.for_object(oid).items():
+        assert local_state.walk(oid, [name]) == set(oids)
+
+class SlowReads:
+    "connection whose fetches take long enough for other threads to miss meanwhile"
+
+    def __init__(self, connect, delay=0.002):
+        self._connect = connect
+        self._delay = delay
+
+    def __getattr__(self, name):
+        found = getattr(self._connect, name)
+        if not (name.startswith('get_') and callable(found)):
+            return found
+        def slow(*args, **kwargs):
+            res = found(*args, **kwargs)
+            time.sleep(self._delay)
+            return res
+        return slow
+
+def check_thread_safe():
+    shared = ThreadSafeClientState(wrapper)
+    oids = [o['id'] for o in base_data.instances]
+    shared.load_objects(oids)
+    EquivalenceCheck(FromDB(), FromState(shared))()
+    name = random_member(set(base_data.tags.by_name))
+    assert shared.tagged_objects(name) == set(local_state.tagged_objects(name))
+
+    # concurrent misses fetch each key once while another thread writes
+    stats = Stats()
+    shared = ThreadSafeClientState(SlowReads(wrapper), stats=stats)
+    names = list(base_data.tags.by_name)
+    new = [(oid, n) for oid in oids for n in names if n not in local_state.tags.for_object(oid)][:10]
+    readers = 6
+    start = threading.Barrier(readers + 1)
+    seen, errors = [], []
+    def read():
+        start.wait()
+        for oid in random.sample(oids, len(oids)):
+            shared.get_object(oid)
+        seen.append({n: shared.tagged_objects(n) for n in random.sample(names, len(names))})
+    def write():
+        start.wait()
+        for oid, n in new:
+            shared.tag(oid, n)
+            shared.untag(oid, n)
+    def run(fn):
+        try:
+            fn()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(fn,)) for fn in [read] * readers + [write]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    fetched = defaultdict(int)
+    for methods in stats.calls.values():
+        for method, timing in methods.items():
+            fetched[method] += timing.count
+    assert fetched['get_object'] == len(oids)
+    assert fetched['get_tagset'] == len(names)
+    for found in seen:
+        for n in names:
+            assert found[n] <= set(local_state.tagged_objects(n)) | {o for o, t in new if t == n}
+    EquivalenceCheck(FromDB(), FromState(shared))()
+
+def check_group_renames():
+    renaming = state.ClientState(wrapper)
+    parent, child = random.sample(list(base_data.groups.by_name), 2)
+    pid, cid = (renaming._groups.by_name[n]['id'] for n in (parent, child))
+    def edit(gid, **values):
+        renaming.begin_transaction()
+        renaming._groups.modifiable(gid).update(values)
+        renaming.commit()
+    was_in = list(renaming._groups.get(cid).get('contained_in') or [])
+    edit(cid, contained_in=[parent])
+    assert set(renaming.grouped_objects(child)) <= set(renaming.grouped_objects(parent))
+    renaming.begin_transaction()
+    renaming._groups.modifiable(pid)['name'] = parent + '_renamed'
+    stale = renaming._stale_groups(renaming.pending_changes()['groups'])
+    assert {parent, parent + '_renamed'} <= stale  # renamed without a parent of its own
+    renaming.commit()
+    assert parent not in renaming.groups.by_meta
+    fresh = state.ClientState(wrapper)
+    for name in (parent + '_renamed', child):
+        assert set(renaming.grouped_objects(name)) == set(fresh.grouped_objects(name))
+    edit(pid, name=parent)
+    edit(cid, contained_in=was_in)
+    assert set(renaming.grouped_objects(parent)) == set(local_state.grouped_objects(parent))
+
+def check_group_commits():
+    committing = state.ClientState(wrapper)
+    hierarchy = committing.group_hierarchy
+    names = list(base_data.groups.by_name)
+    parent, child = random_member([(p, c) for p in names for c in names
+                                   if (p != c) and (p not in hierarchy.descendant_names(c))])
+    cid = committing._groups.by_name[child]['id']
+    was_in = list(committing._groups.get(cid).get('contained_in') or [])
+    committing.begin_transaction()
+    committing._groups.modifiable(cid)['contained_in'] = was_in + [parent]
+    committing.commit()
+    outside = [o['id'] for o in base_data.instances
+               if o['id'] not in committing.grouped_objects(parent)]
+    holder, added = random.sample(outside, 2)
+    committing.begin_transaction()
+    committing.group(holder, child)
+    committing.commit()
+    assert holder in committing.grouped_objects(parent)  # cached above the changed group
+    assert holder not in committing.groups.for_object(holder)[child]  # read before the next change
+    committing.begin_transaction()
+    committing.group(added, child)
+    committing.commit()
+    assert added in committing.grouped_objects(parent)
+    assert added in committing.groups.for_object(holder)[child]  # neighbour copy refreshed
+    fresh = state.ClientState(wrapper)
+    for name in (parent, child):
+        assert set(committing.grouped_objects(name)) == set(fresh.grouped_objects(name))
+    committing.begin_transaction()
+    committing.ungroup(holder, child)
+    committing.ungroup(added, child)
+    committing._groups.modifiable(cid)['contained_in'] = was_in
+    committing.commit()
+    assert set(committing.grouped_objects(parent)) == set(local_state.grouped_objects(parent))
+
+def check_nested_edits():
+    editing = state.ClientState(wrapper)
+    hierarchy = editing.group_hierarchy
+    names = list(base_data.groups.by_name)
+    parent, child = random_member([(p, c) for p in names for c in names
+                                   if (p != c) and (p not in hierarchy.descendant_names(c))])
+    cid = editing._groups.by_name[child]['id']
+    was_in = list(editing._groups.get(cid).get('contained_in') or [])
+    editing.begin_transaction()
+    editing._groups.modifiable(cid)['contained_in'] = list(was_in)
+    editing.commit()
+    editing.begin_transaction()
+    editing._groups.get(cid)['contained_in'].append(parent)
+    assert editing.has_changes
+    changes = editing._groups.get_changes()
+    assert changes['modified'] == {cid: {'contained_in': was_in + [parent]}}
+    assert parent in hierarchy.ancestor_names(child)
+    editing.commit()
+    fresh = state.ClientState(wrapper)
+    assert parent in fresh._groups.get(cid)['contained_in']
+    assert set(editing.grouped_objects(child)) <= set(editing.grouped_objects(parent))
+    editing.begin_transaction()
+    editing._groups.get(cid)['contained_in'].remove(parent)
+    editing.commit()
+    fresh = state.ClientState(wrapper)
+    assert hierarchy.ancestor_names(child) == fresh.group_hierarchy.ancestor_names(child)
+    assert set(editing.grouped_objects(parent)) == set(local_state.grouped_objects(parent))
+
+def check_shared_meta():
+    shared = SharedMetadata(wrapper.meta_map())
+    first, second = shared.state(wrapper), shared.state(wrapper)
+    gid = random_member(set(base_data.groups.by_id))
+    assert first._groups.get(gid) is second._groups.get(gid)
+    editable = first._groups.modifiable(gid)
+    editable['name'] = editable['name'] + '_local'
+    assert second._groups.get(gid)['name'] != editable['name']
+    assert first._groups.item_mods(gid) == {'name': editable['name']}
+    first.abort()
+    assert first._groups.get(gid) is second._groups.get(gid)  # still shared after clearing
+    other = random_member(set(base_data.groups.by_id) - {gid})
+    first.begin_transaction()
+    first._groups.modifiable(other)['name'] += '_committed'
+    first.commit(full_refresh=True)
+    assert first._groups.get(gid) is second._groups.get(gid)
+    assert first._groups.get(other)['name'] == second._groups.get(other)['name'] + '_committed'
+    first.begin_transaction()
+    first._groups.modifiable(other)['name'] = second._groups.get(other)['name']
+    first.commit()
+    first.abort()
+    assert first._groups.get(gid) is second._groups.get(gid)
+    assert first._groups.get(other) == second._groups.get(other).thaw()
+
+def check_bookmark_import():
+    importer = BookmarkImporter(wrapper, batch_size=5)
+    folder = random_member(list(base_data.groups.by_name))
+    before = set(local_state.grouped_objects(folder))
+    records = [BookmarkRecord((folder,), f'https://import{i}.org', tags=['imported'])
+               for i in range(23)]
+    assert importer.run(records) == len(records) and importer.batches == 5
+    imported = importer.state
+    assert not (imported.groups.by_meta.keys() | imported.tags.by_meta.keys())  # released
+    assert not (imported.groups._refs or imported.tags._refs)
+    fresh = state.ClientState(wrapper)
+    created = set(fresh.grouped_objects(folder)) - before
+    assert len(created) == len(records) == len(fresh.tagged_objects('imported'))
+    fresh.begin_transaction()
+    for oid in created:
+        fresh.delete_object(oid)
+    fresh.commit()
+
+def check_query():
+    t1, t2 = random.sample(list(base_data.tags.by_name), 2)
+    g = random_member(set(base_data.groups.by_name))
+    tagged = lambda name: set(local_state.tagged_objects(name))
+    grouped = set(local_state.grouped_objects(g))
+    result = local_state.query((tag(t1) | tag(t2)) - group(g))
+    assert set(result) == (tagged(t1) | tagged(t2)) - grouped
+    assert result.page(0, 2) == sorted(result)[:2]
+    for connect, fetches in ((wrapper, {'get_tagset': 2}), (BulkConnection(wrapper), {'get_tagsets': 1})):
+        stats = Stats()
+        querying = state.ClientState(connect, stats=stats)
+        assert set(querying.query((tag(t1) | tag(t2)) - group(g))) == set(result)
+        calls = {m: t.count for m, t in stats.calls['query'].items()}
+        assert calls == dict(fetches, **{'grouped.find': 1})  # terms fetched together per kind
+
+def check_saved_queries():
+    t1, t2 = random.sample(list(base_data.tags.by_name), 2)
+    expr = tag(t1) - tag(t2)
+    assert as_data(from_data(as_data(expr))) == as_data(expr)
+    local_state.new_query('saved', tag(t1))
+    local_state.save_query('other', tag(t2))
+    first, other = local_state.run_query('saved'), local_state.run_query('other')
+    assert set(first) == set(local_state.tagged_objects(t1))
+    assert local_state.run_query('saved') is first  # memoized
+    oid = random_member({o['id'] for o in base_data.instances} - set(first))
+    local_state.tag(oid, t1)
+    assert oid in local_state.run_query('saved')
+    assert local_state.run_query('other') is other  # t2 untouched
+    local_state.untag(oid, t1)
+    local_state.get_query('empty')
+    try:
+        local_state.run_query('empty')
+        assert False, 'ran a query without an expression'
+    except ValueError as e:
+        assert 'empty' in str(e)
+    aborted = state.ClientState(wrapper)
+    aborted.begin_transaction()
+    aborted.new_query('aborted', tag(t1))
+    aborted.abort()
+    assert aborted.get_query('aborted', create_if_missing=False) is None
+    assert state.ClientState(wrapper).get_query('aborted', create_if_missing=False) is None
+
 def check_fetches():
     oids = {o['id'] for o in base_data.instances}
     local_state.load_objects(oids)
     EquivalenceCheck(FromWorkingContext(base_data), FromState(local_state))()
 
+async def check_async_fetches():
+    # sqlite connections stay on the loop thread
+    async_state = await AsyncClientState.create(wrapper, threaded=False)
+    oids = [o['id'] for o in base_data.instances]
+    await async_state.aload_objects(oids)
+    EquivalenceCheck(FromDB(), FromState(async_state))()
+    obj, assocs = await async_state.aget_object_and_associations(oids[0])
+    assert obj['id'] == oids[0]
+    assert assocs['tags'] is async_state.tags.for_object(oids[0])
+    for kind in ('tags', 'groups'):
+        used = assocs[kind]
+        assert set(used.loaded()) == set(used)  # member sets read without blocking the loop
+    name = random_member([n for n in base_data.tags.by_name if async_state.tagged_objects(n)])
+    tagged = random_member(list(async_state.tagged_objects(name)))
+    lazy = await AsyncClientState.create(wrapper, threaded=False)
+    assert await lazy.tags.amember_value(tagged, name) == set(async_state.tagged_objects(name))
+    assert name in lazy.tags.by_meta
+
+    # fills wait for a write in progress to finish
+    filling = await AsyncClientState.create(wrapper, threaded=False)
+    name = random_member(list(base_data.tags.by_name))
+    async with filling._cache_lock:  # as held by write()
+        fill = asyncio.ensure_future(filling.atagged_objects(name))
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert name not in filling.tags.by_meta
+    assert set(await fill) == set(async_state.tagged_objects(name))
+
 def run_state_tests():
 
     check_persisted()  # check newly created state was properly persisted
+    check_is_persisted()  # uncached objects count as persisted only if in the database
     check_fetches() # check what is in database against what is put in state when fetched
+    check_snapshot()  # warm state restored from a snapshot matches the database
+    check_instrumentation()  # database calls are attributed to state operations
+    check_change_many()  # duplicate and cancelled association changes are not written
+    check_batched_loads()  # many objects load with one query per kind, objects too if batched
+    check_compact_sets()  # OidSet backed association caches hold the same data
+    check_lazy_assocs()  # association member sets are fetched only when read
+    check_delta_sets()  # membership changes do not fetch the member set
+    check_graph()  # traversals agree with the cached relationships
+    check_thread_safe()  # the locked state holds the same data
+    check_group_renames()  # renaming a containing group drops its cached member sets
+    check_group_commits()  # commits refresh the cached sets of groups above changed ones
+    check_nested_edits()  # in place changes of nested values are committed
+    check_shared_meta()  # states share frozen metadata and copy only what they change
+    check_bookmark_import()  # batched imports do not keep what they committed
+    check_query()  # boolean queries agree with the cached membership sets
+    check_saved_queries()  # saved query results are dropped only by changes they read
     check_associate()  # create more objects and associations and check correctness
     check_disassociate()  # remove some associations and check correctness
+    check_pushes()  # commits write only the changed items
+    check_change_tracking()  # only written objects show up as changed
+    check_cache_limits()  # bounded caches evict clean entries only
     check_mods()  # modify some objects, persist, and check correctness
+    check_back_refs()  # back references find every cached entry holding an oid
     check_deletes() # delete some objects and check correct propagation in state and database
 
 
+def test_json_bookmarks():
+    leaf = lambda title, uri: dict(title=title, typeCode=1, uri=uri, dateAdded=1600000000000000)
+    tree = dict(title='', children=[
+        dict(title='Menu', children=[leaf('a', 'https://a.org'),
+                                     dict(title='Imported Chrome', children=[leaf('b', 'https://b.org')]),
+                                     dict(title='Sub', children=[leaf('c', 'https://c.org')])])])
+    found = list(iter_json_bookmarks(io.StringIO(json.dumps(tree)), chunk_size=5))
+    assert [(r.path, r.url) for r in found] == [(('Menu',), 'https://a.org'),
+                                                (('Menu', 'Sub'), 'https://c.org')]
+    assert found[0].add_date == 1600000000
+
+
+def test_html_bookmarks():
+    page = '''<H1>Bookmarks</H1><DL><p>
+        <DT><H3>Bar</H3><DL><p>
+            <DT><A HREF="https://a.org" ADD_DATE="1600000000" TAGS="x,y">A &amp; B</A>
+        </DL><p>
+        <DT><A HREF="https://b.org">B</A>
+    </DL>'''
+    found = list(iter_html_bookmarks(io.StringIO(page), chunk_size=5))
+    assert [(r.path, r.url, r.title) for r in found] == [(('Bar',), 'https://a.org', 'A & B'),
+                                                         ((), 'https://b.org', 'B')]
+    assert found[0].tags == ['x', 'y'] and found[0].add_date == 1600000000
+
+
+def test_url_index():
+    assert normalize_url('HTTPS://Example.com:443/a/?utm_source=x&b=1#top') == \
+        'https://example.com/a?b=1'
+    index = UrlIndex(capacity=100)
+    index.update(['https://a.org/x', 'https://b.org'])
+    assert 'https://A.org/x/' in index
+    assert index.add('https://c.org')
+    assert not index.add('https://c.org/?fbclid=1')
+    assert 'https://d.org' not in index
+    primed = UrlIndex(capacity=100)
+    primed.prime(iter([dict(url='https://a.org/?utm_source=x'), dict(url=None)]),
+                 lambda obj: obj['url'])
+    assert 'https://a.org' in primed and len(primed) == 1
+
+
+def test_meta_mappings():
+    role = lambda mid, name, reverse: dicts.DictObject(id=mid, name=name, reverse_name=reverse)
+    mappings = state.MetaMappings([role('r1', 'parent', 'child'), role('r2', 'likes', None)])
+    assert mappings.reverse_map == {'child': mappings.id_map['r1']}
+    assert mappings.is_reverse == {'parent': False, 'child': True, 'likes': False}
+    assert mappings.forward_meta('child') is mappings.forward_meta('parent')
+    mappings.add_meta(role('r1', 'parent', 'kid'))  # reverse name changed
+    assert set(mappings.reverse_map) == {'kid'} and 'child' not in mappings.is_reverse
+    assert mappings.forward_meta('kid')['reverse_name'] == 'kid'
+    mappings.remove_meta(mappings.id_map['r1'])
+    assert not mappings.reverse_map and mappings.is_reverse == {'likes': False}
+    assert mappings.forward_meta('kid') is None
+
+
+def test_group_hierarchy():
+    groups = state.CachedByNameId()
+    contained = dict(a=[], b=['a'], c=['b'], d=[], e=[], f=['e'])
+    groups.add_originals({n: dict(id=n, name=n, kind='groups', contained_in=parents)
+                          for n, parents in contained.items()})
+    hierarchy = state.GroupHierarchy(groups)
+    assert hierarchy.descendant_names('a') == {'b', 'c'}
+    assert hierarchy.ancestor_names('c') == {'a', 'b'}
+    assert hierarchy.descendant_names('e') == {'f'}
+    groups.modifiable('c')['contained_in'] = ['d']  # relinked through the watcher
+    assert hierarchy.descendant_names('a') == {'b'}
+    assert hierarchy.descendant_names('d') == {'c'}
+    assert hierarchy.ancestor_names('c') == {'d'}
+    assert 'e' in hierarchy._descendants  # closures not through c are kept
+    groups.modifiable('b')['name'] = 'bb'
+    assert hierarchy.descendant_names('a') == {'bb'}
+    assert hierarchy.descendants('a') == {'b'}  # ids
+    groups.clear()
+    assert hierarchy.descendant_names('a') == set()
+
+
+def test_delta_set_fills():
+    class Interleaved(set):
+        "base whose update lets a competing fill, as of another thread, run first"
+        def __ior__(self, other):
+            members.fill({1, 2, 3})
+            return super().__ior__(other)
+    members = DeltaSet(lambda: {1, 2, 3})
+    members.add(4)
+    members.discard(1)
+    members.fill(Interleaved({1, 2, 3}))
+    assert set(members) == {2, 3, 4} and 4 in members and 1 not in members
+    assert members.known() == {2, 3, 4}
+
+def test_read_through_cache():
+    loads = []
+    data = {1: 'one', 2: 'two'}
+    def batch(keys):
+        loads.append(keys)
+        return {k: data[k] for k in keys if k in data}
+    cache = ReadThroughCache(data.get, batch, limits=CacheLimits(max_entries=3), negative_ttl=60)
+    assert cache.get_many([1, 2, 3]) == {1: 'one', 2: 'two'}
+    assert cache.get_many([1, 3]) == {1: 'one'}  # 3 is a cached miss
+    assert loads == [[1, 2, 3]]
+    cache.get(4)
+    assert cache.stats()['evictions'] == 1
+
+
 async def test_with_sqlite():
     register_adaptor(adaptor.AlchemyDatabase, 'sqlite')
     dc = await direct.DirectConnection.get_connection('sqlite', db_name)
     set_connection(dc)
-    run_state_tests()
\ No newline at end of file
+    run_state_tests()
+    await check_async_fetches()
+
+
+async def test_bench_smoke():
+    out = os.path.join(tempfile.mkdtemp(), 'bench.json')
+    args = ['--scales', '30', '--sample', '5', '--no-memory', '--output', out,
+            '--db-prefix', f'benchdb_{random.randint(10000, 99999)}']
+    runs = []
+    for _ in range(2):
+        await bench_main(args)
+        with open(out) as f:
+            runs.append(json.load(f))
+    (scale,), (again,) = (run['scales'] for run in runs)
+    assert scale['database'] != again['database']  # each run builds a fresh database
+    assert scale['operations']['load_objects']['db_calls'] == \
+        again['operations']['load_objects']['db_calls']
+    assert scale['dataset']['objects'] == 30
+    ops = scale['operations']
+    assert ops['load_objects']['ops'] == 30
+    assert ops['get_object_and_associations.warm']['db_calls'] == 0  # all cached by the cold pass
+    assert ops['commit']['db_calls'] > 0
@@ -0,0 +1,240 @@
+import functools
+import threading
+from uop.connect.uop_connect import ConnectionWrapper
+from uopclient.state import ClientState, AssociatedTags, AssociatedGroups, Relationships
+from uopclient.utils.lazy import is_pending, materialized
+from uopclient.utils.misc import SingleFlight
+
+
+def locked(fn):
+    "fn run holding the state's lock"
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+class ThreadSafeAssociated:
+    """
+    ObjectAssociated fetches for use from many threads.  Database reads run
+    without holding the state's lock, each key fetched once for all threads
+    wanting it, and the caches are only updated with the lock held.  The
+    thread fetching a key caches it before the others waiting are released,
+    so a miss right after them finds it cached rather than fetching again.
+    """
+
+    def _cached_meta(self, meta_name):
+        return (meta_name in self._by_meta) and not is_pending(self._by_meta[meta_name])
+
+    def _store_meta(self, meta_name, data):
+        with self._state.lock:
+            if not self._cached_meta(meta_name):
+                self._set_meta(meta_name, data)
+        return data
+
+    def _fill_meta(self, meta_name):
+        return self._store_meta(meta_name, self.get_by_meta(meta_name))
+
+    def for_meta(self, meta_name, fn=None):
+        state = self._state
+        with state.lock:
+            if self._cached_meta(meta_name):
+                return super().for_meta(meta_name, fn)
+        if fn is None:
+            data = state.single_flight(('meta', self._kind, meta_name), self._fill_meta, meta_name)
+        else:
+            data = fn(meta_name)
+        self._store_meta(meta_name, data)  # the flight may have been a DeltaSet's base fetch
+        with state.lock:
+            return super().for_meta(meta_name, fn)
+
+    def _fetch_base(self, name):
+        "base of the DeltaSet of name, which is filled under the lock before it is returned"
+        data = self._state.single_flight(('meta', self._kind, name), self.get_by_meta, name)
+        with self._state.lock:
+            base = super()._fetch_base(name, data)
+            pending = self._by_meta.get(name)
+            if is_pending(pending):
+                pending.fill(base)
+            return base
+
+    def for_object(self, object_id):
+        state = self._state
+        with state.lock:
+            if object_id in self._by_object:
+                return super().for_object(object_id)
+        if not self.object_persisted(object_id):  # may read the object, so not under the lock
+            with state.lock:
+                return super().for_object(object_id)
+        state.single_flight(('object', self._kind, object_id), self._fill_object, object_id)
+        with state.lock:
+            return super().for_object(object_id)
+
+    def _fill_object(self, object_id):
+        found = self.db_object_associated(object_id)
+        with self._state.lock:
+            if object_id not in self._by_object:
+                self._set_object(object_id, self.object_entry(object_id, found))
+
+    def load_objects(self, oids, persisted=False):
+        state = self._state
+        with state.lock:
+            wanted = [oid for oid in oids if oid not in self._by_object]
+        if wanted and not persisted:
+            wanted = state.persisted_objects(wanted)
+        if not wanted:
+            return
+        found = self.db_objects_associated(wanted)
+        with state.lock:
+            for oid in wanted:
+                if oid not in self._by_object:
+                    self._set_object(oid, self.object_entry(oid, found.get(oid, ())))
+
+    def load_metas(self, names):
+        state = self._state
+        with state.lock:
+            missing = [n for n in dict.fromkeys(names)
+                       if self.get_meta(n) and not self._cached_meta(n)]
+        if not missing:
+            return
+        found = self.db_metas_associated(missing)
+        with state.lock:
+            for name, members in found.items():
+                if not self._cached_meta(name):
+                    self._set_meta(name, members)
+
+
+class ThreadSafeTags(ThreadSafeAssociated, AssociatedTags):
+    pass
+
+
+class ThreadSafeGroups(ThreadSafeAssociated, AssociatedGroups):
+    pass
+
+
+class ThreadSafeRelationships(ThreadSafeAssociated, Relationships):
+
+    def related_to(self, name, subject):
+        state = self._state
+        with state.lock:
+            if subject in self._by_meta[name]:
+                return self._by_meta[name][subject]
+        state.single_flight(('related', name, subject), self._fill_related, name, subject)
+        with state.lock:
+            return super().related_to(name, subject)
+
+    def _fill_related(self, name, subject):
+        data = self.get_by_meta(name, subject)
+        with self._state.lock:
+            named = self._by_meta[name]
+            if subject not in named:
+                named[subject] = data
+                self._ref(subject, name, subject)
+                for related in data:
+                    self._ref(related, name, subject)
+
+
+class ThreadSafeClientState(ClientState):
+    """
+    ClientState that threads, e.g. those of a WSGI server, can share.
+    Cache hits are served under a short lock; on misses the database is
+    read without holding it and concurrent misses on the same key share one
+    fetch.  Writes and transactions hold the lock throughout so they are
+    serialized and never interleave with cache fills.
+    Member sets and association mappings handed out are the live cached
+    ones: hold state.lock while iterating them if other threads may write.
+    tagged_objects and friends return copies.
+    """
+    tags_class = ThreadSafeTags
+    groups_class = ThreadSafeGroups
+    roles_class = ThreadSafeRelationships
+
+    def __init__(self, connect: ConnectionWrapper, **kwargs):
+        self.lock = threading.RLock()
+        self._flights = SingleFlight()
+        super().__init__(connect, **kwargs)
+
+    def single_flight(self, key, fn, *args):
+        "fn(*args) run once for all threads concurrently asking for key"
+        return self._flights.run(key, fn, *args)
+
+    def get_object(self, oid):
+        with self.lock:
+            if self._objects.get(oid):
+                return super().get_object(oid)
+        data = self.single_flight(('objects', oid), self._fill_object, oid)
+        with self.lock:
+            self.count_cache('objects', misses=1)
+            return self._objects.get(oid) or data
+
+    def _fill_object(self, oid):
+        data = self._connect.get_object(oid)
+        with self.lock:
+            if data and (oid not in self._objects):
+                self._cache_object(oid, data)
+        return data
+
+    def prefetch_objects(self, oids):
+        with self.lock:
+            wanted = dict.fromkeys(oids)
+            missing = [oid for oid in wanted if oid not in self._objects]
+            self.count_cache('objects', len(wanted) - len(missing), len(missing))
+        if not missing:
+            return
+        loaded = self.read_objects(missing)
+        for assoc in (self.tags, self.groups, self.roles):
+            assoc.load_objects(loaded, persisted=True)
+
+    def read_objects(self, oids):
+        objects = self.db_get_objects(oids)
+        loaded = []
+        with self.lock:
+            for obj in objects:
+                if obj:
+                    if obj['id'] not in self._objects:
+                        self._cache_object(obj['id'], obj)
+                    loaded.append(obj['id'])
+        return loaded
+
+    def persisted_objects(self, oids):
+        with self.lock:
+            uncached = [oid for oid in dict.fromkeys(oids) if oid not in self._objects]
+        found = set(self.read_objects(uncached)) if uncached else set()
+        with self.lock:
+            return [oid for oid in oids if (oid in found) or self._objects.is_original(oid)]
+
+    def _associated_objects(self, assoc, name):
+        members = assoc.for_meta(name)
+        with self.lock:
+            return set(materialized(members))
+
+    add_meta = locked(ClientState.add_meta)
+    delete_meta = locked(ClientState.delete_meta)
+    delete_object = locked(ClientState.delete_object)
+    begin_transaction = locked(ClientState.begin_transaction)
+    abort = locked(ClientState.abort)
+    push_mods = locked(ClientState.push_mods)
+    commit = locked(ClientState.commit)
+    add_object = locked(ClientState.add_object)
+    create_class_instance = locked(ClientState.create_class_instance)
+    tag = locked(ClientState.tag)
+    untag = locked(ClientState.untag)
+    group = locked(ClientState.group)
+    ungroup = locked(ClientState.ungroup)
+    relate = locked(ClientState.relate)
+    unrelate = locked(ClientState.unrelate)
+    change_assocs = locked(ClientState.change_assocs)
+    tag_many = locked(ClientState.tag_many)
+    untag_many = locked(ClientState.untag_many)
+    group_many = locked(ClientState.group_many)
+    ungroup_many = locked(ClientState.ungroup_many)
+    relate_many = locked(ClientState.relate_many)
+    unrelate_many = locked(ClientState.unrelate_many)
+    neighborhood = locked(ClientState.neighborhood)
+    shortest_path = locked(ClientState.shortest_path)
+    walk = locked(ClientState.walk)
+    new_query = locked(ClientState.new_query)
+    save_query = locked(ClientState.save_query)
+    delete_query = locked(ClientState.delete_query)
+    run_query = locked(ClientState.run_query)
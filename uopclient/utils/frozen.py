@@ -0,0 +1,54 @@
+"immutable copies of meta items that processes can share"
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError('shared metadata is read only, use modifiable(id) for a writable copy')
+
+
+class FrozenItem(dict):
+    "immutable meta item, nested values frozen too; attributes read its keys"
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __setattr__ = __delattr__ = _read_only
+    __ior__ = update = pop = popitem = setdefault = clear = _read_only
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __reduce__(self):
+        return FrozenItem, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def thaw(self):
+        "writable deep copy as plain dicts and lists"
+        return thaw(self)
+
+
+def freeze(value):
+    if isinstance(value, FrozenItem):
+        return value
+    if isinstance(value, dict):
+        return FrozenItem((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def thaw(value):
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    if isinstance(value, frozenset):
+        return set(value)
+    return value
@@ -0,0 +1,115 @@
+"""
+Incremental JSON parsing: a document is read from a text file a chunk at
+a time and reported as (event, value) pairs, so arbitrarily large
+documents are processed in memory bounded by the chunk size and the
+largest single string in them.
+"""
+from json import JSONDecodeError
+from json.decoder import scanstring
+import re
+
+START_MAP = 'start_map'
+END_MAP = 'end_map'
+START_ARRAY = 'start_array'
+END_ARRAY = 'end_array'
+KEY = 'key'
+VALUE = 'value'
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?')
+LITERALS = {'true': True, 'false': False, 'null': None}
+LONGEST_LITERAL = max(len(lit) for lit in LITERALS)
+
+
+class _Buffer:
+    "text of f still to be tokenized, read a chunk at a time"
+
+    def __init__(self, f, chunk_size):
+        self._file = f
+        self._chunk_size = chunk_size
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        "append the next chunk, False at the end of the file"
+        if self.eof:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return bool(chunk)
+
+
+def _tokens(f, chunk_size):
+    "(kind, value): kind a structural character, '\"' for strings or 'v' for scalars"
+    buf = _Buffer(f, chunk_size)
+    while True:
+        buf.pos = WHITESPACE.match(buf.text, buf.pos).end()
+        if buf.pos == len(buf.text):
+            if buf.more():
+                continue
+            return
+        text, pos = buf.text, buf.pos
+        char = text[pos]
+        if char in '{}[],:':
+            buf.pos += 1
+            yield char, None
+        elif char == '"':
+            try:
+                value, end = scanstring(text, pos + 1)
+            except JSONDecodeError:
+                if buf.more():
+                    continue  # string runs past the buffer
+                raise
+            buf.pos = end
+            yield char, value
+        elif (len(text) - pos < LONGEST_LITERAL + 1) and buf.more():
+            continue
+        elif text.startswith(('true', 'false', 'null'), pos):
+            literal = next(lit for lit in LITERALS if text.startswith(lit, pos))
+            buf.pos += len(literal)
+            yield 'v', LITERALS[literal]
+        else:
+            match = NUMBER.match(text, pos)
+            end = match.end() if match else pos
+            if ((end == len(text)) or (text[end] in '.eE+-')) and buf.more():
+                continue  # number may continue in the next chunk
+            if not match:
+                raise JSONDecodeError('unexpected character', text, pos)
+            number = match.group()
+            buf.pos = match.end()
+            is_float = match.group(1) or match.group(2)
+            yield 'v', float(number) if is_float else int(number)
+
+
+def iter_events(f, chunk_size=1 << 16):
+    """
+    (event, value) pairs for the JSON document in text file f: START_MAP,
+    END_MAP, START_ARRAY and END_ARRAY with value None, KEY with the key
+    and VALUE with each scalar value.
+    """
+    containers = []
+    want_key = False
+    for kind, value in _tokens(f, chunk_size):
+        if kind == '{':
+            containers.append(kind)
+            want_key = True
+            yield START_MAP, None
+        elif kind == '[':
+            containers.append(kind)
+            yield START_ARRAY, None
+        elif kind in '}]':
+            containers.pop()
+            want_key = False
+            yield (END_MAP if kind == '}' else END_ARRAY), None
+        elif kind == ',':
+            want_key = bool(containers) and (containers[-1] == '{')
+        elif kind == ':':
+            continue
+        elif want_key:
+            want_key = False
+            yield KEY, value
+        else:
+            yield VALUE, value
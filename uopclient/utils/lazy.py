@@ -0,0 +1,202 @@
+from collections.abc import MutableMapping, MutableSet
+import sys
+
+_UNLOADED = object()
+
+
+class LazyAssocs(MutableMapping):
+    """
+    An object's association name -> associated oids mapping that knows its
+    names up front and computes each name's oids, with
+    assoc.member_value(owner, name), only when that name is read.
+    """
+    __slots__ = ('_assoc', '_owner', '_values')
+
+    def __init__(self, assoc, owner, names=(), loaded=None):
+        self._assoc = assoc
+        self._owner = owner
+        self._values = dict.fromkeys(names, _UNLOADED)
+        if loaded:
+            self._values.update(loaded)
+
+    def bind(self, assoc):
+        self._assoc = assoc
+
+    def __getitem__(self, name):
+        value = self._values[name]
+        if value is _UNLOADED:
+            value = self._values[name] = self._assoc.member_value(self._owner, name)
+        return value
+
+    def __setitem__(self, name, value):
+        self._values[name] = value
+
+    def __delitem__(self, name):
+        del self._values[name]
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def pop(self, name, *default):
+        "remove name without computing its value, popping default or None if it was not computed"
+        if name not in self._values:
+            if default:
+                return default[0]
+            raise KeyError(name)
+        value = self._values.pop(name)
+        if value is _UNLOADED:
+            return default[0] if default else None
+        return value
+
+    def add_name(self, name):
+        "name is associated, its oids computed when read"
+        self._values.setdefault(name, _UNLOADED)
+
+    def unload(self, name):
+        "forget the computed value of name, computed again when next read"
+        if name in self._values:
+            self._values[name] = _UNLOADED
+
+    def peek(self, name, default=None):
+        "value of name if already computed, else default"
+        value = self._values.get(name, default)
+        return default if value is _UNLOADED else value
+
+    def loaded(self):
+        return {k: v for k, v in self._values.items() if v is not _UNLOADED}
+
+    def __sizeof__(self):
+        "size including names and the values computed so far"
+        return object.__sizeof__(self) + sys.getsizeof(self._values) + sum(
+            sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.loaded().items())
+
+    def __reduce__(self):
+        settled = {k: v for k, v in self.loaded().items() if not is_pending(v)}
+        return LazyAssocs, (None, self._owner, list(self._values), settled)
+
+    def __repr__(self):
+        shown = {k: ('...' if v is _UNLOADED else v) for k, v in self._values.items()}
+        return f'LazyAssocs({self._owner!r}, {shown!r})'
+
+
+def peek(mapping, name, default=None):
+    "mapping[name] without computing a lazy value"
+    if isinstance(mapping, LazyAssocs):
+        return mapping.peek(name, default)
+    return mapping.get(name, default)
+
+
+def _loaded_set(members):
+    return members
+
+
+class DeltaSet(MutableSet):
+    """
+    Member set whose base is fetched, with load(), only when it is
+    enumerated.  Until then adds and discards are kept as an overlay so
+    changing membership of a large set costs nothing to fetch.
+    """
+    __slots__ = ('_load', '_base', '_added', '_removed')
+
+    def __init__(self, load):
+        self._load = load
+        self._base = None
+        self._added = set()
+        self._removed = set()
+
+    @property
+    def loaded(self):
+        return self._base is not None
+
+    def fill(self, base):
+        """
+        Use base as the fetched members, applying the overlay to it.  The
+        completed set is swapped in whole and the overlay only dropped after,
+        so a reader or another fill racing this one never sees it half done.
+        """
+        added, removed = self._added, self._removed
+        if (self._base is None) and (added is not None):
+            base |= added
+            base -= removed
+            self._base = base
+            self._added = self._removed = None
+            self._load = None
+
+    def members(self):
+        "the full member set, fetched if need be"
+        if self._base is None:
+            self.fill(self._load())
+        return self._base
+
+    def known(self):
+        "members seen without fetching: the base if loaded, else the adds"
+        added = self._added
+        return added if self._base is None else self._base
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return set(it)
+
+    def __contains__(self, oid):
+        added, removed = self._added, self._removed
+        base = self._base
+        if base is not None:
+            return oid in base
+        if oid in added:
+            return True
+        if oid in removed:
+            return False
+        return oid in self.members()
+
+    def __iter__(self):
+        return iter(self.members())
+
+    def __len__(self):
+        return len(self.members())
+
+    def add(self, oid):
+        if self._base is not None:
+            self._base.add(oid)
+        else:
+            self._added.add(oid)
+            self._removed.discard(oid)
+
+    def discard(self, oid):
+        if self._base is not None:
+            self._base.discard(oid)
+        else:
+            self._removed.add(oid)
+            self._added.discard(oid)
+
+    def copy(self):
+        return self.members().copy()
+
+    def __sizeof__(self):
+        if self._base is not None:
+            return object.__sizeof__(self) + sys.getsizeof(self._base)
+        return object.__sizeof__(self) + sys.getsizeof(self._added) + \
+            sys.getsizeof(self._removed)
+
+    def __reduce__(self):
+        return _loaded_set, (self.members(),)
+
+    def __repr__(self):
+        if self._base is not None:
+            return f'DeltaSet({self._base!r})'
+        return f'DeltaSet(+{self._added!r}, -{self._removed!r})'
+
+
+def materialized(members):
+    "members as a plain set, fetching a DeltaSet's base if need be"
+    return members.members() if isinstance(members, DeltaSet) else members
+
+
+def is_pending(members):
+    "whether members is a DeltaSet whose base is not fetched yet"
+    return isinstance(members, DeltaSet) and not members.loaded
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+import sys
+
+
+def estimate_size(value):
+    "rough in memory size of value, counting one level of contents"
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += sys.getsizeof(k) + sys.getsizeof(v)
+    return size
+
+
+class CacheLimits:
+    """
+    Capacity of a cache as a number of entries and/or estimated bytes.
+    None for either means that measure is unbounded.
+    """
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    @property
+    def bounded(self):
+        return (self.max_entries is not None) or (self.max_bytes is not None)
+
+    def as_dict(self):
+        return dict(max_entries=self.max_entries, max_bytes=self.max_bytes)
+
+
+class LRUIndex:
+    """
+    Recency order and estimated sizes for the keys of a cache owned by
+    someone else.  Once the limits are exceeded the least recently used keys
+    that can_evict(key) allows are passed to evict(key); the rest are kept
+    and moved to the recent end.  The key being touched is never evicted
+    by its own admission.  Does nothing when limits are unbounded.
+    """
+
+    def __init__(self, limits, evict, can_evict=None, sizer=estimate_size):
+        self._limits = limits or CacheLimits()
+        self._evict = evict
+        self._can_evict = can_evict or (lambda key: True)
+        self._sizer = sizer
+        self._order = OrderedDict()  # key -> estimated size
+        self.bytes = 0
+        self.evictions = 0
+
+    @property
+    def active(self):
+        return self._limits.bounded
+
+    def touch(self, key, value=None):
+        "key was used; value is given when it is new or may have grown"
+        if not self.active:
+            return
+        order = self._order
+        if key in order:
+            order.move_to_end(key)
+            if (value is None) or (self._limits.max_bytes is None):
+                return
+            self.bytes -= order[key]
+        size = self._sizer(value) if self._limits.max_bytes is not None else 0
+        order[key] = size
+        self.bytes += size
+        self.enforce(keep=key)
+
+    def discard(self, key):
+        size = self._order.pop(key, None)
+        if size:
+            self.bytes -= size
+
+    def _over(self):
+        limits = self._limits
+        return ((limits.max_entries is not None) and (len(self._order) > limits.max_entries)) or \
+            ((limits.max_bytes is not None) and (self.bytes > limits.max_bytes))
+
+    def enforce(self, keep=None):
+        "evict down to the limits, never keep"
+        order = self._order
+        kept = 0
+        while self._over() and (kept < len(order)):
+            key, size = next(iter(order.items()))
+            if (key != keep) and self._can_evict(key):
+                order.popitem(last=False)
+                self.bytes -= size
+                self.evictions += 1
+                self._evict(key)
+            else:
+                order.move_to_end(key)
+                kept += 1
+
+    def clear(self):
+        self._order.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return dict(entries=len(self._order), bytes=self.bytes,
+                    evictions=self.evictions, **self._limits.as_dict())
@@ -1,23 +1,252 @@
+from uopclient.utils.lru import CacheLimits, LRUIndex
+import threading
+import time
+
+_ABSENT = object()  # nothing cached for the key
+_NEGATIVE = object()  # key cached as known to be missing
+
+
 def values_from_keys(a_dict):
     return lambda keys: [a_dict[k] for k in keys]
 
-def get_by_id(source, db_fun):
-    def inner(_id):
-        if id not in source:
-            thing = db_fun(id)
-            if thing:
-                source[id] = thing
-        return source.get(id)
-    return inner
-
-class db_hash_get:
-    def __init__(self, source_dict, db_getter):
-        self._source = source_dict
-        self._getter = db_getter
+
+class _Flight:
+    "a load in progress that other callers wanting the same key wait on"
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    "runs fn once for all threads concurrently asking for the same key"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight
+
+    def run(self, key, fn, *args):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            return flight.result()
+        try:
+            flight.value = fn(*args)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+    def __len__(self):
+        return len(self._flights)
+
+
+class ReadThroughCache:
+    """
+    Values by key loaded with loader(key) on a miss and kept for ttl
+    seconds, the least recently used dropped beyond limits.  Misses, values
+    is_missing accepts, are remembered for negative_ttl seconds so repeated
+    lookups of absent keys do not reach the database.  Concurrent loads of
+    a key, from any thread, share one loader call.
+    """
+
+    def __init__(self, loader, batch_loader=None, limits: CacheLimits = None, ttl=None,
+                 negative_ttl=None, is_missing=None, store=None, clock=time.monotonic):
+        """
+        :param batch_loader: keys -> mapping of the found keys to their
+        values, used by get_many
+        :param is_missing: value -> whether it means the key was not found,
+        default value is None
+        :param store: dict to keep the values in
+        """
+        self._loader = loader
+        self._batch_loader = batch_loader
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._is_missing = is_missing or (lambda value: value is None)
+        self._values = {} if store is None else store
+        self._expires = {}  # key -> deadline of the value or negative entry
+        self._negative = set()
+        self._lru = LRUIndex(limits, self._drop)
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._loading = {}  # key -> _Flight
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    def _drop(self, key):
+        self._values.pop(key, None)
+        self._expires.pop(key, None)
+        self._negative.discard(key)
+
+    def _lookup(self, key):
+        "cached value, _NEGATIVE or _ABSENT; call with the lock held"
+        deadline = self._expires.get(key)
+        if (deadline is not None) and (deadline <= self._clock()):
+            self.invalidate(key)
+            return _ABSENT
+        if key in self._negative:
+            return _NEGATIVE
+        value = self._values.get(key, _ABSENT)
+        if value is not _ABSENT:
+            self._lru.touch(key)
+        return value
+
+    def _store(self, key, value):
+        "remember a loaded value; call with the lock held"
+        if self._is_missing(value):
+            if not self._negative_ttl:
+                return
+            self._values.pop(key, None)
+            self._negative.add(key)
+            self._expires[key] = self._clock() + self._negative_ttl
+        else:
+            self._negative.discard(key)
+            self._values[key] = value
+            if self._ttl:
+                self._expires[key] = self._clock() + self._ttl
+            else:
+                self._expires.pop(key, None)
+        self._lru.touch(key, value)
+
+    def _claim(self, keys):
+        """
+        Split keys, none cached, into flights this caller must load and
+        flights already in progress; call with the lock held.
+        """
+        mine, theirs = {}, {}
+        for key in keys:
+            flight = self._loading.get(key)
+            if flight is None:
+                mine[key] = self._loading[key] = _Flight()
+            else:
+                theirs[key] = flight
+        return mine, theirs
+
+    def _land(self, flights, found=None, error=None):
+        "finish flights with values from found or error"
+        with self._lock:
+            for key, flight in flights.items():
+                if error is not None:
+                    flight.error = error
+                else:
+                    flight.value = found.get(key)
+                    self._store(key, flight.value)
+                del self._loading[key]
+        for flight in flights.values():
+            flight.done.set()
+
+    def _answer(self, value, default):
+        return default if (value is _NEGATIVE) or self._is_missing(value) else value
+
+    def get(self, key, default=None):
+        with self._lock:
+            found = self._lookup(key)
+            if found is not _ABSENT:
+                self.hits += 1
+                return self._answer(found, default)
+            self.misses += 1
+            mine, theirs = self._claim([key])
+        if theirs:
+            return self._answer(theirs[key].result(), default)
+        try:
+            self.loads += 1
+            value = self._loader(key)
+        except BaseException as e:
+            self._land(mine, error=e)
+            raise
+        self._land(mine, {key: value})
+        return self._answer(value, default)
+
+    def get_many(self, keys):
+        """
+        key -> value for those of keys that are found, loading all uncached
+        keys with one batch_loader call, or one loader call each without
+        a batch_loader.
+        """
+        keys = list(dict.fromkeys(keys))
+        if self._batch_loader is None:
+            return {k: v for k, v in ((k, self.get(k, _ABSENT)) for k in keys) if v is not _ABSENT}
+        res = {}
+        with self._lock:
+            wanted = []
+            for key in keys:
+                found = self._lookup(key)
+                if found is _ABSENT:
+                    wanted.append(key)
+                elif found is not _NEGATIVE:
+                    res[key] = found
+            self.hits += len(keys) - len(wanted)
+            self.misses += len(wanted)
+            mine, theirs = self._claim(wanted)
+        if mine:
+            try:
+                self.loads += 1
+                found = dict(self._batch_loader(list(mine)))
+            except BaseException as e:
+                self._land(mine, error=e)
+                raise
+            self._land(mine, found)
+            res.update((k, v) for k, v in found.items() if not self._is_missing(v))
+        for key, flight in theirs.items():
+            value = flight.result()
+            if not self._is_missing(value):
+                res[key] = value
+        return res
 
     def __call__(self, key):
-        if key not in self._source:
-            value = self._getter(key)
-            if value:
-                self._source[key] = value
-        return self._source.get(key)
\ No newline at end of file
+        return self.get(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            found = self._lookup(key)
+        return (found is not _ABSENT) and (found is not _NEGATIVE)
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._lru.discard(key)
+            self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._expires.clear()
+            self._negative.clear()
+            self._lru.clear()
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, loads=self.loads,
+                    negative=len(self._negative), **self._lru.stats())
+
+
+def get_by_id(source, db_fun):
+    "function reading ids through source, a dict, from db_fun"
+    return ReadThroughCache(db_fun, store=source, is_missing=lambda thing: not thing)
+
+
+class db_hash_get(ReadThroughCache):
+    "source_dict read through from db_getter, caching found values only"
+
+    def __init__(self, source_dict, db_getter, **kwargs):
+        kwargs.setdefault('is_missing', lambda value: not value)
+        super().__init__(db_getter, store=source_dict, **kwargs)
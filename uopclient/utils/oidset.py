@@ -0,0 +1,287 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableSet
+import sys
+
+CHUNK_BITS = 16
+LOW_MASK = (1 << CHUNK_BITS) - 1
+ARRAY_MAX = 4096  # members above which a chunk is stored as a bitmap
+BITMAP_BYTES = (1 << CHUNK_BITS) // 8
+
+
+class OidInterner:
+    "dense int for each oid seen, in order of first use"
+
+    def __init__(self):
+        self._ids = {}
+        self._oids = []
+
+    def intern(self, oid):
+        an_int = self._ids.get(oid)
+        if an_int is None:
+            an_int = self._ids[oid] = len(self._oids)
+            self._oids.append(oid)
+        return an_int
+
+    def lookup(self, oid):
+        "int of oid or None if oid was never interned"
+        return self._ids.get(oid)
+
+    def oid(self, an_int):
+        return self._oids[an_int]
+
+    def __len__(self):
+        return len(self._oids)
+
+
+class _Bitmap:
+    __slots__ = ('bits', 'count')
+
+    def __init__(self, bits=None, count=0):
+        self.bits = bits if bits is not None else bytearray(BITMAP_BYTES)
+        self.count = count
+
+    def __contains__(self, low):
+        return (self.bits[low >> 3] >> (low & 7)) & 1
+
+    def __iter__(self):
+        for pos, byte in enumerate(self.bits):
+            if byte:
+                base = pos << 3
+                for bit in range(8):
+                    if (byte >> bit) & 1:
+                        yield base + bit
+
+    def __len__(self):
+        return self.count
+
+    def add(self, low):
+        if low not in self:
+            self.bits[low >> 3] |= 1 << (low & 7)
+            self.count += 1
+            return True
+        return False
+
+    def discard(self, low):
+        if low in self:
+            self.bits[low >> 3] &= ~(1 << (low & 7)) & 0xFF
+            self.count -= 1
+            return True
+        return False
+
+    def copy(self):
+        return _Bitmap(bytearray(self.bits), self.count)
+
+    def as_int(self):
+        return int.from_bytes(self.bits, 'little')
+
+    @classmethod
+    def from_int(cls, value):
+        return cls(bytearray(value.to_bytes(BITMAP_BYTES, 'little')), value.bit_count())
+
+
+def _has(chunk, low):
+    if isinstance(chunk, _Bitmap):
+        return low in chunk
+    at = bisect_left(chunk, low)
+    return (at < len(chunk)) and (chunk[at] == low)
+
+
+def _make_chunk(lows):
+    "smallest container for the sorted distinct lows, None if empty"
+    if not lows:
+        return None
+    if len(lows) <= ARRAY_MAX:
+        return array('H', lows)
+    res = _Bitmap()
+    for low in lows:
+        res.add(low)
+    return res
+
+
+def _copy(chunk):
+    return chunk.copy() if isinstance(chunk, _Bitmap) else chunk[:]
+
+
+def _as_int(chunk):
+    if isinstance(chunk, _Bitmap):
+        return chunk.as_int()
+    return _make_bitmap(chunk).as_int()
+
+
+def _make_bitmap(lows):
+    res = _Bitmap()
+    for low in lows:
+        res.add(low)
+    return res
+
+
+def _from_int(value):
+    if value.bit_count() > ARRAY_MAX:
+        return _Bitmap.from_int(value)
+    return _make_chunk(list(_Bitmap.from_int(value))) if value else None
+
+
+class OidSet(MutableSet):
+    """
+    Set of oids stored as dense ints from an OidInterner in chunks of 2**16
+    values, each a sorted array of 16 bit values or a bitmap once it holds
+    more than ARRAY_MAX members (roaring bitmap layout).  Uses a few bytes
+    per member instead of a set's tens and copies as memory blocks.
+    Operations between OidSets of the same interner work chunk by chunk.
+    """
+    __slots__ = ('_interner', '_chunks', '_len')
+
+    def __init__(self, interner, oids=()):
+        self._interner = interner
+        self._chunks = {}
+        self._len = 0
+        if isinstance(oids, OidSet) and (oids._interner is interner):
+            self._chunks = {hi: _copy(chunk) for hi, chunk in oids._chunks.items()}
+            self._len = oids._len
+        else:
+            by_chunk = {}
+            for an_int in sorted({interner.intern(oid) for oid in oids}):
+                by_chunk.setdefault(an_int >> CHUNK_BITS, []).append(an_int & LOW_MASK)
+            self._chunks = {hi: _make_chunk(lows) for hi, lows in by_chunk.items()}
+            self._len = sum(len(lows) for lows in by_chunk.values())
+
+    def _add_int(self, hi, low):
+        chunk = self._chunks.get(hi)
+        if chunk is None:
+            self._chunks[hi] = array('H', [low])
+        elif isinstance(chunk, _Bitmap):
+            if not chunk.add(low):
+                return
+        else:
+            at = bisect_left(chunk, low)
+            if (at < len(chunk)) and (chunk[at] == low):
+                return
+            if len(chunk) >= ARRAY_MAX:
+                bitmap = _make_bitmap(chunk)
+                bitmap.add(low)
+                self._chunks[hi] = bitmap
+            else:
+                chunk.insert(at, low)
+        self._len += 1
+
+    def _from_iterable(self, oids):
+        return OidSet(self._interner, oids)
+
+    @property
+    def interner(self):
+        return self._interner
+
+    def __contains__(self, oid):
+        an_int = self._interner.lookup(oid)
+        if an_int is None:
+            return False
+        chunk = self._chunks.get(an_int >> CHUNK_BITS)
+        return (chunk is not None) and bool(_has(chunk, an_int & LOW_MASK))
+
+    def __iter__(self):
+        oid = self._interner.oid
+        for hi in sorted(self._chunks):
+            base = hi << CHUNK_BITS
+            for low in self._chunks[hi]:
+                yield oid(base | low)
+
+    def __len__(self):
+        return self._len
+
+    def __repr__(self):
+        return f'OidSet({set(self)!r})'
+
+    def __sizeof__(self):
+        chunks = (c.bits if isinstance(c, _Bitmap) else c for c in self._chunks.values())
+        return object.__sizeof__(self) + sys.getsizeof(self._chunks) + \
+            sum(sys.getsizeof(c) for c in chunks)
+
+    def add(self, oid):
+        an_int = self._interner.intern(oid)
+        self._add_int(an_int >> CHUNK_BITS, an_int & LOW_MASK)
+
+    def discard(self, oid):
+        an_int = self._interner.lookup(oid)
+        if an_int is None:
+            return
+        hi, low = an_int >> CHUNK_BITS, an_int & LOW_MASK
+        chunk = self._chunks.get(hi)
+        if chunk is None:
+            return
+        if isinstance(chunk, _Bitmap):
+            if not chunk.discard(low):
+                return
+            if chunk.count <= ARRAY_MAX // 2:
+                self._chunks[hi] = array('H', chunk)
+        else:
+            at = bisect_left(chunk, low)
+            if (at == len(chunk)) or (chunk[at] != low):
+                return
+            del chunk[at]
+            if not chunk:
+                del self._chunks[hi]
+        self._len -= 1
+
+    def clear(self):
+        self._chunks.clear()
+        self._len = 0
+
+    def copy(self):
+        return OidSet(self._interner, self)
+
+    def _same(self, other):
+        return isinstance(other, OidSet) and (other._interner is self._interner)
+
+    def _with_chunks(self, chunks):
+        res = OidSet(self._interner)
+        res._chunks = {hi: c for hi, c in chunks.items() if c is not None}
+        res._len = sum(len(c) for c in res._chunks.values())
+        return res
+
+    def __and__(self, other):
+        if not self._same(other):
+            return super().__and__(other)
+        chunks = {}
+        for hi, chunk in self._chunks.items():
+            theirs = other._chunks.get(hi)
+            if theirs is None:
+                continue
+            if isinstance(chunk, _Bitmap) and isinstance(theirs, _Bitmap):
+                chunks[hi] = _from_int(chunk.as_int() & theirs.as_int())
+            else:
+                small, big = (chunk, theirs) if len(chunk) <= len(theirs) else (theirs, chunk)
+                chunks[hi] = _make_chunk([low for low in small if _has(big, low)])
+        return self._with_chunks(chunks)
+
+    def __or__(self, other):
+        if not self._same(other):
+            return super().__or__(other)
+        chunks = {hi: _copy(chunk) for hi, chunk in self._chunks.items()}
+        for hi, theirs in other._chunks.items():
+            mine = chunks.get(hi)
+            if mine is None:
+                chunks[hi] = _copy(theirs)
+            elif isinstance(mine, _Bitmap) or isinstance(theirs, _Bitmap) or \
+                    (len(mine) + len(theirs) > ARRAY_MAX):
+                chunks[hi] = _from_int(_as_int(mine) | _as_int(theirs))
+            else:
+                chunks[hi] = _make_chunk(sorted(set(mine).union(theirs)))
+        return self._with_chunks(chunks)
+
+    def __sub__(self, other):
+        if not self._same(other):
+            return super().__sub__(other)
+        chunks = {}
+        for hi, chunk in self._chunks.items():
+            theirs = other._chunks.get(hi)
+            if theirs is None:
+                chunks[hi] = _copy(chunk)
+            elif isinstance(chunk, _Bitmap) and isinstance(theirs, _Bitmap):
+                chunks[hi] = _from_int(chunk.as_int() & ~theirs.as_int())
+            else:
+                chunks[hi] = _make_chunk([low for low in chunk if not _has(theirs, low)])
+        return self._with_chunks(chunks)
+
+    __rand__ = __and__
+    __ror__ = __or__